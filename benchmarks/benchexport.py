@@ -0,0 +1,330 @@
+"""
+times the spritesheet exporter outside of krita,
+on synthetic animations drawn by the stand-in krita module next to it
+
+for every frame count and frame size (skipping the cases whose frames
+wouldn't fit in --max-bytes), it times each step on its own
+(capturing the frames, assembling the sheet, encoding it as png,
+writing the texture atlas) then whole exports with a few settings
+along with their traces; it also times, in a fresh python,
+how long the plugin takes to load when krita starts
+and to build its dialog the first time it's used,
+and writes everything to a json file, so the results of two versions
+can be compared:
+
+    python benchmarks/benchexport.py --label before
+    python benchmarks/benchexport.py --label after
+    python benchmarks/benchexport.py --compare benchmarks/results/before.json \\
+                                               benchmarks/results/after.json
+
+needs numpy for the assembly and the numpy exports
+(they're skipped without it) and PyQt5, which the exporter imports
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from math import ceil, sqrt
+from pathlib import Path
+
+benchDir = Path(__file__).resolve().parent
+# the stand-in krita module first, then the plugin
+sys.path.insert(0, str(benchDir.parent))
+sys.path.insert(0, str(benchDir))
+
+import krita
+
+from spritesheetExporter import (pixelbuffer, sheetcompositor, spriteframe,
+                                 layoutpacker, pngencoder, encoderpool,
+                                 spritesheetexporter)
+
+
+frameCounts = [10, 100, 1000, 5000]
+frameSizes = [32, 128, 512, 1024]
+
+# whole exports: name -> exporter settings
+exportSettings = {
+    "layers": {},
+    "memory": {"captureInMemory": True},
+    "numpy": {"compositor": "numpy"},
+    "numpy trim maxrects": {"compositor": "numpy", "trim": True,
+                            "packer": "maxrects", "removeDuplicates": True},
+    "numpy 4 workers": {"compositor": "numpy", "encodeWorkers": 4,
+                        "framesInFlight": 16},
+    "numpy png-optimized": {"compositor": "numpy",
+                            "sheetFormat": "png-optimized"},
+    "numpy png-indexed": {"compositor": "numpy", "sheetFormat": "png-indexed"},
+    "numpy low memory": {"compositor": "numpy", "lowMemory": True,
+                         "scratchFrames": True},
+}
+
+
+# what krita does with the plugin at startup (import it, let it add its
+# action), then what the first click on the action does, in a new
+# python so nothing is imported yet; prints the times as json
+startupScript = """
+import json, sys, time
+sys.path[:0] = {paths!r}
+import krita
+start = time.perf_counter()
+before = set(sys.modules)
+import spritesheetExporter
+window = krita.Window()
+for extension in krita.Krita.instance().extensions:
+    extension.createActions(window)
+load = time.perf_counter() - start
+loaded = set(sys.modules) - before
+from PyQt5.QtWidgets import QApplication
+application = QApplication([])
+krita.Krita.instance().setActiveDocument(krita.animatedDocument(32, 32, 2))
+start = time.perf_counter()
+window.actions["pykrita_spritesheetExporter"].trigger()
+dialog = time.perf_counter() - start
+print(json.dumps({{"load": load, "dialog": dialog,
+                  "modules": len(loaded),
+                  "numpy": "numpy" in loaded,
+                  "widgets": "PyQt5.QtWidgets" in loaded}}))
+"""
+
+
+def timeStartup():
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    output = subprocess.check_output(
+        [sys.executable, "-c", startupScript.format(
+            paths=[str(benchDir), str(benchDir.parent)])],
+        env=env, cwd=str(benchDir))
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+# forget the documents and pngs of the last case
+def resetKrita():
+    krita.exported.clear()
+    krita.Krita.instance().documentList.clear()
+
+
+def captureFrames(doc, frames):
+    captured = []
+    for frame in range(frames):
+        doc.setCurrentTime(frame)
+        captured.append(bytes(doc.pixelData(0, 0, doc.width(), doc.height())))
+    return captured
+
+
+def assembleGrid(captured, size):
+    columns = ceil(sqrt(len(captured)))
+    rows = ceil(len(captured) / columns)
+    compositor = sheetcompositor.SheetCompositor(
+        columns * size, rows * size, "U8")
+    for num, data in enumerate(captured):
+        x, y = layoutpacker.gridPosition(num, columns, rows, True, size, size)
+        compositor.blit(pixelbuffer.toArray(data, size, size, "U8"), x, y)
+    return compositor
+
+
+def trimAndPack(captured, size):
+    sprites = []
+    for num, data in enumerate(captured):
+        sprite = spriteframe.SpriteFrame(
+            num, pixelbuffer.toArray(data, size, size, "U8"))
+        sprite.trim()
+        sprites.append(sprite)
+    packer = layoutpacker.MaxRectsPacker()
+    packer.pack([(sprite.width, sprite.height) for sprite in sprites])
+    return sprites
+
+
+def encodeWithPool(compositor, path, workers):
+    pool = encoderpool.EncoderPool(workers)
+    pool.submit(path, pixelbuffer.toBytes(compositor.pixels),
+                compositor.width, compositor.height, "U8")
+    written = pool.wait()
+    pool.close()
+    return written
+
+
+def writeAtlas(sprites, path):
+    atlas = {"frames": [sprite.atlasFrame(True) for sprite in sprites]}
+    with open(str(path), "w") as f:
+        json.dump(atlas, f)
+
+
+def exportDocument(doc, settings, outDir):
+    exporter = spritesheetexporter.SpritesheetExporter()
+    exporter.exportDir = outDir
+    exporter.exportName = "sheet"
+    exporter.writeTextureAtlas = True
+    exporter.traceExport = True
+    for name, value in settings.items():
+        setattr(exporter, name, value)
+    krita.Krita.instance().setActiveDocument(doc)
+    exporter.export()
+    return exporter.trace
+
+
+def runCase(frames, size, exports, workers, outDir):
+    results = []
+
+    def record(step, seconds, **extra):
+        result = {"frames": frames, "size": size,
+                  "step": step, "seconds": seconds}
+        result.update(extra)
+        results.append(result)
+        print("{:>5} frames {:>5}px  {:<28} {:9.3f}s".format(
+            frames, size, step, seconds))
+
+    # every 4th frame held, so there are duplicates to find
+    doc = krita.animatedDocument(size, size, frames, hold=4)
+    seconds, captured = timed(captureFrames, doc, frames)
+    record("capture", seconds)
+
+    if pixelbuffer.available():
+        seconds, compositor = timed(assembleGrid, captured, size)
+        record("assemble grid", seconds)
+        seconds, sprites = timed(trimAndPack, captured, size)
+        record("trim and maxrects", seconds)
+        data = pixelbuffer.toBytes(compositor.pixels)
+        seconds, png = timed(pngencoder.encode, data,
+                             compositor.width, compositor.height, "U8")
+        record("encode", seconds, bytes=len(png))
+        if workers:
+            seconds, written = timed(encodeWithPool, compositor,
+                                     outDir.joinpath("pool.png"), workers)
+            record("encode " + str(workers) + " workers", seconds,
+                   bytes=written)
+        seconds, _ = timed(writeAtlas, sprites, outDir.joinpath("atlas.json"))
+        record("atlas", seconds)
+        compositor = None
+        sprites = None
+    captured = None
+
+    for name in exports:
+        settings = exportSettings[name]
+        if not pixelbuffer.available() and any(
+                key in settings for key in ("compositor", "trim")):
+            continue
+        resetKrita()
+        doc = krita.animatedDocument(size, size, frames, hold=4)
+        seconds, trace = timed(exportDocument, doc, settings, outDir)
+        # and where the export's time went
+        record("export " + name, seconds, stages=trace.totals(),
+               counters=trace.counters)
+    resetKrita()
+    return results
+
+
+def gitVersion():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=str(benchDir), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run(options):
+    outDir = Path(tempfile.mkdtemp(prefix="spritesheetBench"))
+    results = []
+    if options.startup:
+        startup = timeStartup()
+        results.append({"frames": 0, "size": 0, "step": "plugin load",
+                        "seconds": startup["load"],
+                        "modules": startup["modules"]})
+        results.append({"frames": 0, "size": 0, "step": "first dialog",
+                        "seconds": startup["dialog"]})
+        for result in results:
+            print("{:<40} {:9.3f}s".format(result["step"], result["seconds"]))
+        print("{} modules imported at load, numpy: {}, qt widgets: {}".format(
+            startup["modules"], startup["numpy"], startup["widgets"]))
+    try:
+        for frames in options.frames:
+            for size in options.sizes:
+                if frames * size * size * 4 > options.max_bytes:
+                    print("{:>5} frames {:>5}px  skipped (--max-bytes)".format(
+                        frames, size))
+                    continue
+                results += runCase(frames, size, options.exports,
+                                   options.workers, outDir)
+    finally:
+        shutil.rmtree(str(outDir), ignore_errors=True)
+
+    report = {"label": options.label,
+              "version": gitVersion(),
+              "date": datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(),
+              "numpy": (pixelbuffer.np.__version__
+                        if pixelbuffer.available() else None),
+              "platform": platform.platform(),
+              "results": results}
+    path = Path(options.output or
+                benchDir.joinpath("results", options.label + ".json"))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(str(path), "w") as f:
+        json.dump(report, f, indent=1)
+    print("results written to " + str(path))
+
+
+# the time of each step in the new results against the old ones
+def compare(oldPath, newPath):
+    with open(oldPath) as f:
+        old = json.load(f)
+    with open(newPath) as f:
+        new = json.load(f)
+
+    def key(result):
+        return (result["frames"], result["size"], result["step"])
+
+    before = {key(result): result["seconds"] for result in old["results"]}
+    print("{} ({}) -> {} ({})".format(old["label"], old["version"],
+                                      new["label"], new["version"]))
+    for result in new["results"]:
+        if key(result) not in before:
+            continue
+        oldSeconds = before[key(result)]
+        ratio = result["seconds"] / oldSeconds if oldSeconds else float("inf")
+        print("{:>5} frames {:>5}px  {:<28} {:9.3f}s -> {:9.3f}s  x{:.2f}".format(
+            result["frames"], result["size"], result["step"],
+            oldSeconds, result["seconds"], ratio))
+
+
+def parseArguments(args):
+    parser = argparse.ArgumentParser(
+        description="Time the spritesheet exporter on synthetic animations.")
+    parser.add_argument("--label", default=datetime.now().strftime("%Y%m%d-%H%M%S"),
+                        help="name of the results file")
+    parser.add_argument("--output", help="where to write the results")
+    parser.add_argument("--frames", type=int, nargs="+", default=frameCounts)
+    parser.add_argument("--sizes", type=int, nargs="+", default=frameSizes)
+    parser.add_argument("--exports", nargs="*", default=list(exportSettings),
+                        choices=list(exportSettings),
+                        help="which whole exports to time")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="png encoding workers to time, 0 for none")
+    parser.add_argument("--max-bytes", type=int, default=256 << 20,
+                        help="skip the cases with more frame pixels than this")
+    parser.add_argument("--no-startup", dest="startup", action="store_false",
+                        help="don't time the plugin's loading")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two results files instead")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    options = parseArguments(sys.argv[1:])
+    if options.compare:
+        compare(*options.compare)
+    else:
+        run(options)
@@ -0,0 +1,571 @@
+"""
+a stand-in for krita's python api, for running the exporter
+(and timing it) outside of krita
+
+only what the exporter uses is there: documents made of paint layers
+whose projection is their layers copied one over the other
+(no blending), and animated documents whose frames are drawn
+by a python function of the time; pngs are written with the
+exporter's own encoder and remembered, so file layers can read
+them back quickly, and openDocument() reads them from the disk
+
+like krita does, importing it puts Krita, Application, Scripter
+and i18n in the builtins
+
+"""
+
+import builtins
+import struct
+import sys
+import zlib
+from pathlib import Path
+
+
+# krita's color depths and how many bytes a pixel takes
+pixelSizes = {"U8": 4, "U16": 8, "F16": 8, "F32": 16}
+
+# path -> (pixel data, width, height, color depth) of every png written
+exported = {}
+
+
+# (pixel data, width, height, color depth) of an RGBA png on disk,
+# like krita would open it, None if it isn't one
+def readPNG(path):
+    # not on top: the plugin's package imports this module first
+    from spritesheetExporter import pngencoder
+    try:
+        png = Path(path).read_bytes()
+    except OSError:
+        return None
+    if not png.startswith(pngencoder.signature):
+        return None
+    header = None
+    deflated = b""
+    position = len(pngencoder.signature)
+    while position + 8 <= len(png):
+        length, tag = struct.unpack(">I4s", png[position:position + 8])
+        data = png[position + 8:position + 8 + length]
+        if tag == b"IHDR":
+            header = struct.unpack(">IIBB", data[:10])
+        elif tag == b"IDAT":
+            deflated += data
+        position += 12 + length
+    if header is None or header[3] != 6 or header[2] not in (8, 16):
+        return None
+    width, height, bitDepth = header[:3]
+    colorDepth = "U8" if bitDepth == 8 else "U16"
+    pixelSize = pixelSizes[colorDepth]
+    stride = width * pixelSize
+    raw = zlib.decompress(deflated)
+    rows = []
+    above = bytearray(stride)
+    for row in range(height):
+        start = row * (stride + 1)
+        filterType = raw[start]
+        line = bytearray(raw[start + 1:start + 1 + stride])
+        for i in range(stride):
+            left = line[i - pixelSize] if i >= pixelSize else 0
+            up = above[i]
+            upLeft = above[i - pixelSize] if i >= pixelSize else 0
+            if filterType == 1:
+                line[i] = (line[i] + left) & 0xff
+            elif filterType == 2:
+                line[i] = (line[i] + up) & 0xff
+            elif filterType == 3:
+                line[i] = (line[i] + ((left + up) >> 1)) & 0xff
+            elif filterType == 4:
+                guess = left + up - upLeft
+                distances = (abs(guess - left), abs(guess - up),
+                             abs(guess - upLeft))
+                predictor = (left if distances[0] <= min(distances[1:])
+                             else up if distances[1] <= distances[2]
+                             else upLeft)
+                line[i] = (line[i] + predictor) & 0xff
+        rows.append(bytes(line))
+        above = line
+    # png's order back to krita's, it's its own inverse
+    data = bytes(pngencoder.toPNGOrder(b"".join(rows), colorDepth))
+    return (data, width, height, colorDepth)
+
+
+# what stands for the icc data of a color profile
+# in the pngs written, like krita embeds the real one
+def iccData(profile):
+    return b"stand-in icc profile: " + profile.encode("utf-8")
+
+
+class InfoObject(object):
+
+    def __init__(self):
+        self.properties = {}
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+
+class Point(object):
+
+    def __init__(self, x, y):
+        self.px = x
+        self.py = y
+
+    def x(self):
+        return self.px
+
+    def y(self):
+        return self.py
+
+
+class Node(object):
+
+    def __init__(self, document, name, nodeType="paintlayer"):
+        self.document = document
+        self.nodeName = name
+        self.nodeType = nodeType
+        self.isVisible = True
+        self.nodeOpacity = 255
+        self.kids = []
+        self.offsetX = 0
+        self.offsetY = 0
+        # the layer's own pixels, covering width x height from its offset
+        self.data = None
+        self.dataWidth = 0
+        self.dataHeight = 0
+        # sorted times of the keyframes, for animated layers
+        self.keyframes = []
+
+    def name(self):
+        return self.nodeName
+
+    def type(self):
+        return self.nodeType
+
+    def visible(self):
+        return self.isVisible
+
+    def setVisible(self, visible):
+        self.isVisible = visible
+        self.document.setModified(True)
+
+    def opacity(self):
+        return self.nodeOpacity
+
+    def setOpacity(self, opacity):
+        self.nodeOpacity = opacity
+        self.document.setModified(True)
+
+    def animated(self):
+        return len(self.keyframes) > 0
+
+    def hasKeyframeAtTime(self, time):
+        return time in self.keyframes
+
+    # not krita's, whose keyframes are made in the timeline:
+    # what editing them there does
+    def setKeyframes(self, times):
+        self.keyframes = sorted(times)
+        self.document.setModified(True)
+
+    def childNodes(self):
+        return list(self.kids)
+
+    def addChildNode(self, child, above):
+        self.kids.append(child)
+        self.document.setModified(True)
+        return True
+
+    def position(self):
+        return Point(self.offsetX, self.offsetY)
+
+    def move(self, x, y):
+        self.offsetX = x
+        self.offsetY = y
+        self.document.setModified(True)
+
+    def setPixelData(self, data, x, y, width, height):
+        self.data = bytes(data)
+        self.offsetX = x
+        self.offsetY = y
+        self.dataWidth = width
+        self.dataHeight = height
+        self.document.setModified(True)
+
+    def pixelData(self, x, y, width, height):
+        return crop(self.data, self.dataWidth, self.dataHeight,
+                    x - self.offsetX, y - self.offsetY, width, height,
+                    pixelSizes[self.document.depth])
+
+    # a group's visible layers one over the other, or the layer itself
+    def projectionPixelData(self, x, y, width, height):
+        if not self.kids:
+            return self.pixelData(x, y, width, height)
+        data = self.document.composite(self)
+        return crop(data, self.document.docWidth, self.document.docHeight,
+                    x, y, width, height, pixelSizes[self.document.depth])
+
+    def save(self, path, xResolution, yResolution, info, rect):
+        from spritesheetExporter import pngencoder
+        data = self.projectionPixelData(
+            rect.x(), rect.y(), rect.width(), rect.height())
+        with open(str(path), "wb") as f:
+            f.write(pngencoder.encode(data, rect.width(), rect.height(),
+                                      self.document.depth, xResolution))
+        return True
+
+
+# the width x height rectangle at x, y of an image,
+# transparent wherever it's outside of it
+def crop(data, dataWidth, dataHeight, x, y, width, height, pixelSize):
+    if (data is not None and x == 0 and y == 0
+            and width == dataWidth and height == dataHeight):
+        return bytes(data)
+    out = bytearray(width * height * pixelSize)
+    if data is None:
+        return bytes(out)
+    left = max(0, x)
+    right = min(dataWidth, x + width)
+    if right <= left:
+        return bytes(out)
+    for row in range(max(0, y), min(dataHeight, y + height)):
+        start = (row * dataWidth + left) * pixelSize
+        outStart = ((row - y) * width + left - x) * pixelSize
+        out[outStart:outStart + (right - left) * pixelSize] = \
+            data[start:start + (right - left) * pixelSize]
+    return bytes(out)
+
+
+class Document(object):
+
+    def __init__(self, width, height, name="", colorModel="RGBA",
+                 colorDepth="U8", colorProfile="sRGB-elle-V2-srgbtrc.icc",
+                 resolution=72.0, fileName=""):
+        self.docWidth = width
+        self.docHeight = height
+        self.docName = name
+        self.model = colorModel
+        self.depth = colorDepth
+        self.profile = colorProfile
+        self.docResolution = resolution
+        self.docFileName = fileName
+        self.time = 0
+        self.clipStart = 0
+        self.clipEnd = 100
+        self.fps = 24
+        self.batchmode = False
+        self.closed = False
+        # whether it changed since it was made or opened
+        self.docModified = False
+        # time -> the frame's pixels; when set, it's the projection
+        # instead of the layers
+        self.renderer = None
+        self.projections = 0
+        self.root = Node(self, "root", "grouplayer")
+
+    def width(self):
+        return self.docWidth
+
+    def height(self):
+        return self.docHeight
+
+    def name(self):
+        return self.docName
+
+    def fileName(self):
+        return self.docFileName
+
+    def colorModel(self):
+        return self.model
+
+    def colorDepth(self):
+        return self.depth
+
+    def colorProfile(self):
+        return self.profile
+
+    def resolution(self):
+        return self.docResolution
+
+    def modified(self):
+        return self.docModified
+
+    def setModified(self, modified):
+        self.docModified = modified
+
+    def setBatchmode(self, batchmode):
+        self.batchmode = batchmode
+
+    def waitForDone(self):
+        pass
+
+    def refreshProjection(self):
+        pass
+
+    def currentTime(self):
+        return self.time
+
+    def setCurrentTime(self, time):
+        self.time = time
+
+    def framesPerSecond(self):
+        return self.fps
+
+    def animationLength(self):
+        return self.clipEnd - self.clipStart + 1
+
+    def fullClipRangeStartTime(self):
+        return self.clipStart
+
+    def fullClipRangeEndTime(self):
+        return self.clipEnd
+
+    def setFullClipRange(self, start, end):
+        self.clipStart = start
+        self.clipEnd = end
+
+    def rootNode(self):
+        return self.root
+
+    def topLevelNodes(self):
+        return self.root.childNodes()
+
+    def createNode(self, name, nodeType):
+        return Node(self, name, nodeType)
+
+    # "ImageToSize": the layer keeps the size of the png
+    def createFileLayer(self, name, path, scalingMethod):
+        layer = Node(self, name, "filelayer")
+        if str(path) in exported:
+            data, width, height, depth = exported[str(path)]
+            layer.setPixelData(data, 0, 0, width, height)
+        return layer
+
+    # the visible layers, each one covering those under it
+    def projection(self):
+        if self.renderer is not None:
+            return self.renderer(self.time)
+        # how many times krita composited the whole image
+        self.projections += 1
+        return self.composite(self.root)
+
+    def composite(self, node):
+        pixelSize = pixelSizes[self.depth]
+        out = bytearray(self.docWidth * self.docHeight * pixelSize)
+        for layer in self.visibleLeaves(node):
+            if layer.data is None:
+                continue
+            left = max(0, layer.offsetX)
+            right = min(self.docWidth, layer.offsetX + layer.dataWidth)
+            if right <= left:
+                continue
+            rowBytes = (right - left) * pixelSize
+            for row in range(max(0, layer.offsetY),
+                             min(self.docHeight,
+                                 layer.offsetY + layer.dataHeight)):
+                start = ((row - layer.offsetY) * layer.dataWidth
+                         + left - layer.offsetX) * pixelSize
+                outStart = (row * self.docWidth + left) * pixelSize
+                out[outStart:outStart + rowBytes] = \
+                    layer.data[start:start + rowBytes]
+        return bytes(out)
+
+    def visibleLeaves(self, node):
+        for kid in node.childNodes():
+            if not kid.visible():
+                continue
+            if kid.childNodes():
+                yield from self.visibleLeaves(kid)
+            else:
+                yield kid
+
+    def pixelData(self, x, y, width, height):
+        return crop(self.projection(), self.docWidth, self.docHeight,
+                    x, y, width, height, pixelSizes[self.depth])
+
+    def exportImage(self, path, info):
+        # not on top: the plugin's package imports this module first
+        from spritesheetExporter import pngencoder
+        data = self.projection()
+        exported[str(path)] = (data, self.docWidth, self.docHeight, self.depth)
+        if pngencoder.canEncode(self.model, self.depth):
+            with open(str(path), "wb") as f:
+                f.write(pngencoder.encode(
+                    data, self.docWidth, self.docHeight, self.depth,
+                    self.docResolution,
+                    iccProfile=(self.profile, iccData(self.profile))))
+        else:
+            # nothing to write it with, an empty file will have to do
+            Path(path).touch()
+        return True
+
+    def close(self):
+        self.closed = True
+        Krita.instance().documentList.discard(self)
+        return True
+
+
+# a document drawing a square moving across a transparent canvas,
+# changing only every hold frames (so there are duplicates to find),
+# with a keyframe on every change
+def animatedDocument(width, height, frames, hold=1, colorDepth="U8",
+                     name="animation"):
+    doc = Document(width, height, name, "RGBA", colorDepth)
+    doc.setFullClipRange(0, frames - 1)
+    layer = Node(doc, "animation")
+    layer.keyframes = list(range(0, frames, hold))
+    doc.root.addChildNode(layer, None)
+    pixelSize = pixelSizes[colorDepth]
+    side = max(1, min(width, height) // 2)
+    # only the last frame drawn is kept, frames come in order
+    last = {}
+
+    def render(time):
+        step = time // hold
+        if last.get("step") == step:
+            return last["data"]
+        out = bytearray(width * height * pixelSize)
+        x = (step * 7) % max(1, width - side + 1)
+        y = (step * 3) % max(1, height - side + 1)
+        pixel = bytes(((step * 37) % 256, (step * 91) % 256,
+                       (step * 13) % 256, 255))
+        if pixelSize != 4:
+            pixel = bytes(value for value in pixel
+                          for _ in range(pixelSize // 4))
+        row = pixel * side
+        for line in range(y, y + side):
+            start = (line * width + x) * pixelSize
+            out[start:start + len(row)] = row
+        last["step"] = step
+        last["data"] = bytes(out)
+        return last["data"]
+
+    doc.renderer = render
+    doc.setModified(False)
+    return doc
+
+
+class Extension(object):
+
+    def __init__(self, parent):
+        self.parent = parent
+
+
+# just enough of a qt signal for the actions' triggered
+class Signal(object):
+
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        for slot in self.slots:
+            slot(*args)
+
+
+# a menu entry; trigger() is what clicking on it does
+class Action(object):
+
+    def __init__(self, name, text, menu):
+        self.name = name
+        self.text = text
+        self.menu = menu
+        self.toolTip = ""
+        self.triggered = Signal()
+
+    def setToolTip(self, toolTip):
+        self.toolTip = toolTip
+
+    def trigger(self):
+        self.triggered.emit()
+
+
+# the main window extensions add their actions to
+class Window(object):
+
+    def __init__(self):
+        # name -> action
+        self.actions = {}
+
+    def createAction(self, name, text, menu):
+        action = Action(name, text, menu)
+        self.actions[name] = action
+        return action
+
+
+class Krita(object):
+    instanceObject = None
+
+    def __init__(self):
+        self.active = None
+        self.documentList = set()
+        # path -> document, what openDocument() finds besides pngs
+        self.files = {}
+        self.extensions = []
+
+    @classmethod
+    def instance(cls):
+        if cls.instanceObject is None:
+            cls.instanceObject = cls()
+        return cls.instanceObject
+
+    def version(self):
+        return "5.2.0"
+
+    def activeDocument(self):
+        return self.active
+
+    def setActiveDocument(self, doc):
+        self.active = doc
+
+    def documents(self):
+        return list(self.documentList)
+
+    # a white "Background" layer, like krita's new documents
+    def createDocument(self, width, height, name, colorModel, colorDepth,
+                       profile, resolution):
+        doc = Document(width, height, name, colorModel, colorDepth,
+                       profile, resolution)
+        background = doc.createNode("Background", "paintlayer")
+        background.setPixelData(
+            b"\xff" * (width * height * pixelSizes[colorDepth]),
+            0, 0, width, height)
+        doc.root.addChildNode(background, None)
+        doc.setModified(False)
+        self.documentList.add(doc)
+        return doc
+
+    # the documents in files, or a png: read from the disk
+    # (it may have been renamed since it was written),
+    # or as it was exported if there was nothing to write it with
+    def openDocument(self, path):
+        doc = self.files.get(str(path))
+        image = None
+        if doc is None:
+            image = readPNG(path) or exported.get(str(path))
+        if image is not None:
+            data, width, height, depth = image
+            doc = Document(width, height, Path(path).stem, "RGBA", depth,
+                           fileName=str(path))
+            layer = doc.createNode("Background", "paintlayer")
+            layer.setPixelData(data, 0, 0, width, height)
+            doc.root.addChildNode(layer, None)
+            doc.setModified(False)
+        if doc is not None:
+            self.documentList.add(doc)
+        return doc
+
+    def addExtension(self, extension):
+        self.extensions.append(extension)
+
+
+def i18n(text):
+    return text
+
+
+krita = sys.modules[__name__]
+
+builtins.Krita = Krita
+builtins.Application = Krita.instance()
+builtins.Scripter = Krita.instance()
+builtins.i18n = i18n
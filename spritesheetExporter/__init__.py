@@ -1 +1,7 @@
-from .spritesheetexporterextension import *
+import sys
+
+# krita has already imported its module by the time it loads plugins;
+# anywhere else (e.g. in the png encoding worker processes)
+# only the modules that don't need krita can be used
+if "krita" in sys.modules:
+    from .spritesheetexporterextension import *
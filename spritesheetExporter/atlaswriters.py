@@ -0,0 +1,334 @@
+"""
+the formats the texture atlas can be written in:
+
+- "phaser": our own {"frames": [...], "meta": ...}, what Phaser 3 reads
+- "texturepacker-hash" and "texturepacker-array": TexturePacker's
+  JSON (Hash) and JSON (Array), with one file per page like
+  its multipack (exportName_0.json, exportName_1.json...)
+- "godot": a Godot 4 SpriteFrames resource (exportName.tres)
+- "binary": fixed-width records a game can read without parsing
+  anything (exportName.atlas, see BinaryWriter)
+
+every writer streams: it's given the meta (what pages there are and how
+big, and their pixel "format" if they're packed for the gpu),
+then the frames one at a time as the exporter makes them
+(filename, frame, and maybe rotated, trimmed, spriteSourceSize,
+sourceSize, page, duration in ms), then the animations
+(name -> filenames of its frames) if there are any, maybe with
+how long each of their frames is shown (name -> ms of each frame),
+and only keeps what it needs to write the end
+
+"""
+
+import json
+import struct
+from pathlib import Path
+
+
+class AtlasWriter(object):
+    name = ""
+    extension = ".json"
+
+    # basePath is where the atlas goes, without its extension;
+    # framesPerSecond is the document's, for formats that play animations
+    def __init__(self, basePath, framesPerSecond=12):
+        self.basePath = Path(basePath)
+        self.framesPerSecond = framesPerSecond
+        self.files = []
+        # every file opened, still there once they're closed
+        self.paths = []
+
+    def open(self, path, mode="w"):
+        f = open(str(path), mode)
+        self.files.append(f)
+        self.paths.append(Path(path))
+        return f
+
+    def begin(self, meta):
+        raise NotImplementedError
+
+    def addFrame(self, frame):
+        raise NotImplementedError
+
+    def end(self, animations=None, durations=None):
+        raise NotImplementedError
+
+    # also called if the export stopped halfway
+    def close(self):
+        for f in self.files:
+            f.close()
+        self.files.clear()
+
+
+# (page, image, width, height) of each page the meta lists
+def metaPages(meta):
+    if "pages" in meta:
+        return [(page, description["image"],
+                 description["size"]["w"], description["size"]["h"])
+                for page, description in enumerate(meta["pages"])]
+    return [(0, meta.get("image", ""), meta["size"]["w"], meta["size"]["h"])]
+
+
+class PhaserWriter(AtlasWriter):
+    name = "phaser"
+
+    def begin(self, meta):
+        self.meta = meta
+        self.file = self.open(self.basePath.with_name(
+            self.basePath.name + self.extension))
+        self.file.write('{"frames": [')
+        self.framesNum = 0
+
+    def addFrame(self, frame):
+        if self.framesNum > 0:
+            self.file.write(", ")
+        self.file.write(json.dumps(frame))
+        self.framesNum += 1
+
+    def end(self, animations=None, durations=None):
+        self.file.write('], "meta": ' + json.dumps(self.meta))
+        if animations and durations:
+            # each frame with how long this animation shows it
+            animations = {
+                name: [{"filename": filename, "duration": duration}
+                       for filename, duration
+                       in zip(filenames, durations[name])]
+                for name, filenames in animations.items()}
+        if animations:
+            self.file.write(', "animations": ' + json.dumps(animations))
+        self.file.write("}")
+        self.close()
+
+
+class TexturePackerWriter(AtlasWriter):
+    name = ""
+    # whether frames are a {filename: frame} hash or an array
+    hashed = False
+
+    def begin(self, meta):
+        self.pages = []
+        pages = metaPages(meta)
+        for page, image, width, height in pages:
+            name = self.basePath.name
+            if len(pages) > 1:
+                name += "_" + str(page)
+            f = self.open(self.basePath.with_name(name + self.extension))
+            f.write('{"frames": ' + ("{" if self.hashed else "["))
+            self.pages.append({
+                "file": f,
+                "framesNum": 0,
+                "meta": {"app": "Krita spritesheet exporter",
+                         "version": "1.0",
+                         "image": image,
+                         "format": meta.get("format", "RGBA8888"),
+                         "size": {"w": width, "h": height},
+                         "scale": meta.get("scale", "1")}})
+
+    def addFrame(self, frame):
+        page = self.pages[frame.get("page", 0)]
+        # texture packer always says whether it's rotated or trimmed
+        size = {"w": frame["frame"]["w"], "h": frame["frame"]["h"]}
+        entry = {"frame": frame["frame"],
+                 "rotated": frame.get("rotated", False),
+                 "trimmed": frame.get("trimmed", False),
+                 "spriteSourceSize": frame.get(
+                     "spriteSourceSize", dict({"x": 0, "y": 0}, **size)),
+                 "sourceSize": frame.get("sourceSize", size)}
+        if "duration" in frame:
+            # like aseprite's json, which looks like theirs
+            entry["duration"] = frame["duration"]
+        if page["framesNum"] > 0:
+            page["file"].write(", ")
+        if self.hashed:
+            page["file"].write(json.dumps(str(frame["filename"])) + ": " +
+                               json.dumps(entry))
+        else:
+            page["file"].write(json.dumps(dict(
+                {"filename": str(frame["filename"])}, **entry)))
+        page["framesNum"] += 1
+
+    def end(self, animations=None, durations=None):
+        for page in self.pages:
+            page["file"].write(("}" if self.hashed else "]") +
+                               ', "meta": ' + json.dumps(page["meta"]))
+            if animations and durations:
+                # each frame with how long this animation shows it,
+                # like our own json does
+                page["file"].write(', "animations": ' + json.dumps(
+                    {name: [{"filename": str(filename), "duration": duration}
+                            for filename, duration
+                            in zip(filenames, durations[name])]
+                     for name, filenames in animations.items()}))
+            elif animations:
+                # like pixi reads them
+                page["file"].write(', "animations": ' + json.dumps(
+                    {name: [str(filename) for filename in filenames]
+                     for name, filenames in animations.items()}))
+            page["file"].write("}")
+        self.close()
+
+
+class TexturePackerHashWriter(TexturePackerWriter):
+    name = "texturepacker-hash"
+    hashed = True
+
+
+class TexturePackerArrayWriter(TexturePackerWriter):
+    name = "texturepacker-array"
+    hashed = False
+
+
+# one AtlasTexture per frame, cut from its page's texture;
+# the sheet is expected next to the .tres in the godot project,
+# and rotated sprites can't be turned back by godot;
+# the animations play at the document's frame rate
+class GodotWriter(AtlasWriter):
+    name = "godot"
+    extension = ".tres"
+
+    def begin(self, meta):
+        self.file = self.open(self.basePath.with_name(
+            self.basePath.name + self.extension))
+        self.file.write('[gd_resource type="SpriteFrames" format=3]\n\n')
+        for page, image, width, height in metaPages(meta):
+            self.file.write('[ext_resource type="Texture2D" path="' + image +
+                            '" id="' + str(page + 1) + '"]\n\n')
+        # filename -> id of its AtlasTexture, in order
+        self.textures = {}
+        # filename -> how long it's shown in ms, if it's said
+        self.durations = {}
+
+    def addFrame(self, frame):
+        textureId = "AtlasTexture_" + str(len(self.textures))
+        self.textures[frame["filename"]] = textureId
+        if "duration" in frame:
+            self.durations[frame["filename"]] = frame["duration"]
+        rect = frame["frame"]
+        self.file.write(
+            '[sub_resource type="AtlasTexture" id="' + textureId + '"]\n' +
+            'atlas = ExtResource("' + str(frame.get("page", 0) + 1) + '")\n' +
+            "region = Rect2(" + ", ".join(str(rect[key])
+                                          for key in "xywh") + ")\n")
+        if frame.get("trimmed"):
+            # the transparent borders that were cut, so it's drawn in place
+            source = frame["spriteSourceSize"]
+            self.file.write("margin = Rect2({}, {}, {}, {})\n".format(
+                source["x"], source["y"],
+                frame["sourceSize"]["w"] - source["w"],
+                frame["sourceSize"]["h"] - source["h"]))
+        self.file.write("\n")
+
+    def end(self, animations=None, durations=None):
+        if not animations:
+            animations = {"default": list(self.textures)}
+
+        speed = float(self.framesPerSecond)
+
+        # godot's durations are in frames of the animation's speed
+        # (whole frames of the document, give or take the ms rounding)
+        def duration(milliseconds):
+            if milliseconds is None:
+                return "1.0"
+            return "{:g}".format(round(milliseconds * speed / 1000, 1))
+
+        def animation(name, filenames):
+            if durations:
+                frameDurations = durations[name]
+            else:
+                frameDurations = [self.durations.get(filename)
+                                  for filename in filenames]
+            # frames that aren't in the atlas (e.g. timeline frames
+            # named in animations of layers as frames) are left out
+            return ('{\n"frames": [' + ", ".join(
+                        '{\n"duration": ' + duration(milliseconds) +
+                        ',\n"texture": SubResource("' +
+                        self.textures[filename] + '")\n}'
+                        for filename, milliseconds
+                        in zip(filenames, frameDurations)
+                        if filename in self.textures) +
+                    '],\n"loop": true,\n"name": &' + json.dumps(name) +
+                    ',\n"speed": ' + str(speed) + '\n}')
+        self.file.write("[resource]\nanimations = [" + ", ".join(
+            animation(name, filenames)
+            for name, filenames in animations.items()) + "]\n")
+        self.close()
+
+
+# little endian, so a runtime can read the records straight into an array:
+#   header: "SSAT", version (u16), record size (u16),
+#           frames number (u32), pages number (u32)
+#   a record per frame, in order: filename (u32), page (u16),
+#           flags (u16: 1 rotated, 2 trimmed), x, y, w, h (u32),
+#           offset x, offset y in the source (i32), source w, h (u32),
+#           duration in ms (u32, 0 if it isn't said)
+#   each page: width, height (u32), image name length (u16), image (utf-8)
+#   animations number (u32), then each animation: name length (u16),
+#           name (utf-8), frames number (u32), then for each frame
+#           its record index and how long the animation shows it
+#           in ms (u32 each, 0 if it isn't said)
+class BinaryWriter(AtlasWriter):
+    name = "binary"
+    extension = ".atlas"
+    magic = b"SSAT"
+    version = 2
+    header = struct.Struct("<4sHHII")
+    record = struct.Struct("<IHHIIIIiiIII")
+
+    def begin(self, meta):
+        self.file = self.open(self.basePath.with_name(
+            self.basePath.name + self.extension), "wb")
+        self.pages = metaPages(meta)
+        # written again once we know how many frames there are
+        self.file.write(self.header.pack(
+            self.magic, self.version, self.record.size, 0, len(self.pages)))
+        # filename -> index of its record
+        self.records = {}
+
+    def addFrame(self, frame):
+        rect = frame["frame"]
+        source = frame.get("spriteSourceSize",
+                           {"x": 0, "y": 0, "w": rect["w"], "h": rect["h"]})
+        sourceSize = frame.get("sourceSize", {"w": rect["w"], "h": rect["h"]})
+        flags = ((1 if frame.get("rotated") else 0) |
+                 (2 if frame.get("trimmed") else 0))
+        self.records[frame["filename"]] = len(self.records)
+        self.file.write(self.record.pack(
+            int(frame["filename"]), frame.get("page", 0), flags,
+            rect["x"], rect["y"], rect["w"], rect["h"],
+            source["x"], source["y"], sourceSize["w"], sourceSize["h"],
+            frame.get("duration", 0)))
+
+    def end(self, animations=None, durations=None):
+        for page, image, width, height in self.pages:
+            image = image.encode("utf-8")
+            self.file.write(struct.pack("<IIH", width, height, len(image)))
+            self.file.write(image)
+        animations = animations or {}
+        self.file.write(struct.pack("<I", len(animations)))
+        for name, filenames in animations.items():
+            frameDurations = (durations[name] if durations
+                              else [0] * len(filenames))
+            # the frames without a record can't be pointed to
+            entries = [(self.records[filename], duration)
+                       for filename, duration
+                       in zip(filenames, frameDurations)
+                       if filename in self.records]
+            name = name.encode("utf-8")
+            self.file.write(struct.pack("<H", len(name)) + name)
+            self.file.write(struct.pack("<I", len(entries)))
+            self.file.write(struct.pack(
+                "<" + str(2 * len(entries)) + "I",
+                *[value for entry in entries for value in entry]))
+        self.file.seek(0)
+        self.file.write(self.header.pack(
+            self.magic, self.version, self.record.size,
+            len(self.records), len(self.pages)))
+        self.close()
+
+
+writers = {
+    PhaserWriter.name: PhaserWriter,
+    TexturePackerHashWriter.name: TexturePackerHashWriter,
+    TexturePackerArrayWriter.name: TexturePackerArrayWriter,
+    GodotWriter.name: GodotWriter,
+    BinaryWriter.name: BinaryWriter}
@@ -0,0 +1,186 @@
+"""
+exports the spritesheets of many .kra files in one run,
+without the dialog: each file is opened, exported and closed
+before the next one, and a failing file doesn't stop the others
+
+from a script:
+    batchexport.exportFiles(["walk.kra", "run.kra"],
+                            {"trim": True, "packer": "maxrects"})
+
+or with kritarunner, from a manifest:
+    kritarunner -s spritesheetExporter.batchexport -f __main__ \\
+        --manifest sprites.json --report report.json
+
+where sprites.json looks like:
+    { "settings": { "exportDir": "build/sprites", "trim": true },
+      "files": [ "walk.kra",
+                 { "file": "run.kra", "settings": { "step": 2 } } ] }
+
+"""
+
+import argparse
+import gc
+import json
+import time
+import traceback
+from pathlib import Path
+
+from krita import Krita
+
+from . import spritesheetexporter
+from . import keyframeindex
+
+
+# the exporter's attributes that are paths
+pathSettings = ("exportDir", "spritesExportDir")
+
+# and those that are its own business, not settings
+internalAttributes = ("defaultPath", "defaultTime", "defaultSpace",
+                      "frames", "duplicates",
+                      "layersList", "layersStates", "offLayers")
+
+
+# a new exporter for each file, since an export fills in
+# the defaults (rows, columns, start, end) of the one it's done with
+def makeExporter(settings):
+    exporter = spritesheetexporter.SpritesheetExporter()
+    for name, value in settings.items():
+        if name not in vars(exporter) or name in internalAttributes:
+            raise ValueError("unknown setting: " + name)
+        if name in pathSettings:
+            value = Path(value)
+        setattr(exporter, name, value)
+    return exporter
+
+
+# export one file; the spritesheet goes next to it
+# and is named after it, unless the settings say otherwise
+def exportFile(path, settings, debugging=False):
+    path = Path(path)
+    fileSettings = {"exportDir": str(path.parent), "exportName": path.stem}
+    fileSettings.update(settings)
+    # checked before opening anything
+    exporter = makeExporter(fileSettings)
+    if not path.exists():
+        raise FileNotFoundError(str(path))
+    doc = Krita.instance().openDocument(str(path))
+    if doc is None:
+        raise RuntimeError("krita couldn't open " + str(path))
+    # a manifest's build folder may not be there yet
+    exporter.exportDir.mkdir(parents=True, exist_ok=True)
+    try:
+        exporter.export(debugging, doc)
+    finally:
+        keyframeindex.invalidate(doc)
+        doc.close()
+
+
+# export every file in turn; gives back, for each of them,
+# how long it took and the error it failed with, if it did
+def exportFiles(paths, settings=None, perFile=None,
+                debugging=False, log=print):
+    settings = settings or {}
+    perFile = perFile or {}
+    results = []
+    for path in paths:
+        fileSettings = dict(settings)
+        fileSettings.update(perFile.get(str(path), {}))
+        start = time.perf_counter()
+        error = None
+        try:
+            exportFile(path, fileSettings, debugging)
+        except Exception:
+            error = traceback.format_exc()
+        seconds = time.perf_counter() - start
+        results.append({"file": str(path), "seconds": seconds,
+                        "ok": error is None, "error": error})
+        if log is not None:
+            if error is None:
+                log("exported " + str(path) + " in " +
+                    "{:.2f}".format(seconds) + "s")
+            else:
+                log("failed to export " + str(path) + ":\n" + error)
+        # let go of the document's memory before the next one
+        gc.collect()
+    return results
+
+
+# files and settings out of a manifest;
+# relative paths are relative to the manifest
+def loadManifest(path):
+    path = Path(path)
+    with open(str(path)) as f:
+        content = json.load(f)
+    settings = content.get("settings", {})
+    for name in pathSettings:
+        if name in settings:
+            settings[name] = str(path.parent.joinpath(settings[name]))
+    files = []
+    perFile = {}
+    for entry in content.get("files", []):
+        if isinstance(entry, str):
+            entry = {"file": entry}
+        filePath = str(path.parent.joinpath(entry["file"]))
+        files.append(filePath)
+        fileSettings = entry.get("settings", {})
+        for name in pathSettings:
+            if name in fileSettings:
+                fileSettings[name] = str(
+                    path.parent.joinpath(fileSettings[name]))
+        perFile[filePath] = fileSettings
+    return files, settings, perFile
+
+
+# a --set value: json if it reads as json (numbers, true, false),
+# a plain string otherwise
+def parseValue(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parseArguments(args):
+    parser = argparse.ArgumentParser(
+        prog="spritesheetExporter.batchexport",
+        description="Export the spritesheets of many .kra files.")
+    parser.add_argument("files", nargs="*", help=".kra files to export")
+    parser.add_argument("--manifest",
+                        help="json file listing the files and settings")
+    parser.add_argument("--set", action="append", default=[],
+                        metavar="NAME=VALUE",
+                        help="an exporter setting, e.g. --set trim=true")
+    parser.add_argument("--report",
+                        help="where to write the timings and errors as json")
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args(args)
+
+
+# returns how many files failed
+def main(args):
+    options = parseArguments(args)
+    files, settings, perFile = [], {}, {}
+    if options.manifest:
+        files, settings, perFile = loadManifest(options.manifest)
+    files += options.files
+    for assignment in options.set:
+        name, _, value = assignment.partition("=")
+        settings[name] = parseValue(value)
+
+    start = time.perf_counter()
+    results = exportFiles(files, settings, perFile, options.debug)
+    failed = [result for result in results if not result["ok"]]
+    print(str(len(results) - len(failed)) + " exported, " +
+          str(len(failed)) + " failed, in " +
+          "{:.2f}".format(time.perf_counter() - start) + "s")
+
+    if options.report:
+        with open(options.report, "w") as f:
+            json.dump({"seconds": time.perf_counter() - start,
+                       "files": results}, f, indent=2)
+    return len(failed)
+
+
+# kritarunner's entry point
+def __main__(args):
+    return main(list(args))
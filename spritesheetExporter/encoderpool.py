@@ -0,0 +1,110 @@
+"""
+compresses pngs on a pool of worker processes
+while krita keeps rendering frames
+
+"""
+
+import sys
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from . import pngencoder
+
+
+# inside krita, sys.executable is krita itself and we can't spawn
+# workers with it: we look for the python it embeds instead
+def pythonExecutable():
+    executable = Path(sys.executable) if sys.executable else None
+    if executable and executable.stem.lower().startswith("python"):
+        return str(executable)
+    for prefix in (Path(sys.base_prefix), Path(sys.prefix)):
+        for candidate in (prefix.joinpath("bin", "python3"),
+                          prefix.joinpath("python.exe"),
+                          prefix.joinpath("python3.exe")):
+            if candidate.exists():
+                return str(candidate)
+    return None
+
+
+class EncoderPool(object):
+
+    # at most maxPending pngs wait to be written (their pixels or their
+    # compressed strips in memory) before submit() waits for the oldest;
+    # 0 for twice as many as there are workers
+    def __init__(self, workers, maxPending=0):
+        self.workers = workers
+        self.maxPending = maxPending or 2 * workers
+        # (png path, image size and settings, futures of its strips)
+        # in the order they were submitted
+        self.pending = deque()
+        # bytes written since the last wait()
+        self.written = 0
+        executable = pythonExecutable()
+        if executable is not None:
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(executable)
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=context)
+        else:
+            # zlib lets go of the GIL while compressing,
+            # so threads still use several cores
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    # the png is written once its strips are compressed,
+    # at the latest on the next wait()
+    def submit(self, path, data, width, height, colorDepth,
+               resolution=0, level=6, filterMode="none", iccProfile=None):
+        data = bytes(data)
+        pieces = pngencoder.splitStrips(data, width, height, colorDepth)
+        priors = pngencoder.priorRows(data, width, height, colorDepth)
+        futures = [self.executor.submit(
+                       pngencoder.encodeStrip, rows, width, colorDepth,
+                       level, i == len(pieces) - 1, filterMode, priors[i])
+                   for i, rows in enumerate(pieces)]
+        self.pending.append(
+            (path, (width, height, colorDepth, resolution, iccProfile),
+             futures))
+        # what's done is written (and let go of) right away,
+        # and when encoding can't keep up, we wait for it
+        self.writeDone()
+        while len(self.pending) > self.maxPending:
+            self.writeOldest()
+
+    # the oldest png waiting, once its strips are compressed
+    def writeOldest(self):
+        path, (width, height, colorDepth, resolution, iccProfile), \
+            futures = self.pending.popleft()
+        png = pngencoder.assemble(
+            [future.result() for future in futures],
+            width, height, colorDepth, resolution, iccProfile)
+        with open(str(path), "wb") as f:
+            f.write(png)
+        self.written += len(png)
+
+    # the pngs whose strips are all compressed, in order
+    def writeDone(self):
+        while self.pending and all(
+                future.done() for future in self.pending[0][2]):
+            self.writeOldest()
+
+    # write every submitted png, in the order they were submitted;
+    # gives back how many bytes were written since the last time
+    def wait(self):
+        while self.pending:
+            self.writeOldest()
+        written = self.written
+        self.written = 0
+        return written
+
+    def close(self):
+        self.executor.shutdown()
+
+    # forget the pngs that weren't written yet
+    def cancel(self):
+        for path, settings, futures in self.pending:
+            for future in futures:
+                future.cancel()
+        self.pending.clear()
+        self.executor.shutdown()
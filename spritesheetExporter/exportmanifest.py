@@ -0,0 +1,73 @@
+"""
+what the last export of a spritesheet was made of, kept next to it
+(exportName.manifest.json): the settings, a hash of each frame's pixels
+and where each frame went, so the next export only has to redo
+the frames that changed, or nothing at all
+
+"""
+
+import json
+from pathlib import Path
+
+
+class ExportManifest(object):
+    version = 1
+
+    def __init__(self, settings, frames, duplicates, pages, scaledPages=None):
+        # the settings that decide where the sprites go
+        self.settings = settings
+        # frame name -> { "hash", "page", "x", "y", "w", "h", "rotated" }
+        self.frames = frames
+        # frame name -> name of the first identical frame
+        self.duplicates = duplicates
+        # [{ "image", "w", "h" }] for each page of the spritesheet
+        self.pages = pages
+        # [{ "image", "scale" }] for each page written at another size
+        self.scaledPages = scaledPages or []
+
+    # whether the sprites of this export would go where they went last time,
+    # as long as their own sizes didn't change
+    def matches(self, settings, frameNames, duplicates):
+        names = sorted(str(name) for name in frameNames)
+        previousNames = sorted(list(self.frames) + list(self.duplicates))
+        duplicates = {str(name): str(first)
+                      for name, first in duplicates.items()}
+        return (self.settings == settings and names == previousNames
+                and self.duplicates == duplicates)
+
+    # names of the frames whose pixels aren't the same anymore
+    def changedFrames(self, hashes):
+        return [name for name, frame in self.frames.items()
+                if hashes.get(name) != frame["hash"]]
+
+    def hashOf(self, name):
+        frame = self.frames.get(str(name))
+        if frame is None:
+            return None
+        return frame["hash"]
+
+    def save(self, path):
+        with open(str(path), 'w') as f:
+            json.dump({
+                "version": self.version,
+                "settings": self.settings,
+                "frames": self.frames,
+                "duplicates": self.duplicates,
+                "pages": self.pages,
+                "scaledPages": self.scaledPages}, f)
+
+
+# the manifest at path, or None if there is none we can use
+def load(path):
+    if not Path(path).exists():
+        return None
+    try:
+        with open(str(path)) as f:
+            content = json.load(f)
+    except ValueError:
+        return None
+    if content.get("version") != ExportManifest.version:
+        return None
+    return ExportManifest(content["settings"], content["frames"],
+                          content["duplicates"], content["pages"],
+                          content.get("scaledPages"))
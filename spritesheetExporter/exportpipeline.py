@@ -0,0 +1,72 @@
+"""
+lets krita render the next frame while the previous ones
+are hashed, trimmed, compressed and written in the background
+
+the main thread only sets the time and grabs the pixels;
+a bounded queue hands them over to a background thread,
+so at most maxInFlight captured frames wait in memory
+
+"""
+
+import threading
+import queue
+
+
+class FramePipeline(object):
+
+    # process(num, data) is called once per frame, in order;
+    # with maxInFlight at 0 it's called right away on this thread
+    def __init__(self, process, maxInFlight=0):
+        self.process = process
+        self.error = None
+        self.cancelled = False
+        self.thread = None
+        if maxInFlight > 0:
+            self.queue = queue.Queue(maxsize=maxInFlight)
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    # blocks while the queue is full
+    def put(self, num, data):
+        if self.thread is None:
+            self.process(num, data)
+            return
+        if self.error is not None:
+            # stop the background thread and give the error back
+            self.finish()
+        self.queue.put((num, data))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is None and not self.cancelled:
+                try:
+                    self.process(*item)
+                except Exception as error:
+                    # given back to the main thread on its next put()
+                    self.error = error
+
+    # wait for every frame to be processed
+    def finish(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.raiseError()
+
+    # drop the frames still waiting and stop the background thread
+    def cancel(self):
+        self.cancelled = True
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.error = None
+
+    def raiseError(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
@@ -0,0 +1,112 @@
+"""
+what an export spent its time on: timed spans (range detection,
+each frame's render, encoding, assembly, writing the sheet...)
+and counters (bytes written, frames skipped, layers created...),
+saved as json, or as a chrome trace to open in chrome://tracing
+or https://ui.perfetto.dev
+
+a disabled trace records nothing, so it can always be called
+
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ExportTrace(object):
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        # (name, start, end, thread id, args), times in seconds
+        # since the trace started; appending is thread safe
+        self.spans = []
+        # (message, time, thread id)
+        self.marks = []
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def now(self):
+        return time.perf_counter() - self.origin
+
+    # for spans that don't fit in a with block;
+    # gives back what end() needs
+    def begin(self, name, **args):
+        return (name, self.now(), args)
+
+    def end(self, started):
+        if not self.enabled:
+            return
+        name, start, args = started
+        self.spans.append(
+            (name, start, self.now(), threading.get_ident(), args))
+
+    @contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+        started = self.begin(name, **args)
+        try:
+            yield
+        finally:
+            self.end(started)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # a message at a point in time, like debugPrint() shows
+    def mark(self, message):
+        if not self.enabled:
+            return
+        self.marks.append((message, self.now(), threading.get_ident()))
+
+    # span name -> how many there were and how long they took altogether
+    def totals(self):
+        totals = {}
+        for name, start, end, thread, args in self.spans:
+            total = totals.setdefault(name, {"count": 0, "seconds": 0.0})
+            total["count"] += 1
+            total["seconds"] += end - start
+        return totals
+
+    def toDict(self):
+        return {
+            "spans": [{"name": name, "start": start,
+                       "duration": end - start, "thread": thread,
+                       "args": args}
+                      for name, start, end, thread, args in self.spans],
+            "marks": [{"message": message, "time": at, "thread": thread}
+                      for message, at, thread in self.marks],
+            "counters": dict(self.counters),
+            "totals": self.totals()}
+
+    # chrome's trace event format: complete events ("X") for the spans,
+    # instant events ("i") for the marks and a counter event ("C")
+    # with the final counts, times in microseconds
+    def toChromeTrace(self):
+        events = [{"name": name, "ph": "X", "pid": 1, "tid": thread,
+                   "ts": start * 1e6, "dur": (end - start) * 1e6,
+                   "args": args}
+                  for name, start, end, thread, args in self.spans]
+        events += [{"name": message, "ph": "i", "s": "t", "pid": 1,
+                    "tid": thread, "ts": at * 1e6}
+                   for message, at, thread in self.marks]
+        if self.counters:
+            events.append({"name": "counters", "ph": "C", "pid": 1,
+                           "ts": self.now() * 1e6,
+                           "args": dict(self.counters)})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path):
+        with open(str(path), "w") as f:
+            json.dump(self.toDict(), f, indent=1)
+
+    def saveChromeTrace(self, path):
+        with open(str(path), "w") as f:
+            json.dump(self.toChromeTrace(), f)
@@ -0,0 +1,161 @@
+"""
+where the keyframes of a document's visible layers are:
+the first and last keyframe of each animated layer, looked for
+from each end of the clip like the exporter always did, and every
+keyframe in between only when they're asked for (to only render
+keyframes), so the frame range costs a few lookups per layer
+
+an index is kept until the layers' tree, the clip range or a layer's
+first or last keyframe changes; krita can't tell us about a keyframe
+that moved between those, so an export that needs every keyframe
+reads them again (see forDocument()); the cache is for the dialog's
+estimates
+
+(hasKeyframeAtTime() only exists from krita 4.2 on)
+
+"""
+
+import bisect
+
+
+class KeyframeIndex(object):
+
+    def __init__(self, doc):
+        self.clipEnd = doc.fullClipRangeEndTime()
+        # (first, last) keyframe of each visible animated layer,
+        # None for those that don't have any
+        self.layerBounds = []
+        tree = tuple(self.addLayer(layer) for layer in doc.topLevelNodes())
+        # what we check to know the index is still good
+        self.key = (doc.fullClipRangeStartTime(), self.clipEnd,
+                    doc.modified(), tree)
+        # every time at which a visible layer has a keyframe, sorted,
+        # once readTimes() looked for them
+        self.sortedTimes = None
+
+    # like the exporter always did, a hidden group hides its kids;
+    # gives back what the key knows of the layer
+    def addLayer(self, layer):
+        if not layer.visible():
+            return (layer.name(), False)
+        bounds = None
+        if layer.animated():
+            bounds = keyframeBounds(layer, self.clipEnd)
+            self.layerBounds.append(bounds)
+        return (layer.name(), True, bounds,
+                tuple(self.addLayer(kid) for kid in layer.childNodes()))
+
+    # the earliest first keyframe of all layers, or default if earlier;
+    # an animated layer without keyframes counts as starting after the clip
+    def firstKeyframe(self, default):
+        return min([default] +
+                   [bounds[0] if bounds else self.clipEnd + 1
+                    for bounds in self.layerBounds])
+
+    # the latest last keyframe of all layers, or default if later
+    def lastKeyframe(self, default):
+        return max([default] +
+                   [bounds[1] if bounds else -1
+                    for bounds in self.layerBounds])
+
+    # every keyframe of the document's visible layers,
+    # the same ones the index was made from
+    def readTimes(self, doc):
+        times = set()
+
+        def readLayer(layer, bounds):
+            if not layer.visible():
+                return
+            if layer.animated():
+                first, last = next(bounds) or (0, -1)
+                times.update(frame for frame in range(first, last + 1)
+                             if frame in (first, last)
+                             or layer.hasKeyframeAtTime(frame))
+            for kid in layer.childNodes():
+                readLayer(kid, bounds)
+
+        bounds = iter(self.layerBounds)
+        for layer in doc.topLevelNodes():
+            readLayer(layer, bounds)
+        self.sortedTimes = sorted(times)
+
+    # the ones below need readTimes() first
+
+    def hasKeyframeAt(self, time):
+        position = bisect.bisect_left(self.sortedTimes, time)
+        return (position < len(self.sortedTimes)
+                and self.sortedTimes[position] == time)
+
+    # sorted times at which any visible layer has a keyframe
+    def keyframeTimes(self):
+        return self.sortedTimes
+
+    # whether a keyframe comes after a time and up to another one,
+    # i.e. whether the document can look different at the second
+    def changesBetween(self, after, upTo):
+        position = bisect.bisect_right(self.sortedTimes, after)
+        return (position < len(self.sortedTimes)
+                and self.sortedTimes[position] <= upTo)
+
+
+# (first, last) keyframe of an animated layer,
+# only looking from each end up to the first one found
+def keyframeBounds(layer, clipEnd):
+    first = 0
+    while first <= clipEnd and not layer.hasKeyframeAtTime(first):
+        first += 1
+    if first > clipEnd:
+        return None
+    last = clipEnd
+    while last > first and not layer.hasKeyframeAtTime(last):
+        last -= 1
+    return (first, last)
+
+
+# out of these frames (in order), the ones showing something new,
+# and frame -> the frame it's held from for the others;
+# a frame in starts always shows something new
+# (so an animation never starts on a frame held from another)
+def exposures(index, frameTimes, starts=()):
+    exposed = []
+    held = {}
+    previous = None
+    for time in frameTimes:
+        if (previous is not None and time not in starts
+                and not index.changesBetween(previous, time)):
+            held[time] = exposed[-1]
+        else:
+            exposed.append(time)
+        previous = time
+    return exposed, held
+
+
+# document file name (or name, if it was never saved) -> its index
+indexes = {}
+
+
+def documentKey(doc):
+    return doc.fileName() or doc.name()
+
+
+# the cached index of a document, made again if it changed;
+# with allKeyframes, every keyframe is read too: again if fresh,
+# since a keyframe that moved inside a layer's range isn't in the key
+def forDocument(doc, allKeyframes=False, fresh=False):
+    index = KeyframeIndex(doc)
+    cached = indexes.get(documentKey(doc))
+    if cached is not None and cached.key == index.key:
+        index = cached
+    else:
+        indexes[documentKey(doc)] = index
+    if allKeyframes and (fresh or index.sortedTimes is None):
+        index.readTimes(doc)
+    return index
+
+
+# forget the index of a document (once it's closed), or of every document
+def invalidate(doc=None):
+    if doc is None:
+        indexes.clear()
+    else:
+        indexes.pop(documentKey(doc), None)
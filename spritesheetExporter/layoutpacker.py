@@ -0,0 +1,384 @@
+"""
+layout engines deciding where each sprite goes on the spritesheet:
+the good old rows and columns grid, and two bin packers
+(MaxRects and skyline) for sprites of different sizes
+
+every packer takes a list of (width, height) sizes and gives back,
+in the same order, a list of (x, y, rotated) placements
+(None for the sprites that didn't fit), and sets its own
+width and height to the final size of the sheet
+
+"""
+
+import bisect
+from math import sqrt, ceil
+
+
+def powerOfTwo(value):
+    power = 1
+    while power < value:
+        power *= 2
+    return power
+
+
+# rows and columns of a grid of count cells, those at 0 guessed:
+# both for a square fit, or the other from the one that's given
+def gridShape(count, rows=0, columns=0):
+    if count == 0:
+        return rows, columns
+    if rows == 0 and columns == 0:
+        columns = ceil(sqrt(count))
+        rows = ceil(float(count)/columns)
+    elif rows == 0:
+        rows = ceil(float(count)/columns)
+    # Though if I have to guess the number of columns,
+    # it may also change the (user-set) number of rows.
+    # For example, if you want ten rows from twelve sprites
+    # instead of two rows of two and eight of one,
+    # you'll have six rows of two
+    elif columns == 0:
+        columns = ceil(float(count)/rows)
+        rows = ceil(float(count)/columns)
+    return rows, columns
+
+
+# top left corner of the imgNum-th cell of a rows and columns grid
+def gridPosition(imgNum, columns, rows, isDirectionHorizontal, width, height):
+    if isDirectionHorizontal:
+        return (int(imgNum % columns) * int(width),
+                (int(imgNum/columns)) * int(height))
+    else:
+        return (int(imgNum / rows) * int(width),
+                int(imgNum % rows) * int(height))
+
+
+class Packer(object):
+    name = ""
+
+    # maxWidth and maxHeight at 0 mean no limit;
+    # rotated sprites are turned 90 degrees clockwise
+    def __init__(self, maxWidth=0, maxHeight=0,
+                 powerOfTwo=False, allowRotation=False):
+        self.maxWidth = maxWidth
+        self.maxHeight = maxHeight
+        self.powerOfTwo = powerOfTwo
+        self.allowRotation = allowRotation
+        self.width = 0
+        self.height = 0
+
+    def pack(self, sizes):
+        raise NotImplementedError
+
+    # the final sheet size, once we know what we used of it
+    def setSheetSize(self, width, height):
+        if self.powerOfTwo:
+            width = powerOfTwo(width)
+            height = powerOfTwo(height)
+        self.width = width
+        self.height = height
+
+
+class GridPacker(Packer):
+    name = "grid"
+
+    # every cell is as big as the biggest sprite;
+    # rows and columns at 0 are guessed like the exporter always did
+    def __init__(self, rows=0, columns=0, isDirectionHorizontal=True,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.rows = rows
+        self.columns = columns
+        self.isDirectionHorizontal = isDirectionHorizontal
+
+    # cells, if given, is which cell of the grid each sprite goes in
+    def pack(self, sizes, cells=None):
+        count = len(sizes)
+        if count == 0:
+            self.setSheetSize(0, 0)
+            return []
+        self.rows, self.columns = gridShape(count, self.rows, self.columns)
+        cellWidth = max(size[0] for size in sizes)
+        cellHeight = max(size[1] for size in sizes)
+        if cells is None:
+            cells = range(count)
+        if ((self.maxWidth and self.columns * cellWidth > self.maxWidth)
+                or (self.maxHeight and self.rows * cellHeight > self.maxHeight)):
+            return self.packClamped(count, cellWidth, cellHeight)
+        placements = []
+        for imgNum in cells:
+            x, y = gridPosition(imgNum, self.columns, self.rows,
+                                self.isDirectionHorizontal,
+                                cellWidth, cellHeight)
+            placements.append((x, y, False))
+        self.setSheetSize(self.columns * cellWidth, self.rows * cellHeight)
+        return placements
+
+    # the grid is too big: only keep the rows and columns
+    # that fit in the max size, the other sprites are left out
+    def packClamped(self, count, cellWidth, cellHeight):
+        if self.maxWidth:
+            self.columns = min(self.columns, self.maxWidth // cellWidth)
+        if self.maxHeight:
+            self.rows = min(self.rows, self.maxHeight // cellHeight)
+        if self.columns == 0 or self.rows == 0:
+            self.setSheetSize(0, 0)
+            return [None] * count
+        placements = []
+        usedWidth = 0
+        usedHeight = 0
+        for imgNum in range(count):
+            if imgNum >= self.columns * self.rows:
+                placements.append(None)
+                continue
+            x, y = gridPosition(imgNum, self.columns, self.rows,
+                                self.isDirectionHorizontal,
+                                cellWidth, cellHeight)
+            placements.append((x, y, False))
+            usedWidth = max(usedWidth, x + cellWidth)
+            usedHeight = max(usedHeight, y + cellHeight)
+        self.setSheetSize(usedWidth, usedHeight)
+        return placements
+
+
+class BinPacker(Packer):
+
+    # the bin is as wide as a square holding all the sprites would be,
+    # and as tall as it needs to (or as it is allowed to)
+    def guessBinWidth(self, sizes):
+        area = sum(width * height for width, height in sizes)
+        widest = max(min(size) if self.allowRotation else size[0]
+                     for size in sizes)
+        width = max(widest, int(ceil(sqrt(area))))
+        if self.powerOfTwo:
+            width = powerOfTwo(width)
+        if self.maxWidth:
+            width = min(width, self.maxWidth)
+        return width
+
+    def guessBinHeight(self, sizes):
+        if self.maxHeight:
+            return self.maxHeight
+        return sum(max(size) for size in sizes)
+
+    def pack(self, sizes):
+        if len(sizes) == 0:
+            self.setSheetSize(0, 0)
+            return []
+        binWidth = self.guessBinWidth(sizes)
+        binHeight = self.guessBinHeight(sizes)
+        self.start(binWidth, binHeight)
+        # big sprites first, they're the hardest to place
+        order = sorted(range(len(sizes)),
+                       key=lambda i: (max(sizes[i]), sizes[i][0] * sizes[i][1]),
+                       reverse=True)
+        # the shortest side of all the sprites still to place:
+        # free space narrower than that will never be used
+        self.smallest = [0] * len(order)
+        smallest = max(max(size) for size in sizes)
+        for k in range(len(order) - 1, -1, -1):
+            smallest = min(smallest, min(sizes[order[k]]))
+            self.smallest[k] = smallest
+        placements = [None] * len(sizes)
+        usedWidth = 0
+        usedHeight = 0
+        for k, i in enumerate(order):
+            self.placed = k
+            width, height = sizes[i]
+            placement = self.insert(width, height)
+            if placement is None:
+                continue
+            placements[i] = placement
+            x, y, rotated = placement
+            if rotated:
+                width, height = height, width
+            usedWidth = max(usedWidth, x + width)
+            usedHeight = max(usedHeight, y + height)
+        self.setSheetSize(usedWidth, usedHeight)
+        return placements
+
+    def start(self, binWidth, binHeight):
+        raise NotImplementedError
+
+    def insert(self, width, height):
+        raise NotImplementedError
+
+    def orientations(self, width, height):
+        if self.allowRotation and width != height:
+            return ((width, height, False), (height, width, True))
+        return ((width, height, False),)
+
+
+class MaxRectsPacker(BinPacker):
+    name = "maxrects"
+
+    def start(self, binWidth, binHeight):
+        # the free rectangles, as (y, x, width, height) sorted
+        # top to bottom then left to right;
+        # they can overlap but none is inside another
+        self.freeRects = [(0, 0, binWidth, binHeight)]
+
+    # bottom left rule: lowest top edge, then leftmost,
+    # keeps the sheet compact since its height is open ended;
+    # the free rectangles being in that order,
+    # the first one the sprite fits in is the best
+    def insert(self, width, height):
+        best = None
+        bestScore = None
+        for w, h, rotated in self.orientations(width, height):
+            for fy, fx, fw, fh in self.freeRects:
+                if bestScore is not None and fy + h > bestScore[0]:
+                    # the rest are lower, they can't do better
+                    break
+                if w <= fw and h <= fh:
+                    score = (fy + h, fx)
+                    if bestScore is None or score < bestScore:
+                        bestScore = score
+                        best = (fx, fy, w, h, rotated)
+                    break
+        if best is None:
+            return None
+        x, y, w, h = best[:4]
+        self.splitFreeRects(x, y, w, h)
+        return (x, y, best[4])
+
+    def splitFreeRects(self, x, y, w, h):
+        right = x + w
+        bottom = y + h
+        smallest = self.smallest[self.placed + 1] \
+            if self.placed + 1 < len(self.smallest) else 0
+        freeRects = self.freeRects
+        # only the free rectangles starting above the placed one's
+        # bottom can overlap it (or touch it, starting right at it),
+        # and of those only the ones reaching it sideways and down:
+        # the others are left as they are
+        end = bisect.bisect_right(freeRects, (bottom, float("inf")))
+        near = [i for i, (fy, fx, fw, fh) in enumerate(freeRects[:end])
+                if fx <= right and fx + fw >= x and fy + fh >= y]
+        removed = []
+        # the kept rectangles touching the placed one,
+        # the only ones that can hold a new one
+        touching = []
+        added = []
+        for i in near:
+            free = freeRects[i]
+            fy, fx, fw, fh = free
+            fright = fx + fw
+            fbottom = fy + fh
+            if (x >= fright or right <= fx or y >= fbottom or bottom <= fy):
+                if fw < smallest or fh < smallest:
+                    # nothing left to place will ever fit in it
+                    removed.append(i)
+                elif ((fright == x or fx == right) and fy < bottom and fbottom > y) \
+                        or ((fbottom == y or fy == bottom) and fx < right and fright > x):
+                    touching.append(free)
+                continue
+            removed.append(i)
+            # what's left of the free rectangle on each side
+            # of the one we just placed
+            if x > fx:
+                added.append((fy, fx, x - fx, fh))
+            if right < fright:
+                added.append((fy, right, fright - right, fh))
+            if y > fy:
+                added.append((fy, fx, fw, y - fy))
+            if bottom < fbottom:
+                added.append((bottom, fx, fw, fbottom - bottom))
+        # the new rectangles all touch the placed one,
+        # so they can only be inside another new one
+        # or a kept one that touches it too
+        added = set(rect for rect in added
+                    if rect[2] >= smallest and rect[3] >= smallest)
+        pruned = [rect for rect in added
+                  if not any(other != rect and contains(other, rect)
+                             for other in added)
+                  and not any(contains(other, rect) for other in touching)]
+        for i in reversed(removed):
+            del freeRects[i]
+        # the new ones start at or above the placed one's bottom,
+        # so they go among the rectangles that were looked at
+        for rect in pruned:
+            bisect.insort(freeRects, rect)
+
+
+# whether inner is inside outer, both as (y, x, width, height)
+def contains(outer, inner):
+    return (inner[0] >= outer[0] and inner[1] >= outer[1]
+            and inner[1] + inner[2] <= outer[1] + outer[2]
+            and inner[0] + inner[3] <= outer[0] + outer[3])
+
+
+class SkylinePacker(BinPacker):
+    name = "skyline"
+
+    def start(self, binWidth, binHeight):
+        self.binWidth = binWidth
+        self.binHeight = binHeight
+        # the top outline of what was placed, as [x, y, width] segments
+        self.skyline = [[0, 0, binWidth]]
+
+    # bottom left rule again: lowest top edge, then leftmost
+    def insert(self, width, height):
+        best = None
+        bestScore = None
+        for w, h, rotated in self.orientations(width, height):
+            for i in range(len(self.skyline)):
+                y = self.fitAt(i, w, h)
+                if y is None:
+                    continue
+                score = (y + h, self.skyline[i][0])
+                if bestScore is None or score < bestScore:
+                    bestScore = score
+                    best = (i, self.skyline[i][0], y, w, h, rotated)
+        if best is None:
+            return None
+        i, x, y, w, h, rotated = best
+        self.addSegment(i, x, y + h, w)
+        return (x, y, rotated)
+
+    # how low a w by h sprite can sit if its left edge is
+    # on the i-th segment, or None if it doesn't fit
+    def fitAt(self, i, w, h):
+        x = self.skyline[i][0]
+        if x + w > self.binWidth:
+            return None
+        y = 0
+        remaining = w
+        while remaining > 0:
+            segment = self.skyline[i]
+            y = max(y, segment[1])
+            if y + h > self.binHeight:
+                return None
+            remaining -= segment[2]
+            i += 1
+        return y
+
+    def addSegment(self, i, x, y, w):
+        self.skyline.insert(i, [x, y, w])
+        right = x + w
+        # shorten or remove the segments now under the new one
+        j = i + 1
+        while j < len(self.skyline):
+            segment = self.skyline[j]
+            if segment[0] >= right:
+                break
+            overlap = right - segment[0]
+            if overlap >= segment[2]:
+                del self.skyline[j]
+            else:
+                segment[0] += overlap
+                segment[2] -= overlap
+                break
+        # merge neighbours at the same height
+        j = 0
+        while j < len(self.skyline) - 1:
+            if self.skyline[j][1] == self.skyline[j + 1][1]:
+                self.skyline[j][2] += self.skyline[j + 1][2]
+                del self.skyline[j + 1]
+            else:
+                j += 1
+
+
+packers = {
+    GridPacker.name: GridPacker,
+    MaxRectsPacker.name: MaxRectsPacker,
+    SkylinePacker.name: SkylinePacker}
@@ -0,0 +1,200 @@
+"""
+works out what an export will make before anything is rendered:
+which frames get a cell, the rect of each one on the sheet
+(or on which page), how big the sheet is, and about how much memory
+the export will take and how big its files can get
+
+it only knows the frames' canvas size, so for a grid of full frames
+the plan is exactly what the export does; trimming and duplicates
+can only make the sheet smaller, so with them it's an upper bound
+
+nothing is rendered nor allocated (and numpy isn't needed),
+so the dialog can ask for a plan every time a setting changes
+
+"""
+
+import os
+
+from . import layoutpacker
+from . import pngencoder
+from . import sheetformats
+
+
+# bytes per channel of each of krita's color depths
+channelBytes = {"U8": 1, "U16": 2, "F16": 2, "F32": 4}
+
+# what most gpus can load as a single texture
+maxTextureSize = 16384
+
+
+# the frames an export goes through, in order: every step frames
+# from start to end, or every frame of the named animations
+def frameTimes(start, end, step, animations=()):
+    if animations:
+        return sorted({frame
+            for name, first, last, animationStep in animations
+            for frame in range(first, last + 1, animationStep)})
+    return list(range(start, end + 1, step))
+
+
+class LayoutPlan(object):
+
+    def __init__(self, frames, frameWidth, frameHeight):
+        # the frames that get a cell, in the order of their cells
+        self.frames = list(frames)
+        self.frameWidth = frameWidth
+        self.frameHeight = frameHeight
+        self.rows = 0
+        self.columns = 0
+        # what else decided where the frames go
+        self.isDirectionHorizontal = True
+        self.maxSheetSize = 0
+        self.powerOfTwo = False
+        # (width, height) of each page, the first one being the sheet
+        self.pages = []
+        # frame number -> (page, x, y, width, height)
+        self.rects = {}
+        # set by estimate()
+        self.peakBytes = 0
+        self.outputBytes = 0
+        # what's wrong with it, for the dialog to warn about
+        self.warnings = []
+
+    @property
+    def width(self):
+        return self.pages[0][0] if self.pages else 0
+
+    @property
+    def height(self):
+        return self.pages[0][1] if self.pages else 0
+
+
+# the grid of full frames the exporter would make, with the sprites
+# that don't fit in maxSheetSize overflowing on other pages
+def plan(frames, frameWidth, frameHeight, rows=0, columns=0,
+         isDirectionHorizontal=True, maxSheetSize=0, powerOfTwo=False):
+    layout = LayoutPlan(frames, frameWidth, frameHeight)
+    layout.isDirectionHorizontal = isDirectionHorizontal
+    layout.maxSheetSize = maxSheetSize
+    layout.powerOfTwo = powerOfTwo
+    layout.rows, layout.columns = layoutpacker.gridShape(
+        len(layout.frames), rows, columns)
+    remaining = layout.frames
+    while remaining:
+        packer = layoutpacker.GridPacker(
+            rows=layout.rows, columns=layout.columns,
+            isDirectionHorizontal=isDirectionHorizontal,
+            maxWidth=maxSheetSize, maxHeight=maxSheetSize,
+            powerOfTwo=powerOfTwo)
+        placements = packer.pack([(frameWidth, frameHeight)] * len(remaining))
+        page = len(layout.pages)
+        overflow = []
+        for frame, placement in zip(remaining, placements):
+            if placement is None:
+                overflow.append(frame)
+            else:
+                x, y, rotated = placement
+                layout.rects[frame] = (page, x, y, frameWidth, frameHeight)
+        if len(overflow) == len(remaining):
+            raise ValueError("the sprites don't fit in a " +
+                str(maxSheetSize) + " pixels wide spritesheet")
+        layout.pages.append((packer.width, packer.height))
+        remaining = overflow
+    return layout
+
+
+# how many bytes a page can take as a file: the packed formats
+# are exactly their pixels, the others at worst barely more
+def pageBytes(width, height, sheetFormat, sheetDepth):
+    if sheetFormat in sheetformats.packedFormats:
+        glTypeSize = sheetformats.packedFormats[sheetFormat][1][1]
+        pixelBytes = 4 if sheetFormat == "rgba8" else glTypeSize
+        return 96 + height * (-(-width * pixelBytes // 4) * 4)
+    if sheetFormat == "png-indexed":
+        return 1024 + height * (width + 1)
+    return 1024 + height * (width * 4 * channelBytes[sheetDepth] + 1)
+
+
+# what the export will need, filled in the plan: peakBytes,
+# the memory used at its worst (krita's own documents aside),
+# and outputBytes, how big the sheets can get on disk;
+# frames captured in memory wait there until they're all in,
+# unless they go in a scratch file, and each page is in memory
+# twice (the array and its bytes) unless it's written in bands
+def estimate(layout, colorDepth, sheetFormat="png", useCompositor=False,
+             outputDepth="", scales=(), lowMemory=False,
+             scratchFrames=False, framesInFlight=0, inMemory=False):
+    sheetDepth = colorDepth
+    if useCompositor and outputDepth == "U8":
+        sheetDepth = "U8"
+    framePixel = 4 * channelBytes[colorDepth]
+    sheetPixel = 4 * channelBytes[sheetDepth]
+    count = len(layout.frames)
+    frameArea = layout.frameWidth * layout.frameHeight
+    # every size the sheet is written at, as (scale, its plan)
+    layouts = [(1, layout)]
+    if useCompositor:
+        for scale in sorted({float(scale) for scale in scales
+                             if scale > 0 and scale != 1}):
+            layouts.append((scale, plan(
+                layout.frames,
+                max(1, int(round(layout.frameWidth * scale))),
+                max(1, int(round(layout.frameHeight * scale))),
+                layout.rows, layout.columns, layout.isDirectionHorizontal,
+                layout.maxSheetSize, layout.powerOfTwo)))
+    pages = [page for scale, scaled in layouts for page in scaled.pages]
+    biggestPage = max([width * height for width, height in pages] or [0])
+
+    if useCompositor:
+        waiting = 0
+        if not scratchFrames:
+            waiting = sum(count * scaled.frameWidth * scaled.frameHeight
+                          for scale, scaled in layouts) * sheetPixel
+        stripWriting = lowMemory and sheetFormat in ("png", "png-optimized")
+        pageMemory = 2 * biggestPage * sheetPixel
+        if stripWriting:
+            # a band of rows, and the sprites crossing it
+            # (never more than the page itself)
+            pageMemory = min(pageMemory, 2 * pngencoder.stripBytes)
+        layout.peakBytes = waiting + pageMemory + framesInFlight * (
+            frameArea * framePixel)
+    else:
+        # a layer per frame in a new document, and its projection
+        layout.peakBytes = (count * frameArea + 2 * biggestPage) * framePixel
+        if inMemory:
+            layout.peakBytes += count * frameArea * framePixel
+    layout.outputBytes = sum(pageBytes(width, height, sheetFormat, sheetDepth)
+                             for width, height in pages)
+
+    layout.warnings = []
+    for width, height in pages:
+        if max(width, height) > maxTextureSize:
+            layout.warnings.append(
+                "a " + str(width) + "x" + str(height) +
+                " sheet is bigger than most gpus can load (" +
+                str(maxTextureSize) + " pixels)")
+            break
+    memory = physicalMemory()
+    if memory and layout.peakBytes > memory // 2:
+        layout.warnings.append(
+            "the export may need " + describeBytes(layout.peakBytes) +
+            " of this computer's " + describeBytes(memory) + " of memory")
+    return layout
+
+
+# the computer's memory in bytes, None where we can't tell
+def physicalMemory():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def describeBytes(size):
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024.0
+    if unit == "bytes":
+        return str(int(size)) + " bytes"
+    return "{:.1f} {}".format(size, unit)
@@ -0,0 +1,209 @@
+"""
+conversions between krita's raw pixel data and numpy arrays
+
+"""
+
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy isn't shipped with every build of krita;
+    # whatever relies on it falls back to krita's own layers
+    np = None
+
+
+# numpy type of one channel for each of krita's color depths
+channelTypes = {
+    "U8": "uint8",
+    "U16": "uint16",
+    "F16": "float16",
+    "F32": "float32"}
+
+# struct format of one channel, for when numpy isn't there
+channelFormats = {
+    "U8": "B",
+    "U16": "H",
+    "F16": "e",
+    "F32": "f"}
+
+# how many channels a pixel has in each of krita's color models,
+# the alpha always being the last one
+channelCounts = {
+    "A": 1,
+    "GRAYA": 2,
+    "RGBA": 4,
+    "XYZA": 4,
+    "LABA": 4,
+    "YCbCrA": 4,
+    "CMYKA": 5}
+
+
+def available():
+    return np is not None
+
+
+# we only know how to handle 4 channels images as arrays
+def supports(colorModel, colorDepth):
+    return available() and colorModel == "RGBA" and colorDepth in channelTypes
+
+
+# the QByteArray given by pixelData() as a (height, width, 4) array,
+# channels kept in krita's order (BGRA for integer depths)
+def toArray(data, width, height, colorDepth):
+    return np.frombuffer(
+        bytes(data), dtype=channelTypes[colorDepth]).reshape(height, width, 4)
+
+
+# and back to raw bytes that setPixelData() understands
+def toBytes(array):
+    return np.ascontiguousarray(array).tobytes()
+
+
+# a copy of the array with its alpha times opacity (0 to 255),
+# like krita blends a layer that isn't fully opaque
+def withOpacity(array, opacity):
+    pixels = array.copy()
+    alpha = pixels[..., -1].astype(np.float64) * (opacity / 255.0)
+    if np.issubdtype(array.dtype, np.integer):
+        alpha = np.rint(alpha)
+    pixels[..., -1] = alpha.astype(array.dtype)
+    return pixels
+
+
+# the same for raw pixel data of any color model, numpy or not;
+# None for a color model or depth we don't know the channels of
+def dataWithOpacity(data, colorModel, colorDepth, opacity):
+    channels = channelCounts.get(colorModel)
+    if channels is None or colorDepth not in channelTypes:
+        return None
+    if np is not None:
+        return toBytes(withOpacity(np.frombuffer(
+            bytes(data), dtype=channelTypes[colorDepth]).reshape(-1, channels),
+            opacity))
+    channelFormat = "=" + str(len(data) // struct.calcsize(
+        channelFormats[colorDepth])) + channelFormats[colorDepth]
+    values = list(struct.unpack(channelFormat, bytes(data)))
+    alpha = [value * (opacity / 255.0)
+             for value in values[channels - 1::channels]]
+    if colorDepth in ("U8", "U16"):
+        alpha = [int(round(value)) for value in alpha]
+    values[channels - 1::channels] = alpha
+    return struct.pack(channelFormat, *values)
+
+
+# 4x4 ordered dithering thresholds, between -0.5 and 0.5
+bayer = [[0, 8, 2, 10],
+         [12, 4, 14, 6],
+         [3, 11, 1, 9],
+         [15, 7, 13, 5]]
+
+
+# a frame of any depth as 8 bits BGRA, like krita's U8 pixels:
+# float channels are RGBA, and colors of a linear profile go through
+# the sRGB curve first; dithering adds an ordered (bayer) pattern
+# to the colors before rounding, so gradients don't band
+def toEightBit(array, colorDepth, dither=False, linear=False):
+    if colorDepth == "U8" and not linear:
+        return array
+    pixels = array.astype(np.float32)
+    if np.issubdtype(array.dtype, np.integer):
+        pixels *= 1.0 / np.iinfo(array.dtype).max
+    else:
+        pixels = np.clip(pixels[:, :, [2, 1, 0, 3]], 0.0, 1.0)
+    if linear:
+        color = pixels[:, :, :3]
+        pixels[:, :, :3] = np.where(
+            color <= 0.0031308, color * 12.92,
+            1.055 * np.power(color, 1 / 2.4) - 0.055)
+    pixels *= 255.0
+    if dither:
+        height, width = pixels.shape[:2]
+        thresholds = (np.array(bayer, dtype=np.float32) + 0.5) / 16 - 0.5
+        pixels[:, :, :3] += np.tile(
+            thresholds, (-(-height // 4), -(-width // 4)))[:height, :width, None]
+    return np.clip(np.rint(pixels), 0, 255).astype(np.uint8)
+
+
+# colors times alpha, what engines blending premultiplied textures expect
+def premultiplied(array):
+    if array.dtype == np.uint8:
+        # rounded integer division, no floats
+        color = array[:, :, :3].astype(np.uint16) * array[:, :, 3:]
+        pixels = array.copy()
+        pixels[:, :, :3] = (color + 127) // 255
+        return pixels
+    pixels = array.astype(np.float64)
+    if np.issubdtype(array.dtype, np.integer):
+        pixels[:, :, :3] *= pixels[:, :, 3:] / np.iinfo(array.dtype).max
+        pixels = np.rint(pixels)
+    else:
+        pixels[:, :, :3] *= pixels[:, :, 3:]
+    return pixels.astype(array.dtype)
+
+
+# x, y, width, height of the smallest rectangle
+# holding every pixel that isn't fully transparent,
+# or None if the whole frame is
+def opaqueBounds(array):
+    alpha = array[:, :, 3]
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if rows.size == 0:
+        return None
+    top = int(rows[0])
+    bottom = int(rows[-1]) + 1
+    # no need to look at the columns outside of the opaque rows
+    columns = np.flatnonzero(alpha[top:bottom].any(axis=0))
+    left = int(columns[0])
+    right = int(columns[-1]) + 1
+    return (left, top, right - left, bottom - top)
+
+
+# how much each source pixel (columns) weighs in each resampled pixel (rows),
+# for a row or column of size pixels going to newSize;
+# when shrinking, the kernel is stretched to cover every source pixel
+def resampleWeights(size, newSize, resampleFilter):
+    ratio = size / newSize
+    stretch = max(ratio, 1.0)
+    centers = (np.arange(newSize) + 0.5) * ratio
+    distances = ((np.arange(size) + 0.5)[None, :] - centers[:, None]) / stretch
+    if resampleFilter == "box":
+        weights = ((distances >= -0.5) & (distances < 0.5)).astype(np.float64)
+    else:
+        # "bilinear"
+        weights = np.maximum(0.0, 1.0 - np.abs(distances))
+    return weights / np.maximum(weights.sum(axis=1, keepdims=True), 1e-12)
+
+
+# the (height, width, 4) array scaled by scale (at least a pixel each way):
+# "nearest" keeps hard pixel art edges, "box" averages the pixels
+# each new one covers, "bilinear" blends the nearest ones;
+# colors are weighted by their alpha so transparent pixels don't darken
+# the edges, and nothing outside the array gets in
+def resample(array, scale, resampleFilter="box"):
+    height, width = array.shape[:2]
+    newWidth = max(1, int(round(width * scale)))
+    newHeight = max(1, int(round(height * scale)))
+    if (newWidth, newHeight) == (width, height):
+        return array.copy()
+    if resampleFilter == "nearest":
+        rows = np.minimum(((np.arange(newHeight) + 0.5) * height
+                           / newHeight).astype(np.intp), height - 1)
+        columns = np.minimum(((np.arange(newWidth) + 0.5) * width
+                              / newWidth).astype(np.intp), width - 1)
+        return array[rows][:, columns]
+    pixels = array.astype(np.float64)
+    alpha = pixels[:, :, 3:]
+    pixels[:, :, :3] *= alpha
+    rowWeights = resampleWeights(height, newHeight, resampleFilter)
+    columnWeights = resampleWeights(width, newWidth, resampleFilter)
+    # one axis then the other
+    pixels = np.tensordot(rowWeights, pixels, axes=(1, 0))
+    pixels = np.tensordot(pixels, columnWeights, axes=(1, 1)).transpose(0, 2, 1)
+    alpha = pixels[:, :, 3:]
+    pixels[:, :, :3] = np.divide(pixels[:, :, :3], alpha,
+                                 out=np.zeros_like(pixels[:, :, :3]),
+                                 where=alpha > 0)
+    if np.issubdtype(array.dtype, np.integer):
+        pixels = np.clip(np.rint(pixels), 0, np.iinfo(array.dtype).max)
+    return pixels.astype(array.dtype)
@@ -0,0 +1,290 @@
+"""
+a small png encoder working on krita's raw pixel data,
+so pngs can be written without going through a krita document
+
+the image is compressed in independent strips of rows
+(each one a piece of a single deflate stream, like pigz does)
+so the strips can be compressed in parallel and put back together;
+the strips only depend on the image's width,
+so the output is the same however many workers compress them
+
+rows are stored as they are (filter "none"), or with the png filter
+that makes each of them smallest ("adaptive", needs numpy)
+
+a PNGStream writes a png a few rows at a time instead,
+for images too big to hold in memory
+
+the document's color profile goes in an iCCP chunk, as (name, icc data):
+krita's python api doesn't give out the data, it's read back out of
+a png krita wrote (see readIccProfile())
+
+"""
+
+import struct
+import zlib
+from pathlib import Path
+
+from . import pixelbuffer
+
+
+signature = b"\x89PNG\r\n\x1a\n"
+
+# each strip holds about this many bytes of pixels
+stripBytes = 1 << 20
+
+# png bit depth for each of krita's color depths png can hold
+bitDepths = {"U8": 8, "U16": 16}
+
+
+def canEncode(colorModel, colorDepth):
+    return colorModel == "RGBA" and colorDepth in bitDepths
+
+
+def bytesPerPixel(colorDepth):
+    return 4 * bitDepths[colorDepth] // 8
+
+
+def rowsPerStrip(width, colorDepth):
+    return max(1, stripBytes // (width * bytesPerPixel(colorDepth)))
+
+
+def chunk(tag, data):
+    return (struct.pack(">I", len(data)) + tag + data +
+            struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+
+# the iCCP chunk of an icc profile: its name (1 to 79 latin-1
+# characters), compression method 0 and the zlib compressed data
+def iccpChunk(iccProfile):
+    name, data = iccProfile
+    name = name.strip().encode("latin-1", "replace")[:79].strip()
+    return chunk(b"iCCP", (name or b"ICC profile") + b"\0\0" +
+                 zlib.compress(data))
+
+
+# (name, icc data) of the png's iCCP chunk, None if it doesn't have one
+def readIccProfile(png):
+    position = len(signature)
+    while position + 8 <= len(png):
+        length, tag = struct.unpack(">I4s", png[position:position + 8])
+        if tag == b"iCCP":
+            data = png[position + 8:position + 8 + length]
+            name, rest = data.split(b"\0", 1)
+            return (name.decode("latin-1"), zlib.decompress(rest[1:]))
+        if tag in (b"IDAT", b"IEND"):
+            # it has to come before the pixels
+            return None
+        position += 12 + length
+    return None
+
+
+# krita's BGRA, little-endian for U16, to png's big-endian RGBA
+def toPNGOrder(data, colorDepth):
+    out = bytearray(data)
+    if colorDepth == "U8":
+        out[0::4] = data[2::4]
+        out[2::4] = data[0::4]
+    else:
+        out[0::8] = data[5::8]
+        out[1::8] = data[4::8]
+        out[2::8] = data[3::8]
+        out[3::8] = data[2::8]
+        out[4::8] = data[1::8]
+        out[5::8] = data[0::8]
+        out[6::8] = data[7::8]
+        out[7::8] = data[6::8]
+    return out
+
+
+# png's five filters on every row at once, the one giving the smallest
+# sum of absolute (signed) values kept for each row, as libpng does;
+# prior is the row just above the first one, if there is one
+def adaptiveFilter(pixels, prior, stride, pixelSize):
+    np = pixelbuffer.np
+    rows = np.frombuffer(bytes(pixels), dtype=np.uint8).reshape(-1, stride)
+    above = np.zeros_like(rows)
+    above[1:] = rows[:-1]
+    if prior is not None:
+        above[0] = np.frombuffer(bytes(prior), dtype=np.uint8)
+    left = np.zeros_like(rows)
+    left[:, pixelSize:] = rows[:, :-pixelSize]
+    aboveLeft = np.zeros_like(rows)
+    aboveLeft[:, pixelSize:] = above[:, :-pixelSize]
+
+    a = left.astype(np.int16)
+    b = above.astype(np.int16)
+    c = aboveLeft.astype(np.int16)
+    p = a + b - c
+    pa = np.abs(p - a)
+    pb = np.abs(p - b)
+    pc = np.abs(p - c)
+    paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    candidates = np.stack([
+        rows,
+        rows - left,
+        rows - above,
+        rows - ((a + b) >> 1).astype(np.uint8),
+        rows - paeth.astype(np.uint8)])
+    # smallest sum of the bytes seen as signed values
+    costs = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2)
+    best = costs.argmin(axis=0)
+    chosen = candidates[best, np.arange(len(rows))]
+    out = np.empty((len(rows), stride + 1), dtype=np.uint8)
+    out[:, 0] = best
+    out[:, 1:] = chosen
+    return out.tobytes()
+
+
+def canFilter(filterMode):
+    return filterMode == "none" or pixelbuffer.available()
+
+
+# krita's rows as png stores them, each one starting with its filter type
+def filterRows(rows, width, colorDepth, filterMode="none", prior=None):
+    stride = width * bytesPerPixel(colorDepth)
+    pixels = toPNGOrder(rows, colorDepth)
+    if filterMode == "adaptive":
+        if prior is not None:
+            prior = toPNGOrder(prior, colorDepth)
+        return adaptiveFilter(
+            pixels, prior, stride, bytesPerPixel(colorDepth))
+    # filter type 0 (none) in front of every row
+    return b"".join(
+        b"\x00" + pixels[start:start + stride]
+        for start in range(0, len(pixels), stride))
+
+
+# compress some rows of the image as a piece of raw deflate stream:
+# every strip but the last ends on a full flush, so they can
+# simply be put one after the other; also gives back the adler32
+# and length of the uncompressed rows, for the zlib trailer
+def encodeStrip(rows, width, colorDepth, level, last,
+                filterMode="none", prior=None):
+    filtered = filterRows(rows, width, colorDepth, filterMode, prior)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(filtered)
+    deflated += compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+    return (deflated, zlib.adler32(filtered), len(filtered))
+
+
+# zlib's adler32_combine(): the adler32 of two pieces of data
+# put together, knowing the adler32 of each and the second one's length
+def adler32Combine(adler1, adler2, length2):
+    base = 65521
+    remainder = length2 % base
+    sum1 = adler1 & 0xffff
+    sum2 = (remainder * sum1) % base
+    sum1 += (adler2 & 0xffff) + base - 1
+    sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + base - remainder
+    if sum1 >= base:
+        sum1 -= base
+    if sum1 >= base:
+        sum1 -= base
+    if sum2 >= (base << 1):
+        sum2 -= (base << 1)
+    if sum2 >= base:
+        sum2 -= base
+    return sum1 | (sum2 << 16)
+
+
+# the raw pixels of each strip, in order
+def splitStrips(data, width, height, colorDepth):
+    stride = width * bytesPerPixel(colorDepth)
+    step = rowsPerStrip(width, colorDepth)
+    return [data[row * stride:min(row + step, height) * stride]
+            for row in range(0, height, step)]
+
+
+# the row just above each strip (None for the first one),
+# that the filters look at
+def priorRows(data, width, height, colorDepth):
+    stride = width * bytesPerPixel(colorDepth)
+    step = rowsPerStrip(width, colorDepth)
+    return [data[(row - 1) * stride:row * stride] if row else None
+            for row in range(0, height, step)]
+
+
+# what comes before the pixels;
+# resolution is in dots per inch, as krita gives it
+def header(width, height, colorDepth, resolution=0, iccProfile=None):
+    png = signature + chunk(b"IHDR", struct.pack(
+        ">IIBBBBB", width, height, bitDepths[colorDepth], 6, 0, 0, 0))
+    if iccProfile is not None:
+        png += iccpChunk(iccProfile)
+    if resolution:
+        perMeter = int(round(resolution / 0.0254))
+        png += chunk(b"pHYs", struct.pack(">IIB", perMeter, perMeter, 1))
+    return png
+
+
+# the png file, out of the encodeStrip() results of every strip
+def assemble(strips, width, height, colorDepth, resolution=0,
+             iccProfile=None):
+    deflated = b"".join(strip[0] for strip in strips)
+    adler = 1
+    for strip in strips:
+        adler = adler32Combine(adler, strip[1], strip[2])
+    png = header(width, height, colorDepth, resolution, iccProfile)
+    # zlib header (deflate, 32K window) and trailer around the strips
+    png += chunk(b"IDAT", b"\x78\x9c" + deflated + struct.pack(">I", adler))
+    return png + chunk(b"IEND", b"")
+
+
+# everything at once, on this thread
+def encode(data, width, height, colorDepth, resolution=0, level=6,
+           filterMode="none", iccProfile=None):
+    data = bytes(data)
+    pieces = splitStrips(data, width, height, colorDepth)
+    priors = priorRows(data, width, height, colorDepth)
+    strips = [encodeStrip(rows, width, colorDepth, level, i == len(pieces) - 1,
+                          filterMode, priors[i])
+              for i, rows in enumerate(pieces)]
+    return assemble(strips, width, height, colorDepth, resolution,
+                    iccProfile)
+
+
+# a png written to its file as its rows come, top to bottom:
+# only the last row given is kept (the filters look at it),
+# compressed data goes out in IDAT chunks as soon as zlib gives some
+class PNGStream(object):
+
+    def __init__(self, path, width, height, colorDepth, resolution=0,
+                 level=6, filterMode="none", iccProfile=None):
+        self.width = width
+        self.colorDepth = colorDepth
+        self.filterMode = filterMode
+        self.stride = width * bytesPerPixel(colorDepth)
+        self.compressor = zlib.compressobj(level)
+        self.prior = None
+        self.path = Path(path)
+        self.file = open(str(path), "wb")
+        self.written = self.write(
+            header(width, height, colorDepth, resolution, iccProfile))
+
+    def write(self, data):
+        self.file.write(data)
+        return len(data)
+
+    # krita's raw pixels of one or more whole rows
+    def addRows(self, rows):
+        rows = bytes(rows)
+        if not rows:
+            return
+        deflated = self.compressor.compress(filterRows(
+            rows, self.width, self.colorDepth, self.filterMode, self.prior))
+        self.prior = rows[-self.stride:]
+        if deflated:
+            self.written += self.write(chunk(b"IDAT", deflated))
+
+    # gives back how big the png is
+    def close(self):
+        self.written += self.write(chunk(b"IDAT", self.compressor.flush()))
+        self.written += self.write(chunk(b"IEND", b""))
+        self.file.close()
+        return self.written
+
+    # for an export that stops halfway:
+    # no truncated png is left behind
+    def abort(self):
+        self.file.close()
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,45 @@
+"""
+a memory-mapped temporary file holding the captured frames,
+so they don't all have to stay in memory until the sheet is written:
+the system keeps in memory what's being used and leaves the rest on disk
+
+the file is made as big as it could ever need to be up front
+(it doesn't take any disk space until it's written to), so every frame
+is a numpy array reading straight from a single mapping
+
+"""
+
+import tempfile
+
+from . import pixelbuffer
+
+
+class ScratchBuffer(object):
+
+    # capacity in bytes, at least as much as every array stored
+    def __init__(self, capacity, directory=None):
+        self.capacity = max(1, capacity)
+        # removed once closed (right away on most systems)
+        self.file = tempfile.TemporaryFile(
+            prefix="spritesheetScratch", dir=directory)
+        self.file.truncate(self.capacity)
+        self.memory = pixelbuffer.np.memmap(
+            self.file, dtype=pixelbuffer.np.uint8, mode="r+",
+            shape=(self.capacity,))
+        self.used = 0
+
+    # a copy of the array in the file, as an array of the same shape
+    def store(self, array):
+        size = array.nbytes
+        if self.used + size > self.capacity:
+            raise MemoryError("the scratch buffer is full")
+        stored = self.memory[self.used:self.used + size].view(
+            array.dtype).reshape(array.shape)
+        stored[...] = array
+        self.used += size
+        return stored
+
+    # the arrays given by store() stay readable as long as they're used
+    def close(self):
+        self.memory = None
+        self.file.close()
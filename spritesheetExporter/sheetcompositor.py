@@ -0,0 +1,78 @@
+"""
+assembles the spritesheet in a single preallocated numpy array
+instead of a krita document with one layer per frame
+
+"""
+
+from krita import (Krita, InfoObject)
+
+from . import pixelbuffer
+
+
+class SheetCompositor(object):
+
+    def __init__(self, width, height, colorDepth):
+        self.width = int(width)
+        self.height = int(height)
+        self.colorDepth = colorDepth
+        # transparent everywhere no frame is blitted
+        self.pixels = pixelbuffer.np.zeros(
+            (self.height, self.width, 4),
+            dtype=pixelbuffer.channelTypes[colorDepth])
+
+    # copy a (height, width, 4) frame so its top left corner is at x, y,
+    # turning it 90 degrees clockwise first if asked to;
+    # whatever falls outside the sheet is left out
+    # (a band of the sheet only gets its part of each frame)
+    def blit(self, frame, x, y, rotated=False):
+        x = int(x)
+        y = int(y)
+        if rotated:
+            frame = pixelbuffer.np.rot90(frame, -1)
+        height, width = frame.shape[:2]
+        top = max(0, -y)
+        left = max(0, -x)
+        bottom = min(height, self.height - y)
+        right = min(width, self.width - x)
+        if top >= bottom or left >= right:
+            return
+        self.pixels[y + top:y + bottom, x + left:x + right] = \
+            frame[top:bottom, left:right]
+
+    # the whole sheet is handed over to krita once,
+    # in a single paint layer, and exported with the same
+    # color settings as the animated document
+    # (and krita's export settings for its format, if any)
+    def exportImage(self, path, name, colorModel, colorProfile, resolution,
+                    info=None):
+        sheet = Krita.instance().createDocument(
+            self.width, self.height, name,
+            colorModel, self.colorDepth, colorProfile, resolution)
+        sheet.setBatchmode(True)  # so it won't show the export dialog window
+        root_node = sheet.rootNode()
+        root_node.childNodes()[0].setVisible(False) # hide the default layer filled with white
+        layer = sheet.createNode(name, "paintlayer")
+        root_node.addChildNode(layer, None)
+        layer.setPixelData(
+            pixelbuffer.toBytes(self.pixels), 0, 0, self.width, self.height)
+        sheet.refreshProjection()
+        sheet.exportImage(str(path), info or InfoObject())
+        sheet.close()
+
+
+# a compositor holding the pixels of an image we wrote before,
+# to patch some of its sprites; None if it can't be loaded as such
+def load(path, colorDepth):
+    image = Krita.instance().openDocument(str(path))
+    if image is None:
+        return None
+    if image.colorModel() != "RGBA" or image.colorDepth() != colorDepth:
+        image.close()
+        return None
+    image.waitForDone()
+    compositor = SheetCompositor(image.width(), image.height(), colorDepth)
+    compositor.pixels[:] = pixelbuffer.toArray(
+        image.pixelData(0, 0, image.width(), image.height()),
+        image.width(), image.height(), colorDepth)
+    image.close()
+    return compositor
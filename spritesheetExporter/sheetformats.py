@@ -0,0 +1,246 @@
+"""
+the formats a spritesheet can be written in, besides krita's own png:
+
+- "png-optimized": our png encoder with the best png filter
+  for each row and the zlib level of your choice
+- "png-indexed": a palette png (up to 256 colors, 1, 2, 4 or 8 bits
+  per pixel), very small for pixel art; sheets with more colors
+  are quantized down to 256 first, which loses some of them
+- "webp": lossless webp, written by krita (5.1 and later)
+- "rgba4444", "rgb565" and "rgba8": the pixels packed as a gpu
+  uploads them, in a KTX (1.1) file: a 64 bytes header, then the rows
+  top to bottom, so a runtime can map the file and hand the data
+  straight to glTexImage2D (see packedPixels and encodeKTX)
+
+"""
+
+import struct
+import time
+import zlib
+from pathlib import Path
+
+from krita import InfoObject
+
+from . import pixelbuffer
+from . import pngencoder
+
+
+formats = ["png", "png-optimized", "png-indexed", "webp",
+           "rgba4444", "rgb565", "rgba8"]
+
+# the packed formats: how the texture atlas names them,
+# and their (glType, glTypeSize, glFormat, glInternalFormat) in KTX
+packedFormats = {
+    "rgba4444": ("RGBA4444", (0x8033, 2, 0x1908, 0x8056)),
+    "rgb565": ("RGB565", (0x8363, 2, 0x1907, 0x8D62)),
+    "rgba8": ("RGBA8888", (0x1401, 1, 0x1908, 0x8058))}
+
+
+def extension(sheetFormat):
+    if sheetFormat == "webp":
+        return ".webp"
+    if sheetFormat in packedFormats:
+        return ".ktx"
+    return ".png"
+
+
+# whether we can write a sheet of this color model and depth that way
+def canEncode(sheetFormat, colorModel, colorDepth):
+    if sheetFormat == "png-optimized":
+        return (pngencoder.canEncode(colorModel, colorDepth)
+                and pngencoder.canFilter("adaptive"))
+    if sheetFormat == "png-indexed" or sheetFormat in packedFormats:
+        return (colorModel == "RGBA" and colorDepth == "U8"
+                and pixelbuffer.available())
+    return sheetFormat in formats
+
+
+# the export settings krita's webp exporter understands
+def webpInfo():
+    info = InfoObject()
+    info.setProperty("lossless", True)
+    info.setProperty("quality", 100)
+    return info
+
+
+# (height, width, 4) rgba array -> palette (n, 4) and (height, width) indices;
+# with more than maxColors colors, every channel loses bits until
+# they're few enough, each palette entry being the mean of its colors
+def quantize(rgba, maxColors=256):
+    np = pixelbuffer.np
+    flat = np.ascontiguousarray(rgba).reshape(-1, 4)
+    keys = flat.view(np.uint32).reshape(-1)
+    bits = 8
+    while True:
+        palette, indices = np.unique(keys, return_inverse=True)
+        if len(palette) <= maxColors:
+            break
+        bits -= 1
+        mask = np.uint8((0xff << (8 - bits)) & 0xff)
+        keys = (flat & mask).copy().view(np.uint32).reshape(-1)
+    indices = indices.reshape(-1)
+    if bits == 8:
+        colors = palette.view(np.uint8).reshape(-1, 4)
+    else:
+        # the mean of the original colors that fell in each entry
+        counts = np.bincount(indices, minlength=len(palette))
+        colors = np.stack([
+            np.bincount(indices, weights=flat[:, channel],
+                        minlength=len(palette)) / counts
+            for channel in range(4)], axis=1).round().astype(np.uint8)
+    # transparent entries first, so the tRNS chunk can stop early
+    order = np.argsort(colors[:, 3], kind="stable")
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    return colors[order], remap[indices].reshape(rgba.shape[:2])
+
+
+def paletteBitDepth(colorsNum):
+    for bitDepth in (1, 2, 4):
+        if colorsNum <= 1 << bitDepth:
+            return bitDepth
+    return 8
+
+
+# the rows of indices packed bitDepth bits per pixel, each row
+# starting with its filter type (0: palette images compress best unfiltered)
+def packRows(indices, bitDepth):
+    np = pixelbuffer.np
+    height, width = indices.shape
+    indices = indices.astype(np.uint8)
+    if bitDepth < 8:
+        perByte = 8 // bitDepth
+        padded = np.zeros((height, -(-width // perByte) * perByte),
+                          dtype=np.uint8)
+        padded[:, :width] = indices
+        groups = padded.reshape(height, -1, perByte)
+        packed = np.zeros(groups.shape[:2], dtype=np.uint8)
+        for i in range(perByte):
+            packed |= groups[:, :, i] << (8 - bitDepth * (i + 1))
+        indices = packed
+    rows = np.zeros((height, indices.shape[1] + 1), dtype=np.uint8)
+    rows[:, 1:] = indices
+    return rows.tobytes()
+
+
+# krita's BGRA pixels as an indexed png
+def encodeIndexed(data, width, height, resolution=0, level=9,
+                  iccProfile=None):
+    bgra = pixelbuffer.toArray(data, width, height, "U8")
+    rgba = bgra[:, :, [2, 1, 0, 3]]
+    colors, indices = quantize(rgba)
+    bitDepth = paletteBitDepth(len(colors))
+
+    png = pngencoder.signature + pngencoder.chunk(b"IHDR", struct.pack(
+        ">IIBBBBB", width, height, bitDepth, 3, 0, 0, 0))
+    if iccProfile is not None:
+        png += pngencoder.iccpChunk(iccProfile)
+    if resolution:
+        perMeter = int(round(resolution / 0.0254))
+        png += pngencoder.chunk(
+            b"pHYs", struct.pack(">IIB", perMeter, perMeter, 1))
+    png += pngencoder.chunk(b"PLTE", colors[:, :3].tobytes())
+    opaque = colors[:, 3] == 255
+    if not opaque.all():
+        # alpha of every entry up to the last one that isn't opaque
+        png += pngencoder.chunk(
+            b"tRNS", colors[:len(colors) - int(opaque[::-1].argmin()), 3].tobytes())
+    png += pngencoder.chunk(
+        b"IDAT", zlib.compress(packRows(indices, bitDepth), level))
+    return png + pngencoder.chunk(b"IEND", b"")
+
+
+# krita's BGRA pixels as (height, width) 16 bits gpu pixels
+# (red in the high bits) or (height, width, 4) RGBA bytes;
+# dithering spreads the rounding error of the channels
+# losing bits in an ordered (bayer) pattern
+def packedPixels(data, width, height, sheetFormat, dither=False):
+    np = pixelbuffer.np
+    bgra = pixelbuffer.toArray(data, width, height, "U8")
+    rgba = bgra[:, :, [2, 1, 0, 3]]
+    if sheetFormat == "rgba8":
+        return rgba
+    bits = (4, 4, 4, 4) if sheetFormat == "rgba4444" else (5, 6, 5)
+    if dither:
+        thresholds = ((np.array(pixelbuffer.bayer, dtype=np.float32) + 0.5)
+                      / 16 - 0.5)
+        thresholds = np.tile(thresholds, (-(-height // 4), -(-width // 4)))
+        thresholds = thresholds[:height, :width]
+    packed = np.zeros((height, width), dtype=np.uint16)
+    shift = 16
+    for channel, channelBits in enumerate(bits):
+        levels = (1 << channelBits) - 1
+        values = rgba[:, :, channel].astype(np.float32) * (levels / 255.0)
+        if dither:
+            values += thresholds
+        shift -= channelBits
+        packed |= (np.clip(np.rint(values), 0, levels).astype(np.uint16)
+                   << shift)
+    return packed
+
+
+# a KTX 1.1 file of a single 2d texture, no mipmaps: little endian,
+# top row first (said so in its KTXorientation), rows padded to 4 bytes
+def encodeKTX(data, width, height, sheetFormat, dither=False):
+    np = pixelbuffer.np
+    glType, glTypeSize, glFormat, glInternalFormat = \
+        packedFormats[sheetFormat][1]
+    pixels = packedPixels(data, width, height, sheetFormat, dither)
+    rows = pixels.astype(pixels.dtype.newbyteorder("<")).reshape(
+        height, -1).view(np.uint8)
+    padding = -rows.shape[1] % 4
+    if padding:
+        rows = np.pad(rows, ((0, 0), (0, padding)))
+    keyValue = b"KTXorientation\x00S=r,T=d\x00"
+    keyValue = struct.pack("<I", len(keyValue)) + keyValue
+    keyValue += b"\x00" * (-len(keyValue) % 4)
+    ktx = (b"\xabKTX 11\xbb\r\n\x1a\n" + struct.pack(
+        "<13I", 0x04030201, glType, glTypeSize, glFormat, glInternalFormat,
+        0x1907 if sheetFormat == "rgb565" else 0x1908,
+        width, height, 0, 0, 1, 1, len(keyValue)) + keyValue)
+    return (ktx + struct.pack("<I", rows.size) + rows.tobytes())
+
+
+# the sheet as a file in one of our own formats
+# (not "webp" nor "png", that krita writes)
+def encode(sheetFormat, data, width, height, colorDepth,
+           resolution=0, level=9, dither=False, iccProfile=None):
+    if sheetFormat == "png-optimized":
+        return pngencoder.encode(data, width, height, colorDepth,
+                                 resolution, level, "adaptive", iccProfile)
+    if sheetFormat == "png-indexed":
+        return encodeIndexed(data, width, height, resolution, level,
+                             iccProfile)
+    if sheetFormat in packedFormats:
+        return encodeKTX(data, width, height, sheetFormat, dither)
+    raise ValueError("krita writes " + sheetFormat + " itself")
+
+
+# how big the sheet would be in each format and how long it takes
+# to write it: exportWithKrita(path, info) has krita write the sheet,
+# scratchPath (without extension) is where it can do so
+def compare(data, width, height, colorModel, colorDepth, resolution,
+            level, exportWithKrita, scratchPath):
+    report = {}
+    for sheetFormat in formats:
+        if not canEncode(sheetFormat, colorModel, colorDepth):
+            report[sheetFormat] = {"error": "can't be written from a " +
+                                   colorModel + " " + colorDepth + " image"}
+            continue
+        start = time.perf_counter()
+        if sheetFormat in ("png", "webp"):
+            path = Path(str(scratchPath) + extension(sheetFormat))
+            exportWithKrita(path, webpInfo() if sheetFormat == "webp"
+                            else InfoObject())
+            seconds = time.perf_counter() - start
+            if not path.exists():
+                report[sheetFormat] = {"error": "krita couldn't write it"}
+                continue
+            size = path.stat().st_size
+            path.unlink()
+        else:
+            size = len(encode(sheetFormat, data, width, height, colorDepth,
+                              resolution, level))
+            seconds = time.perf_counter() - start
+        report[sheetFormat] = {"bytes": size, "seconds": seconds}
+    return report
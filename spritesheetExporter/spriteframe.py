@@ -0,0 +1,72 @@
+"""
+one frame of the spritesheet: its pixels, where they come from
+in the original canvas and where they go on the sheet
+
+"""
+
+from . import pixelbuffer
+
+
+class SpriteFrame(object):
+
+    def __init__(self, name, pixels, cell=0):
+        # what the texture atlas calls it (the frame number)
+        self.name = name
+        # a (height, width, 4) array, let go of once it's on the sheet
+        self.pixels = pixels
+        self.width = pixels.shape[1]
+        self.height = pixels.shape[0]
+        self.sourceWidth = self.width
+        self.sourceHeight = self.height
+        # where the (possibly trimmed) pixels were in the original canvas
+        self.offsetX = 0
+        self.offsetY = 0
+        # which cell of the grid it goes in, and its position on the sheet
+        self.cell = cell
+        self.x = 0
+        self.y = 0
+        # turned 90 degrees clockwise on the sheet
+        self.rotated = False
+        # which sheet it's on, when they don't all fit in one
+        self.page = 0
+
+    @property
+    def trimmed(self):
+        return (self.width != self.sourceWidth
+                or self.height != self.sourceHeight)
+
+    # only keep the smallest rectangle holding all the opaque pixels
+    def trim(self):
+        bounds = pixelbuffer.opaqueBounds(self.pixels)
+        if bounds is None:
+            # fully transparent frame: we keep a single pixel
+            # so engines don't choke on an empty rect
+            bounds = (0, 0, 1, 1)
+        x, y, width, height = bounds
+        if (width, height) != (self.sourceWidth, self.sourceHeight):
+            # a copy, so the full frame can be freed
+            self.pixels = self.pixels[y:y + height, x:x + width].copy()
+            self.width = width
+            self.height = height
+            self.offsetX = x
+            self.offsetY = y
+
+    def atlasFrame(self, withTrimInfo=False):
+        frame = {
+            "filename": self.name,
+            "frame": { "x": self.x,
+                       "y": self.y,
+                       "w": self.width,
+                       "h": self.height}}
+        if self.rotated:
+            frame["rotated"] = True
+        if withTrimInfo:
+            # what engines need to put the trimmed pixels back in place
+            frame["trimmed"] = self.trimmed
+            frame["spriteSourceSize"] = { "x": self.offsetX,
+                                          "y": self.offsetY,
+                                          "w": self.width,
+                                          "h": self.height}
+            frame["sourceSize"] = { "w": self.sourceWidth,
+                                    "h": self.sourceHeight}
+        return frame
@@ -1,16 +1,82 @@
 from krita import (krita, InfoObject)
-from math import sqrt, ceil, floor
 import json
+import hashlib
+import os
+import tempfile
 
-from . import uispritesheetexporter
-# manages the dialog that lets you set user preferences
-# before applying the script
+from . import (pixelbuffer, sheetcompositor, spriteframe, layoutpacker)
+# numpy helpers, to assemble the sheet without a layer per frame
+
+from . import layoutplanner
+# where everything goes and what it will take, before rendering anything
+
+from . import keyframeindex
+# where the keyframes are, without asking every layer about every frame
+
+from . import exportmanifest
+# what the last export was made of, to only redo what changed
+
+from . import (pngencoder, encoderpool, exportpipeline)
+# to compress pngs on several cores,
+# and while krita renders the next frames
+
+from . import sheetformats
+# webp and smaller pngs than krita's
+
+from . import scratchbuffer
+# to write sheets bigger than memory, a band at a time
+
+from . import atlaswriters
+# the texture atlas for phaser, texture packer, godot or a game of your own
+
+from . import exporttrace
+# to know where the time goes
 
 from pathlib import Path
 # for path operations (who'd have guessed)
 
-from PyQt5.QtWidgets import QWidget, QLabel, QMessageBox
-# for debug messages
+from PyQt5.QtCore import QRect
+# for the part of a layer to save
+
+
+# only from version 4.2.x on can we use hasKeyframeAtTime
+def readsKeyframes():
+    ver = Application.version ()
+    return (int(ver[0]) > 4 or ( int(ver[0]) == 4 and int(ver[2]) >= 2))
+
+
+# raised from the progress checks once cancel() was called
+class ExportCancelled(Exception):
+    pass
+
+
+# (color model, depth, profile name) -> (name, icc data) of the profile
+iccProfiles = {}
+
+
+# the profile our own pngs embed, like krita's do: its python api
+# only gives out profile names, so krita writes a one pixel png
+# with the profile and we read it back (once per profile)
+def iccProfile(colorModel, colorDepth, profile):
+    key = (colorModel, colorDepth, profile)
+    if key not in iccProfiles:
+        handle, probePath = tempfile.mkstemp(".png")
+        os.close(handle)
+        probe = Krita.instance().createDocument(
+            1, 1, "icc", colorModel, colorDepth, profile, 72.0)
+        try:
+            probe.setBatchmode(True)
+            info = InfoObject()
+            # sRGB too, krita leaves it out otherwise
+            info.setProperty("saveSRGBProfile", True)
+            probe.exportImage(probePath, info)
+            probe.waitForDone()
+            iccProfiles[key] = pngencoder.readIccProfile(
+                Path(probePath).read_bytes())
+        finally:
+            probe.close()
+            Path(probePath).unlink(missing_ok=True)
+    return iccProfiles[key]
 
 
 class SpritesheetExporter(object):
@@ -35,89 +101,322 @@ class SpritesheetExporter(object):
         self.removeTmp = True
         self.step = 1
         self.layersAsAnimation = False
+        # with layersAsAnimation, each group layer is one frame
+        # (its layers together) instead of one frame per layer in it
+        self.groupsAsFrames = False
         self.writeTextureAtlas = False
+        # what the texture atlas looks like: "phaser" (exportName.json),
+        # "texturepacker-hash", "texturepacker-array", "godot"
+        # (exportName.tres) or "binary" (exportName.atlas), see atlaswriters
+        self.atlasFormat = "phaser"
+        # read each frame's pixels straight from the document's projection
+        # instead of saving it as a png and loading it back as a file layer
+        self.captureInMemory = False
+        self.frames = {}
+        # how the sheet is assembled: "layers" adds one krita layer per frame,
+        # "numpy" blits every frame into a single array (needs numpy)
+        self.compositor = "layers"
+        # crop each frame to its opaque pixels (needs the numpy compositor)
+        self.trim = False
+        # place pixel-identical frames only once on the sheet
+        # (frames are then captured in memory)
+        self.removeDuplicates = False
+        # frame number -> frame number of the first identical frame
+        self.duplicates = {}
+        # where the sprites go: "grid" (rows and columns),
+        # or the "maxrects" and "skyline" bin packers
+        self.packer = "grid"
+        # 0 for no limit on the sheet's width and height
+        self.maxSheetSize = 0
+        self.powerOfTwo = False
+        # let bin packers turn sprites 90 degrees if they fit better
+        self.allowRotation = False
+        # how many processes compress the pngs (frames and sheets);
+        # 0 lets krita write them one after the other
+        self.encodeWorkers = 0
+        # how many captured frames can wait to be processed in the background
+        # while krita renders the next ones; 0 does everything in turn
+        self.framesInFlight = 0
+        # what the sheet is written as: "png" (by krita), "png-optimized",
+        # "png-indexed" or "webp" (lossless), see sheetformats
+        self.sheetFormat = "png"
+        # zlib level of our own pngs, 0 (fastest) to 9 (smallest)
+        self.pngLevel = 9
+        # also write how big the sheet is in every format,
+        # and how long each one takes (exportName.formats.json)
+        self.compareFormats = False
+        # the depth frames are turned into once captured, so assembling
+        # and writing them costs no more than that: "U8" for 8 bits sRGB,
+        # "" to keep the document's (needs the numpy compositor)
+        self.outputDepth = ""
+        # ordered dithering when going down to 8 bits, so gradients don't band
+        self.dither = False
+        # colors multiplied by alpha in the sheet and sprites
+        # (needs the numpy compositor)
+        self.premultiplyAlpha = False
+        # write png sheets a band of rows at a time, straight to the file,
+        # instead of building each page whole in memory first, and keep
+        # the captured frames on disk like scratchFrames, so memory
+        # doesn't grow with the frames nor the sheet
+        # (needs the numpy compositor)
+        self.lowMemory = False
+        # keep the captured frames in a memory-mapped temporary file
+        # instead of memory until they're on the sheet
+        # (lowMemory does it too)
+        self.scratchFrames = False
+        # other sizes to write the sheet at, besides its own, e.g. [0.5, 2]
+        # for exportName@0.5x.png and exportName@2x.png along with
+        # exportName.png (and their atlases); needs the numpy compositor
+        self.scales = []
+        # how the frames are resized for them:
+        # "nearest" (pixel art), "box" or "bilinear"
+        self.scaleFilter = "box"
+        # keep a manifest next to the sheet and only redo the frames
+        # that changed since the last export (needs the numpy compositor)
+        self.incremental = False
+        # named frame ranges, as (name, start, end, step), exported together
+        # in one sheet instead of start..end; the texture atlas then lists
+        # the frames of each of them
+        self.animations = []
+        # only render the frames where a visible layer has a keyframe
+        # (since the frame before), each once, and give each its
+        # "duration" (in ms) in the texture atlas instead of listing
+        # the frames it's held on
+        self.keyframesOnly = False
+        # write a trace of the export's steps next to the sheet
+        # (exportName.trace.json and exportName.trace.chrome.json)
+        self.traceExport = False
+        # and a cProfile of all of it (exportName.prof)
+        self.profileExport = False
+        # the last export's trace
+        self.trace = exporttrace.ExportTrace(enabled=False)
+        # called with (stage, done, total) after each frame
+        # ("render", then "assemble") and each page ("write");
+        # it can call cancel() to stop the export there
+        self.onProgress = None
+        self.cancelRequested = False
         self.layersList = []
         self.layersStates = []
         self.offLayers = 0
 
-    def positionLayer(self, layer, imgNum, width, height):
-        if self.isDirectionHorizontal:
-            layer.move(int(imgNum % self.columns) * int(width),
-                       (int(imgNum/self.columns)) * int(height))
-        else:
-            layer.move(int(imgNum / self.rows) * int(width),
-                       int(imgNum % self.rows) * int(height))
-
-    def checkLayerEnd(self, layer, doc):
-        if layer.visible():
-            if layer.animated():
-                frame = doc.fullClipRangeEndTime()
-                while not (layer.hasKeyframeAtTime(frame)
-                    or frame < 0):
-                    frame -=1
-                if self.end < frame:
-                    self.end = frame
-            if len(layer.childNodes()) != 0:
-            # if it was a group layer
-            # we also check its kids
-                for kid in layer.childNodes():
-                    self.checkLayerEnd(kid, doc)
-
-    def checkLayerStart(self, layer, doc):
-        if layer.visible():
-            if layer.animated():
-                frame = 0
-                while not (layer.hasKeyframeAtTime(frame)
-                    or frame > doc.fullClipRangeEndTime()):
-                    frame +=1
-                if self.start > frame:
-                    self.start = frame
-            if len(layer.childNodes()) != 0:
-                # if it was a group layer
-                # we also check its kids
-                for kid in layer.childNodes():
-                    self.checkLayerStart(kid, doc)
+    # anything but a grid of full frames is assembled in numpy
+    def wantsCompositor(self):
+        return (self.compositor == "numpy" or self.trim
+                or self.packer != "grid" or self.powerOfTwo
+                or self.maxSheetSize != 0 or self.incremental
+                or len(self.scales) > 0 or self.lowMemory
+                or self.scratchFrames or self.outputDepth != ""
+                or self.premultiplyAlpha)
+
+    # what decides where the sprites go, besides their sizes:
+    # if any of it changes, the last export's layout can't be reused
+    def layoutSettings(self, width, height, colorModel, colorDepth):
+        return { "width": width,
+                 "height": height,
+                 "colorModel": colorModel,
+                 "colorDepth": colorDepth,
+                 "exportName": self.exportName,
+                 "packer": self.packer,
+                 "rows": self.rows,
+                 "columns": self.columns,
+                 "isDirectionHorizontal": self.isDirectionHorizontal,
+                 "maxSheetSize": self.maxSheetSize,
+                 "powerOfTwo": self.powerOfTwo,
+                 "allowRotation": self.allowRotation,
+                 "trim": self.trim,
+                 "removeDuplicates": self.removeDuplicates,
+                 "writeTextureAtlas": self.writeTextureAtlas,
+                 "atlasFormat": self.atlasFormat,
+                 "sheetFormat": self.sheetFormat,
+                 "pngLevel": self.pngLevel,
+                 "scales": list(self.scales),
+                 "scaleFilter": self.scaleFilter,
+                 "outputDepth": self.outputDepth,
+                 "dither": self.dither,
+                 "premultiplyAlpha": self.premultiplyAlpha,
+                 "animations": [list(animation)
+                                for animation in self.animations],
+                 "keyframesOnly": self.keyframesOnly}
+
+    def makePacker(self):
+        options = { "maxWidth": self.maxSheetSize,
+                    "maxHeight": self.maxSheetSize,
+                    "powerOfTwo": self.powerOfTwo,
+                    "allowRotation": self.allowRotation}
+        if self.packer == "grid":
+            return layoutpacker.GridPacker(
+                rows=self.rows, columns=self.columns,
+                isDirectionHorizontal=self.isDirectionHorizontal, **options)
+        return layoutpacker.packers[self.packer](**options)
 
     # get actual animation duration
-    def setStartEndFrames(self):
-        doc = Krita.instance().activeDocument()
-        layers = doc.topLevelNodes()
+    def setStartEndFrames(self, doc=None):
+        if doc is None:
+            doc = Krita.instance().activeDocument()
+        self.start, self.end = self.frameRange(doc)
+
+    # start and end of the animation, those at their default
+    # found from the keyframes
+    def frameRange(self, doc):
+        start = self.start
+        end = self.end
 
     # only from version 4.2.x on can we use hasKeyframeAtTime;
     # in earlier versions we just export from 0 to 100 as default
-        ver = Application.version ()
-        isNewVersion = (int(ver[0]) > 4 or ( int(ver[0]) == 4 and int(ver[2]) >= 2))
+        isNewVersion = readsKeyframes()
+        index = None
+        if isNewVersion and self.defaultTime in (start, end):
+            index = keyframeindex.forDocument(doc)
 
         # get the last frame smaller than
         # the clip end time (whose default is 100)
-        if self.end == self.defaultTime:
+        if end == self.defaultTime:
             if(isNewVersion):
-                for layer in layers:
-                    self.checkLayerEnd(layer, doc)
+                end = index.lastKeyframe(end)
             else:
-                self.end = 100
+                end = 100
         # get first frame of all visible layers
-        if self.start == self.defaultTime:
+        if start == self.defaultTime:
             if(isNewVersion):
-                self.start = self.end
-                for layer in layers:
-                    self.checkLayerStart(layer, doc)
+                start = index.firstKeyframe(end)
             else:
-                self.start = 0
-                
+                start = 0
+        return start, end
+
+    # the layers that are frames with layersAsAnimation, in order:
+    # every layer that isn't a group (and the groups themselves
+    # with groupsAsFrames), the kids of groups being looked at too
+    def frameLayers(self, layers):
+        for layer in layers:
+            if len(layer.childNodes()) != 0 and not (
+                    self.groupsAsFrames and layer.type() == "grouplayer"):
+                yield from self.frameLayers(layer.childNodes())
+            else:
+                yield layer
+
+    # the frames (out of these) where the document can look different
+    # from the frame before, and frame -> the frame it's held from
+    # for the others; fresh to read the keyframes again
+    # instead of trusting the cached ones
+    def exposures(self, doc, frames, fresh=False):
+        return keyframeindex.exposures(
+            keyframeindex.forDocument(doc, True, fresh), frames,
+            {start for name, start, end, step in self.animations})
+
+    # what an export with these settings would make of the document
+    # (the active one unless told otherwise), worked out without
+    # rendering anything: see layoutplanner
+    def planLayout(self, doc=None):
+        if doc is None:
+            doc = Krita.instance().activeDocument()
+        if self.layersAsAnimation:
+            visible = [layer.visible()
+                       for layer in self.frameLayers(doc.topLevelNodes())]
+            frames = [num for num in range(0, len(visible), self.step)
+                      if visible[num]]
+        else:
+            start, end = self.frameRange(doc)
+            frames = layoutplanner.frameTimes(start, end, self.step,
+                                              self.animations)
+            if self.keyframesOnly and readsKeyframes():
+                frames = self.exposures(doc, frames)[0]
+        useCompositor = (self.wantsCompositor() and
+            pixelbuffer.supports(doc.colorModel(), doc.colorDepth()))
+        if useCompositor:
+            layout = layoutplanner.plan(
+                frames, doc.width(), doc.height(), self.rows, self.columns,
+                self.isDirectionHorizontal, self.maxSheetSize, self.powerOfTwo)
+        else:
+            # krita's layers make a single sheet of it all
+            layout = layoutplanner.plan(
+                frames, doc.width(), doc.height(), self.rows, self.columns,
+                self.isDirectionHorizontal)
+        depth = doc.colorDepth()
+        if useCompositor and self.outputDepth == "U8":
+            depth = "U8"
+        sheetFormat = self.sheetFormat
+        if not sheetformats.canEncode(sheetFormat, doc.colorModel(), depth):
+            sheetFormat = "png"
+        return layoutplanner.estimate(
+            layout, doc.colorDepth(), sheetFormat, useCompositor,
+            self.outputDepth, self.scales, self.lowMemory,
+            self.scratchFrames or self.lowMemory, self.framesInFlight,
+            self.captureInMemory or self.removeDuplicates
+            or self.encodeWorkers > 0 or self.framesInFlight > 0
+            or self.layersAsAnimation)
+
     # - export all frames of the animation in a temporary folder as png
     # - create a new document of the right dimensions
     #   according to self.rows and self.columns
     # - position each exported frame in the new doc according to its name
     # - export the doc (aka the spritesheet)
     # - remove tmp folder if needed
-    def export(self, debugging=False):
+    # doc is the active document unless told otherwise
+    # (e.g. when exporting files that were never shown)
+    # gives back False if it was cancelled
+    def export(self, debugging=False, doc=None):
+        self.trace = exporttrace.ExportTrace(enabled=self.traceExport)
+        self.cancelRequested = False
+        # what to undo if the export is cancelled, last first
+        cleanup = []
+        # and what to let go of however it ends (worker processes,
+        # threads, temporary files, documents), last first
+        releases = []
+        profiler = None
+        if self.profileExport:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            with self.trace.span("export"):
+                self.exportSpritesheet(debugging, doc, cleanup, releases)
+            return True
+        except ExportCancelled:
+            with self.trace.span("cancel"):
+                for undo in reversed(cleanup):
+                    undo()
+            if debugging:
+                print("export cancelled")
+            return False
+        finally:
+            for release in reversed(releases):
+                try:
+                    release()
+                except Exception as error:
+                    # the export's own error matters more
+                    if debugging:
+                        print("couldn't release " + str(release) + ": " +
+                              str(error))
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(str(
+                    self.exportDir.joinpath(self.exportName + ".prof")))
+            if self.traceExport:
+                self.trace.save(
+                    self.exportDir.joinpath(self.exportName + ".trace.json"))
+                self.trace.saveChromeTrace(self.exportDir.joinpath(
+                    self.exportName + ".trace.chrome.json"))
 
+    # stop the export at the next frame or page
+    def cancel(self):
+        self.cancelRequested = True
+
+    def exportSpritesheet(self, debugging, doc, cleanup, releases):
+        trace = self.trace
+
+        def reportProgress(stage, done, total):
+            if self.onProgress is not None:
+                self.onProgress(stage, done, total)
+            if self.cancelRequested:
+                raise ExportCancelled()
 
         def debugPrint(message, usingTerminal = True):
+            trace.mark(message)
             if usingTerminal:
                 print(message)
             else:
+                # only imported for this, the exporter may run headless
+                from PyQt5.QtWidgets import QWidget, QMessageBox
                 QMessageBox.information(QWidget(), i18n("Debug info: "),
                 i18n(message))
 
@@ -130,28 +429,256 @@ class SpritesheetExporter(object):
         def fileNum(num):
             return "_" + str(num).zfill(3)
 
-        def exportFrame(num, doc, debugging = False):
-            doc.waitForDone()
-            imagePath = str(spritesExportPath(fileNum(num) + ".png"))
-            doc.exportImage(imagePath, InfoObject())
-            if(debugging):
-                debugPrint("exporting frame " + str(num) + " at " + imagePath)
-            
-        def getLayerState(layer, debugging = False):
-            if len(layer.childNodes()) != 0:
-                # if it was a group layer
-                # we also check its kids
-                for kid in layer.childNodes():
-                    getLayerState(kid, debugging)
-                    
+        # the sheet (or one of its pages) in the chosen format:
+        # getData() gives its pixels, exportWithKrita(path, info)
+        # has krita write it (to its part file, see partPath())
+        def writeSheet(finalPath, getData, sheetWidth, sheetHeight,
+                       exportWithKrita):
+            path = partPath(finalPath)
+            if self.compareFormats:
+                with trace.span("compare formats"):
+                    formatsReport[finalPath.name] = sheetformats.compare(
+                        getData(), sheetWidth, sheetHeight, col, depth, res,
+                        self.pngLevel, exportWithKrita,
+                        sheetExportPath("_compare"))
+            if sheetFormat == "png" and pool is not None:
+                pool.submit(path, getData(), sheetWidth, sheetHeight, depth, res,
+                            iccProfile=icc)
+            elif sheetFormat == "png-optimized" and pool is not None:
+                pool.submit(path, getData(), sheetWidth, sheetHeight, depth, res,
+                            self.pngLevel, "adaptive", icc)
+            elif sheetFormat in ("png", "webp"):
+                exportWithKrita(path, sheetformats.webpInfo()
+                                if sheetFormat == "webp" else InfoObject())
+                if trace.enabled and path.exists():
+                    trace.count("bytes written", path.stat().st_size)
+            else:
+                with trace.span("encode sheet", format=sheetFormat):
+                    image = sheetformats.encode(
+                        sheetFormat, getData(), sheetWidth, sheetHeight,
+                        depth, res, self.pngLevel, self.dither, icc)
+                with open(str(path), "wb") as f:
+                    f.write(image)
+                trace.count("bytes written", len(image))
+
+        # a page as a png written a band of rows at a time: only the band
+        # and the sprites still to go on it are in memory, never the page
+        def writeInStrips(path, pageWidth, pageHeight, placed):
+            path = partPath(path)
+            if sheetFormat == "png-optimized":
+                level, filterMode = self.pngLevel, "adaptive"
             else:
-                self.layersStates.append(layer.visible())
-                self.layersList.append(layer)
-                if(not layer.visible()):
-                    self.offLayers += 1
+                level, filterMode = 6, "none"
+            bandHeight = pngencoder.rowsPerStrip(pageWidth, depth)
+            # top to bottom, each sprite going on every band it crosses
+            placed = sorted(placed, key=lambda sprite: sprite.y)
+            active = []
+            nextSprite = 0
+            stream = pngencoder.PNGStream(path, pageWidth, pageHeight, depth,
+                                          res, level, filterMode, icc)
+            try:
+                for top in range(0, pageHeight, bandHeight):
+                    bottom = min(top + bandHeight, pageHeight)
+                    while (nextSprite < len(placed)
+                           and placed[nextSprite].y < bottom):
+                        active.append(placed[nextSprite])
+                        nextSprite += 1
+                    band = sheetcompositor.SheetCompositor(
+                        pageWidth, bottom - top, depth)
+                    still = []
+                    for sprite in active:
+                        band.blit(sprite.pixels, sprite.x, sprite.y - top,
+                                  sprite.rotated)
+                        spriteHeight = (sprite.width if sprite.rotated
+                                        else sprite.height)
+                        if sprite.y + spriteHeight > bottom:
+                            still.append(sprite)
+                        else:
+                            # the sprite's pixels aren't needed anymore
+                            sprite.pixels = None
+                    active = still
+                    with trace.span("encode band", top=top):
+                        stream.addRows(pixelbuffer.toBytes(band.pixels))
+            except BaseException:
+                stream.abort()
+                raise
+            trace.count("bytes written", stream.close())
+
+        # krita writes the png, we only know how big it ended up
+        def exportImage(image, imagePath):
+            image.exportImage(imagePath, InfoObject())
+            if trace.enabled and Path(imagePath).exists():
+                trace.count("bytes written", Path(imagePath).stat().st_size)
+
+        # the layer on its own, like the document would look
+        # with only that layer shown, without showing or hiding anything
+        def layerPixels(layer):
+            data = bytes(layer.projectionPixelData(0, 0, width, height))
+            if layer.opacity() == 255:
+                return data
+            faded = pixelbuffer.dataWithOpacity(
+                data, col, docDepth, layer.opacity())
+            if faded is None:
+                debugPrint("can't apply the opacity of layer " + layer.name() +
+                    " to " + col + " " + docDepth + " pixels, exporting it opaque")
+                return data
+            return faded
+
+        # the frame is the document's current one, or that layer's pixels
+        def exportFrame(num, doc, debugging = False, layer = None):
+            trace.count("frames rendered")
+            with trace.span("render frame", frame=num):
+                doc.waitForDone()
+                if not inMemory:
+                    imagePath = str(spritesExportPath(fileNum(num) + ".png"))
+                    writtenFiles.append(imagePath)
+                    exportImage(doc, imagePath)
+                    if(debugging):
+                        debugPrint("exporting frame " + str(num) + " at " + imagePath)
+                    return
+                # the composited image of the current frame,
+                # in the document's own color space
+                if layer is not None:
+                    data = layerPixels(layer)
+                else:
+                    data = bytes(doc.pixelData(0, 0, width, height))
                 if(debugging):
-                    debugPrint("saving state " + str(layer.visible()) + 
-                    " of layer " + str(layer))
+                    debugPrint("capturing frame " + str(num) + " in memory")
+                if writeSprites and not writeInBackground:
+                    # krita can only export the frame it's showing
+                    imagePath = str(spritesExportPath(fileNum(num) + ".png"))
+                    writtenFiles.append(imagePath)
+                    if layer is not None:
+                        layer.save(imagePath, res, res, InfoObject(),
+                                   QRect(0, 0, width, height))
+                        if trace.enabled and Path(imagePath).exists():
+                            trace.count("bytes written",
+                                        Path(imagePath).stat().st_size)
+                    else:
+                        exportImage(doc, imagePath)
+                    if(debugging):
+                        debugPrint("exporting frame " + str(num) + " at " + imagePath)
+            with trace.span("queue frame", frame=num):
+                pipeline.put(num, data)
+
+        # whatever doesn't need krita's document anymore,
+        # maybe on a background thread while the next frame renders
+        def processFrame(num, data):
+            with trace.span("process frame", frame=num):
+                processFrameData(num, data)
+
+        def processFrameData(num, data):
+            # the frame at the sheet's depth, before it's premultiplied
+            # (the other scales are resized from it)
+            straight = None
+            if converting or premultiplying:
+                with trace.span("convert frame", frame=num):
+                    straight = pixelbuffer.toArray(
+                        data, width, height, docDepth)
+                    if converting:
+                        straight = pixelbuffer.toEightBit(
+                            straight, docDepth, self.dither, linear)
+                    data = pixelbuffer.toBytes(
+                        pixelbuffer.premultiplied(straight)
+                        if premultiplying else straight)
+            isDuplicate = False
+            digest = None
+            if self.removeDuplicates or self.incremental:
+                digest = hashlib.blake2b(data, digest_size=16).digest()
+                frameHashes[str(num)] = digest.hex()
+            if self.removeDuplicates:
+                if digest in uniqueFrames:
+                    # no need to keep the pixels, the first one is enough
+                    self.duplicates[num] = uniqueFrames[digest]
+                    isDuplicate = True
+                    trace.count("duplicate frames")
+                    if(debugging):
+                        debugPrint("frame " + str(num) + " is the same as frame "
+                            + str(self.duplicates[num]))
+                else:
+                    uniqueFrames[digest] = num
+            if not isDuplicate:
+                if useCompositor:
+                    frame = pixelbuffer.toArray(data, width, height, depth)
+                    sprite = spriteframe.SpriteFrame(name=num, pixels=frame)
+                    if self.trim:
+                        with trace.span("trim", frame=num):
+                            sprite.trim()
+                        if (debugging):
+                            debugPrint("trimming image " + str(num) +
+                                  " to " + str((sprite.width, sprite.height)))
+                    # the frame at the other sizes, each resized on its own
+                    # so nothing from the next cell bleeds into it
+                    for scale in scales:
+                        with trace.span("resample", frame=num, scale=scale):
+                            resized = pixelbuffer.resample(
+                                frame if straight is None else straight,
+                                scale, self.scaleFilter)
+                            if premultiplying:
+                                resized = pixelbuffer.premultiplied(resized)
+                            scaled = spriteframe.SpriteFrame(
+                                name=num, pixels=resized)
+                            if self.trim:
+                                scaled.trim()
+                        scaled.pixels = keep(scaled.pixels)
+                        preparedScaled[scale][num] = scaled
+                    sprite.pixels = keep(sprite.pixels)
+                    preparedSprites[num] = sprite
+                else:
+                    self.frames[num] = data
+            if writeSprites and writeInBackground:
+                imagePath = str(spritesExportPath(fileNum(num) + ".png"))
+                if (previous is not None and digest is not None
+                        and previous.hashOf(num) == digest.hex()
+                        and Path(imagePath).exists()):
+                    # the same as last time, no need to write it again
+                    trace.count("sprites unchanged")
+                    return
+                writtenFiles.append(imagePath)
+                if pool is not None:
+                    with trace.span("submit sprite", frame=num):
+                        pool.submit(imagePath, data, width, height, depth, res,
+                                    iccProfile=icc)
+                else:
+                    with trace.span("encode sprite", frame=num):
+                        png = pngencoder.encode(data, width, height, depth, res,
+                                                iccProfile=icc)
+                        with open(imagePath, "wb") as f:
+                            f.write(png)
+                    trace.count("bytes written", len(png))
+                if(debugging):
+                    debugPrint("exporting frame " + str(num) + " at " + imagePath)
+
+        # the pixels of a sprite waiting for its sheet, moved to the
+        # scratch file if there's one; it's only made once the first
+        # frame comes, as big as every frame could ever need
+        def keep(pixels):
+            nonlocal scratch
+            if not (self.scratchFrames or self.lowMemory):
+                return pixels
+            if scratch is None:
+                pixelSize = 4 * pixelbuffer.np.dtype(
+                    pixelbuffer.channelTypes[depth]).itemsize
+                frameSize = width * height + sum(
+                    max(1, int(round(width * scale))) *
+                    max(1, int(round(height * scale)))
+                    for scale in scales)
+                scratch = scratchbuffer.ScratchBuffer(
+                    len(frameTimes) * frameSize * pixelSize, self.exportDir)
+                releases.append(scratch.close)
+            with trace.span("scratch"):
+                return scratch.store(pixels)
+
+        # a layer that's a frame, see frameLayers()
+        def getLayerState(layer, debugging = False):
+            self.layersStates.append(layer.visible())
+            self.layersList.append(layer)
+            if(not layer.visible()):
+                self.offLayers += 1
+                trace.count("frames skipped")
+            if(debugging):
+                debugPrint("saving state " + str(layer.visible()) +
+                " of layer " + str(layer))
 
         if debugging:
             print("")
@@ -162,14 +689,207 @@ class SpritesheetExporter(object):
         self.layersList.clear()
         self.layersStates.clear()
         self.offLayers = 0
+        self.frames.clear()
+        self.duplicates.clear()
+        # pixels digest -> frame number of its first occurrence
+        uniqueFrames = {}
+        # frame number -> its sprite, ready for the numpy compositor
+        preparedSprites = {}
+        # frame number (as a string) -> hex digest of its pixels
+        frameHashes = {}
+        # where the sprites' pixels wait for the sheet,
+        # with scratchFrames or lowMemory
+        scratch = None
+        # with keyframesOnly, frame number -> the frame it's held from,
+        # for the frames that aren't rendered, and the number of
+        # the document's frames each rendered frame is shown for
+        # (without animations)
+        holdsFrames = False
+        heldFrames = {}
+        durations = {}
+        # the sprites written so far, to remove if the export is cancelled
+        writtenFiles = []
+
+        def removeTemporaryFiles():
+            if not self.removeTmp:
+                return
+            for imagePath in writtenFiles:
+                Path(imagePath).unlink(missing_ok=True)
+            if addedFolder and not any(self.spritesExportDir.iterdir()):
+                self.spritesExportDir.rmdir()
+        cleanup.append(removeTemporaryFiles)
+
+        # the sheet's pages, atlases and manifest are written next to
+        # the last export's as name.part.png..., (part, final path) each,
+        # and only take their place once everything is written:
+        # a cancelled or failed export leaves the last one as it was
+        partFiles = []
+
+        def partPath(path):
+            part = path.with_name(path.stem + ".part" + path.suffix)
+            partFiles.append((part, path))
+            return part
+
+        def keepPartFiles():
+            for part, path in partFiles:
+                part.replace(path)
+            partFiles.clear()
+
+        # after the pool's, so nothing is still being written to them
+        def removePartFiles():
+            for part, path in partFiles:
+                part.unlink(missing_ok=True)
+        releases.append(removePartFiles)
+
+        # every png submitted so far, frames and sheets
+        def waitForEncoders():
+            if pool is None:
+                return
+            with trace.span("wait for encoders"):
+                written = pool.wait()
+            trace.count("bytes written", written)
+            pool.close()
+            if debugging:
+                debugPrint("wrote " + str(written) + " bytes of png with " +
+                    str(self.encodeWorkers) + " workers")
+
+        # the end of every export that went through, with or without
+        # anything to write: the scratch file is let go of
+        # and the empty tmp folder removed
+        def finishExport():
+            if scratch is not None:
+                scratch.close()
+            if self.removeTmp:
+                if addedFolder:
+                    with trace.span("cleanup"):
+                        self.spritesExportDir.rmdir()
+            if debugging:
+                debugPrint("All done!")
+
+        if doc is None:
+            doc = Krita.instance().activeDocument()
+        # getting current document info
+        # so we can copy it over to the new document
+        width = doc.width()
+        height = doc.height()
+        col = doc.colorModel()
+        docDepth = doc.colorDepth()
+        profile = doc.colorProfile()
+        res = doc.resolution()
+        # this is very helpful while programming
+        # if you're not quite sure what can be done:
+        # debugPrint(dir(doc))
+
+        # the numpy compositor only knows about rgba images
+        # and needs every frame in memory;
+        # trimming can only be done by it
+        wantsCompositor = self.wantsCompositor()
+        useCompositor = (wantsCompositor and
+            pixelbuffer.supports(col, docDepth))
+        if debugging and wantsCompositor and not useCompositor:
+            debugPrint("numpy compositor unavailable, using layers instead")
+        # the frames as they go on the sheet: maybe down to 8 bits,
+        # as soon as they're captured, and maybe premultiplied
+        depth = docDepth
+        # colors of a linear profile (krita's default for floats)
+        # are put through the sRGB curve on the way
+        linear = any(name in profile.lower()
+                     for name in ("g10", "linear", "scrgb"))
+        converting = (useCompositor and self.outputDepth == "U8"
+                      and (docDepth != "U8" or linear))
+        if converting:
+            depth = "U8"
+            if linear:
+                profile = "sRGB-elle-V2-srgbtrc.icc"
+        premultiplying = useCompositor and self.premultiplyAlpha
+        if debugging and converting:
+            debugPrint("converting the frames from " + docDepth + " to " + depth)
+        # the color profile of the pngs we write ourselves
+        icc = None
+        if pngencoder.canEncode(col, depth):
+            with trace.span("read color profile"):
+                icc = iccProfile(col, depth, profile)
+        # the other sizes the sheet is written at
+        scales = []
+        if useCompositor:
+            scales = sorted({float(scale) for scale in self.scales
+                             if scale > 0 and scale != 1})
+        # scale -> frame number -> its resized sprite
+        preparedScaled = {scale: {} for scale in scales}
+        # and scale -> the resized sprites, in the order of their cells
+        scaledSprites = {scale: [] for scale in scales}
+        # the last export's manifest, to only redo what changed;
+        # the settings are taken before rows and columns get guessed
+        settings = self.layoutSettings(width, height, col, depth)
+        manifestPath = sheetExportPath(".manifest.json")
+        previous = None
+        if self.incremental and useCompositor:
+            previous = exportmanifest.load(manifestPath)
+        # png compression on worker processes,
+        # fed with the frames' pixels straight from memory;
+        # no more frames wait for it than for the pipeline
+        pool = None
+        if (self.encodeWorkers > 0 and
+                pngencoder.canEncode(col, depth)):
+            pool = encoderpool.EncoderPool(self.encodeWorkers,
+                                           self.framesInFlight)
+            cleanup.append(pool.cancel)
+
+            # if the export fails, the pngs already submitted
+            # (the sprites kept so far) are still written
+            def closePool():
+                try:
+                    pool.wait()
+                finally:
+                    pool.close()
+            releases.append(closePool)
+        # and the atlas, our own json if we don't know that format
+        atlasFormat = self.atlasFormat
+        if atlasFormat not in atlaswriters.writers:
+            if debugging:
+                debugPrint("unknown atlas format " + str(atlasFormat) +
+                    ", using phaser instead")
+            atlasFormat = "phaser"
+        # the format the sheet is written in, png if it can't be
+        sheetFormat = self.sheetFormat
+        if not sheetformats.canEncode(sheetFormat, col, depth):
+            if debugging:
+                debugPrint("can't write a " + col + " " + depth + " sheet as " +
+                    sheetFormat + ", using png instead")
+            sheetFormat = "png"
+        sheetExtension = sheetformats.extension(sheetFormat)
+        # sheet image -> how big it is in each format
+        formatsReport = {}
+        # pngs we write ourselves can be written a band at a time
+        stripWriting = (self.lowMemory and useCompositor
+                        and sheetFormat in ("png", "png-optimized")
+                        and pngencoder.canEncode(col, depth))
+        if debugging and self.lowMemory and useCompositor and not stripWriting:
+            debugPrint("can't write a " + col + " " + depth + " sheet as " +
+                sheetFormat + " a band at a time, writing whole pages instead")
+        # layers as frames are always read straight from the layers
+        inMemory = (self.captureInMemory or useCompositor or self.removeDuplicates
+                    or pool is not None or self.framesInFlight > 0
+                    or self.layersAsAnimation)
+        pipeline = exportpipeline.FramePipeline(processFrame, self.framesInFlight)
+        cleanup.append(pipeline.cancel)
+        releases.append(pipeline.cancel)
+
+        # frames captured in memory only touch the disk
+        # if the user wants to keep the individual sprites
+        writeSprites = not (inMemory and self.removeTmp)
+        # and then, if we can, krita isn't needed to write them
+        writeInBackground = inMemory and (pool is not None or
+            ((self.framesInFlight > 0 or converting or premultiplying)
+             and pngencoder.canEncode(col, depth)))
 
         addedFolder = False
         # create a temporary export directory for the individual sprites
         # if the user didn't set any
-        if self.spritesExportDir == self.defaultPath:
+        if writeSprites and self.spritesExportDir == self.defaultPath:
             self.spritesExportDir = sheetExportPath("_sprites")
 
-        if self.forceNew and self.spritesExportDir.exists():
+        if writeSprites and self.forceNew and self.spritesExportDir.exists():
             exportNum = 0
 
             parentPath = self.spritesExportDir.parent
@@ -189,23 +909,57 @@ class SpritesheetExporter(object):
 
         # this will always be called if not forceNew
         # because it will always create a new export folder
-        if not (self.spritesExportDir).exists():
+        if writeSprites and not (self.spritesExportDir).exists():
             addedFolder = True
             (self.spritesExportDir).mkdir()
 
         # render animation in the sprites export folder
-        doc = Krita.instance().activeDocument()
         doc.setBatchmode(True)  # so it won't show the export dialog window
 
+        rangeDetection = trace.begin("range detection")
+        # the export then ends on the last keyframe
+        endsOnKeyframe = self.end == self.defaultTime and not self.animations
         if (not self.layersAsAnimation):
-            # check self.end and self.start values
-            # and if needed input default value
-            if(self.end == self.defaultTime or self.start == self.defaultTime):
-                self.setStartEndFrames()
-            doc.setCurrentTime(self.start)
+            if self.animations:
+                # every frame of every animation in one pass;
+                # frames shared by several animations are only rendered once
+                frameTimes = layoutplanner.frameTimes(
+                    self.start, self.end, self.step, self.animations)
+                if frameTimes:
+                    self.start = frameTimes[0]
+                    self.end = frameTimes[-1]
+            else:
+                # check self.end and self.start values
+                # and if needed input default value
+                if(self.end == self.defaultTime or self.start == self.defaultTime):
+                    self.setStartEndFrames(doc)
+                frameTimes = layoutplanner.frameTimes(
+                    self.start, self.end, self.step)
+            if self.keyframesOnly and readsKeyframes():
+                # no keyframe since the frame before, nothing changed:
+                # that frame is shown longer instead of rendered again
+                holdsFrames = True
+                lastFrame = frameTimes[-1] if frameTimes else 0
+                frameTimes, heldFrames = self.exposures(doc, frameTimes, True)
+                if not self.animations:
+                    # each frame stands for step frames of the document
+                    # (with animations, it's for each of them to say)
+                    durations = {frame: self.step for frame in frameTimes}
+                    for frame, heldFrom in heldFrames.items():
+                        durations[heldFrom] += self.step
+                    if endsOnKeyframe and frameTimes:
+                        # and what it shows is held until the end of the clip
+                        durations[frameTimes[-1]] += max(0,
+                            doc.fullClipRangeEndTime() + 1 -
+                            (lastFrame + self.step))
+                trace.count("frames held", len(heldFrames))
+                if(debugging):
+                    debugPrint(str(len(heldFrames)) + " frame(s) held, " +
+                        str(len(frameTimes)) + " to render")
+            elif self.keyframesOnly and debugging:
+                debugPrint("can't read the keyframes, rendering every frame")
             if(debugging):
-                ver = Application.version ()
-                isNewVersion = (int(ver[0]) > 4 or ( int(ver[0]) == 4 and int(ver[2]) >= 2))
+                isNewVersion = readsKeyframes()
                 if (isNewVersion):
                     debugPrint(
                     "animation Length: " +
@@ -221,174 +975,518 @@ class SpritesheetExporter(object):
                 "; export length: " +
                 str(self.end - self.start)
                 )
-            framesNum = ((self.end + 1) - self.start)/self.step
-            frameIDNum = self.start
+            framesNum = len(frameTimes)
+            trace.end(rangeDetection)
             # export frames
-            while(doc.currentTime() <= self.end):
-                exportFrame(frameIDNum, doc, debugging)
-                frameIDNum += self.step
+            for done, frameIDNum in enumerate(frameTimes):
                 doc.setCurrentTime(frameIDNum)
-            # reset
-            frameIDNum = self.start
+                exportFrame(frameIDNum, doc, debugging)
+                reportProgress("render", done + 1, len(frameTimes))
 
         else:
             frameIDNum = 0
             # save layers state (visible or not)
-            layers = doc.topLevelNodes()
-            for layer in layers:
+            for layer in self.frameLayers(doc.topLevelNodes()):
                 getLayerState(layer, debugging)
             framesNum = len(self.layersList)
+            frameTimes = list(range(0, framesNum, self.step))
+            trace.end(rangeDetection)
             
             # for compatibility between animated frames as frames
             # and layers as frames
             self.start = 0
             self.end = len(self.layersList) - 1
-            
-            # hide all layers
-            for layer in self.layersList:
-                layer.setVisible(False)
-                
-            # export each visible layer
+
+            # export each visible layer, read from the layer itself:
+            # no layer is shown or hidden and the document
+            # isn't composited again for each of them
+            visibleNum = len([frame for frame in frameTimes
+                              if self.layersStates[frame]])
+            done = 0
             while(frameIDNum < len(self.layersStates)):
                 if (self.layersStates[frameIDNum]):
-                    self.layersList[frameIDNum].setVisible(True)
-                    # refresh the canvas
-                    doc.refreshProjection()
-                    exportFrame(frameIDNum, doc, debugging)
-                    self.layersList[frameIDNum].setVisible(False)
+                    exportFrame(frameIDNum, doc, debugging,
+                                layer=self.layersList[frameIDNum])
+                    done += 1
+                    reportProgress("render", done, visibleNum)
                     
                 frameIDNum += self.step
-#            for layer in self.layersStates:
-#                if (layersStates[layersList.index(layer)]):
-#                    layer.setVisible(True)
-#                    exportFrame(frameIDNum, doc)
-#                    layer.setVisible(False)
-#                    frameIDNum += self.step
-            
-            # restore layers state
-            frameIDNum = 0
-            while(frameIDNum < len(self.layersStates)):
-                self.layersList[frameIDNum].setVisible(self.layersStates[frameIDNum])
-                frameIDNum += 1
-                if(debugging):
-                    debugPrint("restoring layer " + str(frameIDNum))
             frameIDNum = 0
 
-        # getting current document info
-        # so we can copy it over to the new document
-        width = doc.width()
-        height = doc.height()
-        col = doc.colorModel()
-        depth = doc.colorDepth()
-        profile = doc.colorProfile()
-        res = doc.resolution()
-        # this is very helpful while programming
-        # if you're not quite sure what can be done:
-        # debugPrint(dir(doc))
+        # wait for the frames still being processed
+        with trace.span("wait for frames"):
+            pipeline.finish()
+
+        # the frames that get a cell, in order: duplicates
+        # share the cell of the first identical frame,
+        # hidden layers aren't on the sheet
+        cellFrames = [frameIDNum for frameIDNum in frameTimes
+                      if frameIDNum not in self.duplicates and (
+                          not self.layersAsAnimation
+                          or self.layersStates[frameIDNum])]
 
         # getting a default value for rows and columns
-        if (self.rows == self.defaultSpace) and (self.columns == self.defaultSpace):
-            # square fit
-            self.columns = ceil(sqrt(framesNum - self.offLayers))
-            self.rows = ceil(float(framesNum - self.offLayers)/self.columns)
-            # or one row?
-            # self.rows = 1
-            # self.columns = framesNum
-            if (debugging):
-                debugPrint("self.rows: " + str(self.rows) +
-                      "; self.columns: " + str(self.columns))
-
-        # if only one is specified, guess the other
-        elif (self.rows == self.defaultSpace):
-            self.rows = ceil(float(framesNum - self.offLayers)/self.columns)
-
-        # Though if I have to guess the number of columns,
-        # it may also change the (user-set) number of rows.
-        # For example, if you want ten rows from twelve sprites
-        # instead of two rows of two and eight of one,
-        # you'll have six rows of two
-        elif (self.columns == self.defaultSpace):
-            self.columns = ceil(float(framesNum - self.offLayers)/self.rows)
-            self.rows = ceil(float(framesNum - self.offLayers)/self.columns)
-
-        # creating a new document where we'll put our sprites
-        sheet = Krita.instance().createDocument(
-            self.columns * width,
-            self.rows * height,
-            self.exportName,
-            col, depth, profile, res)
+        # (a square fit, or the one that isn't given)
+        self.rows, self.columns = layoutpacker.gridShape(
+            len(cellFrames), self.rows, self.columns)
         if (debugging):
-            debugPrint("new doc name: " + sheet.name())
-            debugPrint("old doc width: " + str(width))
-            debugPrint("num of frames: " + str(framesNum))
-            debugPrint("new doc width: " + str(sheet.width()))
-
-            # for debugging when the result of print() is not available
-            # QMessageBox.information(QWidget(), i18n("Debug 130"),
-            #                         i18n("step: " + str(self.step) +
-            #                              "; end: " + str(self.end) +
-            #                              "; start: " + str(self.start) +
-            #                              "; rows: " + str(self.rows) +
-            #                              "; columns: " + str(self.columns) +
-            #                              "; frames number: " +
-            #                              str(framesNum)))
-
-        # adding our sprites to the new document
-        # and moving them to the right position
-        root_node = sheet.rootNode()
-        root_node.childNodes()[0].setVisible(False) # hide the default layer filled with white
-        invisibleLayersNum = 0
-
-
-        textureAtlas = { "frames": [ ] }
-        while (frameIDNum <= self.end):
+            debugPrint("self.rows: " + str(self.rows) +
+                  "; self.columns: " + str(self.columns))
+
+        assembly = trace.begin("assemble")
+        if useCompositor:
+            # the sprites are only put on the sheet once they're all
+            # collected, since trimming changes the size of the cells
+            # and the packers need to know about all of them
+            sprites = []
+        else:
+            # where each frame goes, to create a new document
+            # where we'll put our sprites
+            layout = layoutplanner.plan(
+                cellFrames, width, height, self.rows, self.columns,
+                self.isDirectionHorizontal)
+            sheet = Krita.instance().createDocument(
+                layout.width,
+                layout.height,
+                self.exportName,
+                col, depth, profile, res)
+            releases.append(sheet.close)
+            if (debugging):
+                debugPrint("new doc name: " + sheet.name())
+                debugPrint("old doc width: " + str(width))
+                debugPrint("num of frames: " + str(framesNum))
+                debugPrint("new doc width: " + str(sheet.width()))
+
+                # for debugging when the result of print() is not available
+                # QMessageBox.information(QWidget(), i18n("Debug 130"),
+                #                         i18n("step: " + str(self.step) +
+                #                              "; end: " + str(self.end) +
+                #                              "; start: " + str(self.start) +
+                #                              "; rows: " + str(self.rows) +
+                #                              "; columns: " + str(self.columns) +
+                #                              "; frames number: " +
+                #                              str(framesNum)))
+
+            # adding our sprites to the new document
+            # and moving them to the right position
+            root_node = sheet.rootNode()
+            root_node.childNodes()[0].setVisible(False) # hide the default layer filled with white
+        # how many sprites got a cell so far
+        cellsNum = 0
+
+
+        # frame number -> its atlas entry, and the order they're written in
+        atlasFrames = {}
+        atlasOrder = []
+        for done, frameIDNum in enumerate(frameTimes):
+            reportProgress("assemble", done, len(frameTimes))
             doc.waitForDone()
             if(not self.layersAsAnimation or (self.layersAsAnimation and self.layersStates[frameIDNum])):
                 img = str(spritesExportPath(fileNum(frameIDNum) + ".png"))
-                if(debugging):
-                    debugPrint("managing file " + str(frameIDNum) + " at " + img)
-                layer = sheet.createFileLayer(img, img, "ImageToSize")
-                root_node.addChildNode(layer, None)
-                self.positionLayer(
-                    layer=layer,
-                    imgNum=(((frameIDNum - invisibleLayersNum)- self.start)/self.step),
-                    width=width,
-                    height=height)
-                # refresh canvas so the layers actually do show
-                sheet.refreshProjection()
-                if self.removeTmp:
+                imgNum = cellsNum
+                atlasOrder.append(frameIDNum)
+                if frameIDNum in self.duplicates:
+                    # it will share the rect of the first identical frame
+                    pass
+                elif useCompositor:
+                    sprite = preparedSprites.pop(frameIDNum)
+                    sprite.cell = imgNum
+                    sprites.append(sprite)
+                    for scale in scales:
+                        scaled = preparedScaled[scale].pop(frameIDNum)
+                        scaled.cell = imgNum
+                        scaledSprites[scale].append(scaled)
+                    cellsNum += 1
+                else:
+                    cellsNum += 1
+                    if inMemory:
+                        if(debugging):
+                            debugPrint("managing frame " + str(frameIDNum) + " from memory")
+                        # a paint layer holding the captured pixels,
+                        # no need to decode anything from the disk
+                        layer = sheet.createNode(fileNum(frameIDNum), "paintlayer")
+                        layer.setPixelData(self.frames.pop(frameIDNum), 0, 0, width, height)
+                    else:
+                        if(debugging):
+                            debugPrint("managing file " + str(frameIDNum) + " at " + img)
+                        layer = sheet.createFileLayer(img, img, "ImageToSize")
+                    root_node.addChildNode(layer, None)
+                    trace.count("layers created")
+                    page, x, y, w, h = layout.rects[frameIDNum]
+                    layer.move(x, y)
+                    # refresh canvas so the layers actually do show
+                    sheet.refreshProjection()
+                    x = layer.position().x()
+                    y = layer.position().y()
+                    if (debugging):
+                        debugPrint("adding to spritesheet, image " + str(frameIDNum-self.start) +
+                              " name: " + img +
+                              " at pos: " + str(layer.position()))
+                if self.removeTmp and not inMemory:
                     # removing temporary sprites exports
-                    Path(img).unlink()
-                if (debugging):
-                    debugPrint("adding to spritesheet, image " + str(frameIDNum-self.start) +
-                          " name: " + img +
-                          " at pos: " + str(layer.position()))
-                if (self.writeTextureAtlas):
-                    textureAtlas["frames"].append({
+                    with trace.span("cleanup", frame=frameIDNum):
+                        Path(img).unlink()
+                if (self.writeTextureAtlas and not useCompositor
+                    and frameIDNum not in self.duplicates):
+                    atlasFrames[frameIDNum] = ({
                         "filename": frameIDNum,
-                        "frame": { "x": layer.position().x(),
-                                   "y": layer.position().y(),
+                        "frame": { "x": x,
+                                   "y": y,
                                    "w": width,
                                    "h": height}})
+        trace.end(assembly)
+
+        # the sprites that don't fit in the max sheet size
+        # overflow on another page, then another...
+        def packPages(sprites):
+            pages = []
+            remaining = sprites
+            while remaining:
+                # in a grid, every cell is as big as the biggest (trimmed) sprite
+                packer = self.makePacker()
+                sizes = [(sprite.width, sprite.height) for sprite in remaining]
+                if self.packer == "grid" and not pages:
+                    placements = packer.pack(
+                        sizes, cells=[sprite.cell for sprite in remaining])
+                else:
+                    placements = packer.pack(sizes)
+                placed = []
+                overflow = []
+                for sprite, placement in zip(remaining, placements):
+                    if placement is None:
+                        overflow.append(sprite)
+                    else:
+                        sprite.x, sprite.y, sprite.rotated = placement
+                        sprite.page = len(pages)
+                        placed.append(sprite)
+                if not placed:
+                    raise ValueError("the sprites don't fit in a " +
+                        str(self.maxSheetSize) + " pixels wide spritesheet")
+                pages.append((packer.width, packer.height, placed))
+                remaining = overflow
+            return pages
+
+        # what changed since the last export, if we can reuse its layout
+        patching = False
+        if (useCompositor and previous is not None
+                and previous.matches(settings, atlasOrder, self.duplicates)
+                and all(self.exportDir.joinpath(page["image"]).exists()
+                        for page in previous.pages + previous.scaledPages)):
+            dirty = previous.changedFrames(frameHashes)
+            if not dirty:
+                if debugging:
+                    debugPrint("nothing changed since the last export")
+                waitForEncoders()
+                finishExport()
+                return
+            # a sprite that changed size would need another layout
+            patching = all(
+                (sprite.width, sprite.height) ==
+                (previous.frames[str(sprite.name)]["w"],
+                 previous.frames[str(sprite.name)]["h"])
+                for sprite in sprites if str(sprite.name) in dirty)
+            if (debugging):
+                debugPrint(str(len(dirty)) + " frame(s) changed since the last export" +
+                    ("" if patching else ", packing again"))
+
+        if patching:
+            # every sprite goes where it went last time
+            pages = [(page["w"], page["h"], []) for page in previous.pages]
+            for sprite in sprites:
+                placement = previous.frames[str(sprite.name)]
+                sprite.x = placement["x"]
+                sprite.y = placement["y"]
+                sprite.rotated = placement["rotated"]
+                sprite.page = placement["page"]
+                pages[sprite.page][2].append(sprite)
+            dirtyPages = {previous.frames[name]["page"] for name in dirty}
+        elif useCompositor:
+            with trace.span("pack", packer=self.packer):
+                pages = packPages(sprites)
+            if (debugging):
+                debugPrint("old doc width: " + str(width))
+                debugPrint("num of frames: " + str(framesNum))
+                debugPrint(str(len(pages)) + " page(s) of " + self.packer + " packing")
+
+        # baseName, or baseName_0, baseName_1... if there are several pages
+        def pagesName(baseName, page, pagesNum):
+            if pagesNum > 1:
+                return baseName + "_" + str(page)
+            return baseName
+
+        def pageName(page):
+            return pagesName(self.exportName, page,
+                             len(pages) if useCompositor else 1)
+
+        # exportName@0.5x, exportName@2x...
+        def scaledName(scale):
+            return self.exportName + "@" + "{:g}".format(scale) + "x"
+
+        # the atlas entry of each sprite placed on these pages,
+        # only made when the atlas writer gets to it
+        def pagesFrames(pages):
+            placedSprites = {sprite.name: sprite
+                             for pageWidth, pageHeight, placed in pages
+                             for sprite in placed}
+
+            def frameOf(name):
+                sprite = placedSprites[name]
+                frame = sprite.atlasFrame(self.trim)
+                if len(pages) > 1:
+                    frame["page"] = sprite.page
+                return frame
+            return frameOf
+
+        # what the frames were packed with, and in how big a sheet
+        def pagesMeta(baseName, pages):
+            if len(pages) > 1:
+                meta = {
+                    "packer": self.packer,
+                    "pages": [{ "image": pagesName(baseName, page, len(pages))
+                                         + sheetExtension,
+                                "size": { "w": pageWidth, "h": pageHeight}}
+                              for page, (pageWidth, pageHeight, placed)
+                              in enumerate(pages)]}
             else:
-                invisibleLayersNum += 1
-            frameIDNum += self.step
+                meta = {
+                    "packer": self.packer,
+                    "image": baseName + sheetExtension,
+                    "size": { "w": pages[0][0], "h": pages[0][1]}}
+            return withPixelFormat(meta)
 
-        # export the document to the export location
-        sheet.setBatchmode(True)  # so it won't show the export dialog window
-        if debugging:
-            debugPrint("exporting spritesheet to " + str(sheetExportPath()))
+        # and how the pixels are packed, when it's not a picture
+        def withPixelFormat(meta):
+            if sheetFormat in sheetformats.packedFormats:
+                meta["format"] = sheetformats.packedFormats[sheetFormat][0]
+            return meta
 
-        sheet.exportImage(str(sheetExportPath(".png")), InfoObject())
+        # scale -> the pages of that size
+        scaledPages = {}
+
+        if useCompositor:
+            trace.count("pages", len(pages))
+            for page, (pageWidth, pageHeight, placed) in enumerate(pages):
+                reportProgress("write", page, len(pages))
+                pagePath = self.exportDir.joinpath(pageName(page) + sheetExtension)
+                compositor = None
+                if patching:
+                    if page not in dirtyPages:
+                        # nothing to redo on this page
+                        continue
+                    if not stripWriting:
+                        # only the changed sprites go on last time's page
+                        compositor = sheetcompositor.load(pagePath, depth)
+                    if compositor is not None:
+                        placed = [sprite for sprite in placed
+                                  if str(sprite.name) in dirty]
+                if stripWriting:
+                    # the whole page again, it's never all in memory
+                    if debugging:
+                        debugPrint("exporting spritesheet to " + str(pagePath) +
+                            " a band at a time")
+                    with trace.span("write sheet", page=page):
+                        writeInStrips(pagePath, pageWidth, pageHeight, placed)
+                    continue
+                if compositor is None:
+                    # a single array where we'll put this page's sprites,
+                    # so only one page is in memory at a time
+                    compositor = sheetcompositor.SheetCompositor(
+                        pageWidth, pageHeight, depth)
+                if (debugging):
+                    debugPrint("page " + str(page) + " size: " +
+                        str((compositor.width, compositor.height)))
+                composite = trace.begin("composite page", page=page)
+                for sprite in placed:
+                    compositor.blit(
+                        sprite.pixels, sprite.x, sprite.y, sprite.rotated)
+                    if (debugging):
+                        debugPrint("adding to spritesheet, image " + str(sprite.name) +
+                              " at pos: " + str((sprite.x, sprite.y)))
+                    # the sprite's pixels aren't needed anymore
+                    sprite.pixels = None
+                trace.end(composite)
+                if debugging:
+                    debugPrint("exporting spritesheet to " + str(pagePath))
+                # the one and only time the sheet's pixels leave the array
+                with trace.span("write sheet", page=page):
+                    writeSheet(
+                        pagePath,
+                        lambda: pixelbuffer.toBytes(compositor.pixels),
+                        compositor.width, compositor.height,
+                        lambda path, info: compositor.exportImage(
+                            path, pageName(page), col, profile, res, info))
+                compositor = None
+
+            # then the same at each of the other sizes
+            for scale in scales:
+                with trace.span("pack", packer=self.packer, scale=scale):
+                    scaledPages[scale] = packPages(scaledSprites[scale])
+                trace.count("pages", len(scaledPages[scale]))
+                for page, (pageWidth, pageHeight, placed) in enumerate(
+                        scaledPages[scale]):
+                    reportProgress("write", page, len(scaledPages[scale]))
+                    name = pagesName(scaledName(scale), page,
+                                     len(scaledPages[scale]))
+                    if stripWriting:
+                        with trace.span("write sheet", page=page, scale=scale):
+                            writeInStrips(
+                                self.exportDir.joinpath(name + sheetExtension),
+                                pageWidth, pageHeight, placed)
+                        continue
+                    compositor = sheetcompositor.SheetCompositor(
+                        pageWidth, pageHeight, depth)
+                    with trace.span("composite page", page=page, scale=scale):
+                        for sprite in placed:
+                            compositor.blit(
+                                sprite.pixels, sprite.x, sprite.y, sprite.rotated)
+                            sprite.pixels = None
+                    if debugging:
+                        debugPrint("exporting spritesheet to " + name)
+                    with trace.span("write sheet", page=page, scale=scale):
+                        writeSheet(
+                            self.exportDir.joinpath(name + sheetExtension),
+                            lambda: pixelbuffer.toBytes(compositor.pixels),
+                            compositor.width, compositor.height,
+                            lambda path, info: compositor.exportImage(
+                                path, name, col, profile, res, info))
+                    compositor = None
+        else:
+            # export the document to the export location
+            if debugging:
+                debugPrint("exporting spritesheet to " + str(sheetExportPath()))
+            sheet.setBatchmode(True)  # so it won't show the export dialog window
+            sheet.waitForDone()
+            try:
+                with trace.span("write sheet"):
+                    writeSheet(
+                        sheetExportPath(sheetExtension),
+                        lambda: sheet.pixelData(0, 0, sheet.width(), sheet.height()),
+                        sheet.width(), sheet.height(),
+                        lambda path, info: sheet.exportImage(str(path), info))
+            finally:
+                # written or not, the sheet document isn't needed anymore:
+                # its memory is freed before the next export (e.g. in a batch)
+                releases.remove(sheet.close)
+                sheet.close()
+
+        waitForEncoders()
+
+        if formatsReport:
+            with open(str(partPath(sheetExportPath(".formats.json"))),
+                      "w") as f:
+                json.dump(formatsReport, f, indent=1)
+            if debugging:
+                for image, report in formatsReport.items():
+                    for name, result in report.items():
+                        debugPrint(image + " as " + name + ": " + (
+                            result["error"] if "error" in result else
+                            str(result["bytes"]) + " bytes in " +
+                            "{:.3f}".format(result["seconds"]) + "s"))
+
+        # the atlas in the chosen format, frame by frame;
+        # frameOf(frame number) gives a frame's entry
+        def writeAtlas(basePath, meta, frameOf):
+            # the document's frames in ms
+            def milliseconds(frames):
+                return int(round(frames * 1000 / doc.framesPerSecond()))
+
+            # name.part.json, name.part_0.json... until they're kept
+            partBase = basePath.with_name(basePath.name + ".part")
+            writer = atlaswriters.writers[atlasFormat](
+                partBase, doc.framesPerSecond())
+            try:
+                writer.begin(meta)
+                for frameIDNum in atlasOrder:
+                    if frameIDNum in self.duplicates:
+                        # same rect as the frame it duplicates, different name
+                        frame = frameOf(self.duplicates[frameIDNum])
+                        frame["filename"] = frameIDNum
+                    else:
+                        frame = frameOf(frameIDNum)
+                    if durations:
+                        frame["duration"] = milliseconds(
+                            durations[frameIDNum])
+                    writer.addFrame(frame)
+                animations = None
+                animationDurations = None
+                if self.animations:
+                    # the frames of each animation, in order,
+                    # as their "filename" in the frames above
+                    # (a held frame is the frame it's held from, once,
+                    # shown for as many of the animation's steps)
+                    animations = {}
+                    animationDurations = {} if holdsFrames else None
+                    for name, start, end, step in self.animations:
+                        frames = []
+                        frameDurations = []
+                        for frameIDNum in range(start, end + 1, step):
+                            frameIDNum = heldFrames.get(frameIDNum, frameIDNum)
+                            if frames[-1:] == [frameIDNum]:
+                                frameDurations[-1] += step
+                            else:
+                                frames.append(frameIDNum)
+                                frameDurations.append(step)
+                        animations[name] = frames
+                        if holdsFrames:
+                            animationDurations[name] = [
+                                milliseconds(frameDuration)
+                                for frameDuration in frameDurations]
+                writer.end(animations, animationDurations)
+            finally:
+                writer.close()
+                for part in writer.paths:
+                    partFiles.append((part, basePath.with_name(
+                        basePath.name + part.name[len(partBase.name):])))
 
         if (self.writeTextureAtlas):
-            with open(str(sheetExportPath(".json")), 'w') as f:
-                json.dump(textureAtlas, f)
+            atlasWriting = trace.begin("write atlas", format=atlasFormat)
+            if useCompositor:
+                writeAtlas(sheetExportPath(),
+                           pagesMeta(self.exportName, pages),
+                           pagesFrames(pages))
+            else:
+                writeAtlas(sheetExportPath(),
+                           withPixelFormat({
+                               "packer": "grid",
+                               "image": self.exportName + sheetExtension,
+                               "size": { "w": layout.width,
+                                         "h": layout.height}}),
+                           lambda name: dict(atlasFrames[name]))
+            # and one atlas for each of the other sizes
+            for scale in scales:
+                meta = pagesMeta(scaledName(scale), scaledPages[scale])
+                meta["scale"] = "{:g}".format(scale)
+                writeAtlas(self.exportDir.joinpath(scaledName(scale)),
+                           meta, pagesFrames(scaledPages[scale]))
+            trace.end(atlasWriting)
 
-        # and remove the empty tmp folder when you're done
-        if self.removeTmp:
-            if addedFolder:
-                self.spritesExportDir.rmdir()
+        if self.incremental and useCompositor:
+            # for the next export to know what it can skip
+            exportmanifest.ExportManifest(
+                settings=settings,
+                frames={ str(sprite.name): {
+                            "hash": frameHashes[str(sprite.name)],
+                            "page": sprite.page,
+                            "x": sprite.x,
+                            "y": sprite.y,
+                            "w": sprite.width,
+                            "h": sprite.height,
+                            "rotated": sprite.rotated}
+                         for sprite in sprites},
+                duplicates={ str(name): str(first)
+                             for name, first in self.duplicates.items()},
+                pages=[{ "image": pageName(page) + sheetExtension,
+                         "w": pageWidth, "h": pageHeight}
+                       for page, (pageWidth, pageHeight, placed)
+                       in enumerate(pages)],
+                scaledPages=[{ "image": pagesName(scaledName(scale), page,
+                                                  len(scaledPages[scale]))
+                                        + sheetExtension,
+                               "scale": scale}
+                             for scale in scales
+                             for page in range(len(scaledPages[scale]))]
+                ).save(partPath(manifestPath))
 
-        if debugging:
-            debugPrint("All done!")
+        # the manifest last, it's only ever next to the pages it lists
+        keepPartFiles()
+        finishExport()
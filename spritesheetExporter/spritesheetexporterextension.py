@@ -5,10 +5,10 @@ spritesheet exporter from animation timeline
 """
 
 from krita import (Extension, krita)
-
-from . import uispritesheetexporter
-# manages the dialog that lets you
-# set user preferences before applying the script
+import time
+# nothing else is imported when krita starts: the dialog
+# (and the exporter, numpy, qt's widgets...) only
+# the first time the script is used
 
 
 class spritesheetExporterExtension(Extension):
@@ -17,6 +17,10 @@ class spritesheetExporterExtension(Extension):
     # This is necessary to create the underlying C++ object
     def __init__(self, parent):
         super().__init__(parent)
+        # the dialog, made when it's first needed
+        self.ui = None
+        # how long that took, imports included
+        self.uiSeconds = 0.0
 
     # this too is necessary, because "Extension.setup() is abstract
     # and must be overridden" and we inherit from Extension
@@ -39,8 +43,17 @@ class spritesheetExporterExtension(Extension):
         # doesn't show tooltip on mouse hover. Why?
 
         # when you click on the script in the menu it opens the dialog window
-        self.ui = uispritesheetexporter.UISpritesheetExporter()
-        exportSs.triggered.connect(self.ui.showExportDialog)
+        exportSs.triggered.connect(self.showExportDialog)
+
+    def showExportDialog(self):
+        if self.ui is None:
+            start = time.perf_counter()
+            from . import uispritesheetexporter
+            # manages the dialog that lets you
+            # set user preferences before applying the script
+            self.ui = uispritesheetexporter.UISpritesheetExporter()
+            self.uiSeconds = time.perf_counter() - start
+        self.ui.showExportDialog()
 
 
 # the actual stuff-doing is in the spritesheetexporter.py script
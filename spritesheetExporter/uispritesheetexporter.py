@@ -9,11 +9,16 @@ from PyQt5.QtWidgets import (QGridLayout, QVBoxLayout, QFrame, QPushButton,
                              QVBoxLayout, QHBoxLayout, QFileDialog, QLabel,
                              QPushButton, QInputDialog, QSpinBox, QDialog,
                              QLineEdit, QWidget, QCheckBox, QDialogButtonBox,
-                             QSpacerItem, QSizePolicy)
+                             QSpacerItem, QSizePolicy, QComboBox, QMessageBox,
+                             QProgressDialog, QApplication)
 import krita
+import time
 # we want paths to work whether it's windows or unix
 from pathlib import Path
 from . import spritesheetexporter
+from . import sheetformats
+from . import atlaswriters
+from . import layoutplanner
 
 
 class describedWidget:
@@ -23,6 +28,12 @@ class describedWidget:
         self.tooltip = tooltip
 
 
+# how each step of the export is shown in the progress dialog
+progressStages = {"render": "Rendering frame",
+                  "assemble": "Placing frame",
+                  "write": "Writing page"}
+
+
 class UISpritesheetExporter(object):
 
     def __init__(self):
@@ -77,9 +88,101 @@ class UISpritesheetExporter(object):
         # we let people export each layer as an animation frame if they wish
         self.layersAsAnimation = QCheckBox()
         self.layersAsAnimation.setChecked(False)
+        # and each group as a single frame
+        self.groupsAsFrames = QCheckBox()
+        self.groupsAsFrames.setChecked(False)
 
         self.writeTextureAtlas = QCheckBox()
         self.writeTextureAtlas.setChecked(False)
+        # and in which format
+        self.atlasFormat = QComboBox()
+        self.atlasFormat.addItems(list(atlaswriters.writers))
+
+        # and keep the frames in memory rather than in temporary files
+        self.captureInMemory = QCheckBox()
+        self.captureInMemory.setChecked(False)
+
+        # and assemble them in a single array rather than one layer each
+        self.numpyCompositor = QCheckBox()
+        self.numpyCompositor.setChecked(False)
+
+        # and crop the transparent borders of each frame
+        self.trim = QCheckBox()
+        self.trim.setChecked(False)
+
+        # and only place identical frames once
+        self.removeDuplicates = QCheckBox()
+        self.removeDuplicates.setChecked(False)
+
+        # and only redo what changed since the last export
+        self.incremental = QCheckBox()
+        self.incremental.setChecked(False)
+
+        # and only render the frames with a keyframe
+        self.keyframesOnly = QCheckBox()
+        self.keyframesOnly.setChecked(False)
+
+        # how the sprites are laid out on the sheet
+        self.packingWidget = QWidget()
+        self.packing = QHBoxLayout(self.packingWidget)
+        self.packer = QComboBox()
+        self.packer.addItems(["grid", "maxrects", "skyline"])
+        self.maxSheetSize = QSpinBox(minimum = 0, maximum = 65536)
+        self.maxSheetSize.setValue(0)
+        self.powerOfTwo = QCheckBox()
+        self.powerOfTwo.setChecked(False)
+        self.allowRotation = QCheckBox()
+        self.allowRotation.setChecked(False)
+
+        # how many processes compress the pngs
+        self.encodeWorkers = QSpinBox(minimum = 0, maximum = 64)
+        self.encodeWorkers.setValue(0)
+
+        # and how many frames can wait for them
+        self.framesInFlight = QSpinBox(minimum = 0, maximum = 256)
+        self.framesInFlight.setValue(0)
+
+        # what the sheet is written as, and how hard our pngs are compressed
+        self.formatWidget = QWidget()
+        self.formatLayout = QHBoxLayout(self.formatWidget)
+        self.sheetFormat = QComboBox()
+        self.sheetFormat.addItems(sheetformats.formats)
+        self.pngLevel = QSpinBox(minimum = 0, maximum = 9)
+        self.pngLevel.setValue(9)
+        self.compareFormats = QCheckBox()
+        self.compareFormats.setChecked(False)
+
+        # the other sizes the sheet is written at, and how frames are resized
+        self.scalesWidget = QWidget()
+        self.scalesLayout = QHBoxLayout(self.scalesWidget)
+        self.scales = QLineEdit()
+        self.scales.setPlaceholderText("0.5, 2")
+        self.scaleFilter = QComboBox()
+        self.scaleFilter.addItems(["box", "bilinear", "nearest"])
+
+        # what depth the frames are taken down to, and how
+        self.depthWidget = QWidget()
+        self.depthLayout = QHBoxLayout(self.depthWidget)
+        self.outputDepth = QComboBox()
+        self.outputDepth.addItems(["document's", "8 bits"])
+        self.dither = QCheckBox()
+        self.dither.setChecked(False)
+        self.premultiplyAlpha = QCheckBox()
+        self.premultiplyAlpha.setChecked(False)
+
+        # for sheets too big to be in memory at once
+        self.memoryWidget = QWidget()
+        self.memoryLayout = QHBoxLayout(self.memoryWidget)
+        self.lowMemory = QCheckBox()
+        self.lowMemory.setChecked(False)
+        self.scratchFrames = QCheckBox()
+        self.scratchFrames.setChecked(False)
+
+        # what the export spent its time on
+        self.traceExport = QCheckBox()
+        self.traceExport.setChecked(False)
+        self.profileExport = QCheckBox()
+        self.profileExport.setChecked(False)
 
         # We want to let the user choose if they want the final spritesheet
         # to be horizontally- or vertically-oriented.
@@ -112,6 +215,10 @@ class UISpritesheetExporter(object):
         self.end.setValue(self.exp.defaultTime)
         self.step.setValue(1)
 
+        # named frame ranges to export together instead of start..end
+        self.animations = QLineEdit()
+        self.animations.setPlaceholderText("idle:0-11, walk:12-35/2")
+
         # to be placed outside of spinBoxes, still in outerLayout
         self.hiddenCheckbox = QWidget()
         self.hiddenCheckboxLayout = QVBoxLayout(self.hiddenCheckbox)
@@ -138,6 +245,8 @@ class UISpritesheetExporter(object):
         self.spacerBig = QSpacerItem(self.space*2, self.space*2)
 
         self.exportPath = Path.home()
+        # the document being exported, set when the dialog is shown
+        self.doc = None
 
         self.initialize_export()
 
@@ -186,7 +295,16 @@ class UISpritesheetExporter(object):
                 widget=self.writeTextureAtlas,
                 tooltip="" +
                 "Write a json texture atlas that can be\n" +
-                "used in e.g. the Phaser 3 game framework")])
+                "used in e.g. the Phaser 3 game framework"),
+            describedWidget(
+                descri="format:",
+                widget=self.atlasFormat,
+                tooltip="phaser: exportName.json, as always;\n" +
+                "texturepacker-hash, texturepacker-array: " +
+                "TexturePacker's json (one per page);\n" +
+                "godot: a SpriteFrames resource (exportName.tres);\n" +
+                "binary: fixed-size records for your own engine " +
+                "(exportName.atlas)")])
 
         self.addDescribedWidget(parent=self.topLayout, listWidgets=[
             describedWidget(
@@ -211,7 +329,237 @@ class UISpritesheetExporter(object):
                     "(all visible layers merged down),\n" +
                     "export instead a spritesheet " +
                     "using as frames\n" + 
-                    "the current frame of each visible layer")])
+                    "the current frame of each visible layer"),
+                describedWidget(
+                    descri="groups as frames ",
+                    widget=self.groupsAsFrames,
+                    tooltip="With layers as animation frames, " +
+                    "each group layer is one frame\n" +
+                    "(its visible layers together) " +
+                    "rather than one frame per layer in it")])
+
+        self.addDescribedWidget(parent=self.hideableLayout,
+            listWidgets=[
+                describedWidget(
+                    descri="capture frames in memory ",
+                    widget=self.captureInMemory,
+                    tooltip="Read each frame's pixels directly " +
+                    "instead of exporting it\n" +
+                    "as a temporary png and loading it back;\n" +
+                    "the sprites are only written to disk " +
+                    "if you don't remove them")])
+
+        self.addDescribedWidget(parent=self.hideableLayout,
+            listWidgets=[
+                describedWidget(
+                    descri="assemble the sheet with numpy ",
+                    widget=self.numpyCompositor,
+                    tooltip="Copy every frame into a single image " +
+                    "and write it once\n" +
+                    "instead of adding one layer per frame " +
+                    "to a new document;\n" +
+                    "needs numpy and an RGBA document, " +
+                    "frames are then always captured in memory")])
+
+        self.addDescribedWidget(parent=self.hideableLayout,
+            listWidgets=[
+                describedWidget(
+                    descri="trim transparent borders ",
+                    widget=self.trim,
+                    tooltip="Only keep the smallest rectangle " +
+                    "holding the opaque pixels of each frame;\n" +
+                    "the texture atlas records the offsets " +
+                    "to put them back in place.\n" +
+                    "Uses the numpy assembly")])
+
+        self.addDescribedWidget(parent=self.hideableLayout,
+            listWidgets=[
+                describedWidget(
+                    descri="remove duplicate frames ",
+                    widget=self.removeDuplicates,
+                    tooltip="Place frames with exactly the same pixels " +
+                    "only once on the spritesheet;\n" +
+                    "in the texture atlas, the duplicates point " +
+                    "to the same rectangle.\n" +
+                    "Frames are then captured in memory")])
+
+        self.addDescribedWidget(parent=self.hideableLayout,
+            listWidgets=[
+                describedWidget(
+                    descri="only redo what changed ",
+                    widget=self.incremental,
+                    tooltip="Keep a manifest next to the spritesheet " +
+                    "and, on the next export,\n" +
+                    "only write again the frames and pages " +
+                    "that changed since then.\n" +
+                    "Uses the numpy assembly")])
+
+        self.addDescribedWidget(parent=self.hideableLayout,
+            listWidgets=[
+                describedWidget(
+                    descri="only render keyframes ",
+                    widget=self.keyframesOnly,
+                    tooltip="Only render a frame when a visible layer " +
+                    "has a keyframe since the frame before;\n" +
+                    "the texture atlas gives each frame its duration " +
+                    "instead of listing the frames it's held on.\n" +
+                    "Not for tweened (interpolated) keyframes")])
+
+        self.addDescribedWidget(parent=self.packing, listWidgets=[
+            describedWidget(
+                widget=self.packer,
+                descri="Packing:",
+                tooltip="grid: rows and columns of same-sized cells;\n" +
+                "maxrects and skyline: pack sprites of different sizes\n" +
+                "(e.g. trimmed ones) as tightly as possible,\n" +
+                "maxrects being tighter and skyline faster")])
+        self.addDescribedWidget(parent=self.packing, listWidgets=[
+            describedWidget(
+                widget=self.maxSheetSize,
+                descri="Max size:",
+                tooltip="Maximum width and height of the spritesheet " +
+                "in pixels;\nsprites that don't fit go on other pages " +
+                "(exportName_0.png, exportName_1.png...).\n0 for no limit")])
+        self.addDescribedWidget(parent=self.packing, listWidgets=[
+            describedWidget(
+                widget=self.powerOfTwo,
+                descri="Power of two:",
+                tooltip="Round the spritesheet's width and height up\n" +
+                "to the next power of two")])
+        self.addDescribedWidget(parent=self.packing, listWidgets=[
+            describedWidget(
+                widget=self.allowRotation,
+                descri="Rotation:",
+                tooltip="Let maxrects and skyline turn sprites " +
+                "90 degrees clockwise\n" +
+                "when they fit better that way")])
+        self.hideableLayout.addWidget(self.packingWidget)
+
+        self.addDescribedWidget(parent=self.hideableLayout, listWidgets=[
+            describedWidget(
+                widget=self.encodeWorkers,
+                descri="PNG encoding workers:",
+                tooltip="How many processes compress the pngs " +
+                "(frames and spritesheet) in parallel;\n" +
+                "0 to let Krita write them one after the other.\n" +
+                "Only for 8 and 16 bits RGBA documents, " +
+                "frames are then captured in memory")])
+
+        self.addDescribedWidget(parent=self.hideableLayout, listWidgets=[
+            describedWidget(
+                widget=self.framesInFlight,
+                descri="Frames in flight:",
+                tooltip="How many captured frames can wait to be " +
+                "processed and written in the background\n" +
+                "while Krita renders the next ones " +
+                "(more is faster but uses more memory);\n" +
+                "0 does everything in turn. " +
+                "Frames are then captured in memory")])
+
+        self.addDescribedWidget(parent=self.formatLayout, listWidgets=[
+            describedWidget(
+                widget=self.sheetFormat,
+                descri="Sheet format:",
+                tooltip="png: written by Krita;\n" +
+                "png-optimized: the best png filter for each row, " +
+                "smaller but slower;\n" +
+                "png-indexed: a palette of up to 256 colors, " +
+                "tiny for pixel art\n" +
+                "(sheets with more colors lose some of them);\n" +
+                "webp: lossless webp, written by Krita;\n" +
+                "rgba4444, rgb565, rgba8: the pixels packed as the gpu " +
+                "uploads them, in a .ktx file")])
+        self.addDescribedWidget(parent=self.formatLayout, listWidgets=[
+            describedWidget(
+                widget=self.pngLevel,
+                descri="Compression:",
+                tooltip="zlib level of the optimized and indexed pngs,\n" +
+                "0 (fastest) to 9 (smallest)")])
+        self.addDescribedWidget(parent=self.formatLayout, listWidgets=[
+            describedWidget(
+                widget=self.compareFormats,
+                descri="Compare formats:",
+                tooltip="Also write how big the spritesheet is " +
+                "in every format\nand how long each one takes " +
+                "(exportName.formats.json)")])
+        self.hideableLayout.addWidget(self.formatWidget)
+
+        self.addDescribedWidget(parent=self.scalesLayout, listWidgets=[
+            describedWidget(
+                widget=self.scales,
+                descri="Other scales:",
+                tooltip="Also write the spritesheet at these sizes, " +
+                "separated by commas,\n" +
+                "e.g. 0.5, 2 for exportName@0.5x.png and " +
+                "exportName@2x.png (and their atlases).\n" +
+                "Each frame is resized on its own, " +
+                "so nothing bleeds in from the next one.\n" +
+                "Uses the numpy assembly")])
+        self.addDescribedWidget(parent=self.scalesLayout, listWidgets=[
+            describedWidget(
+                widget=self.scaleFilter,
+                descri="Resize filter:",
+                tooltip="box: the average of the pixels each new one covers;\n" +
+                "bilinear: smoother;\n" +
+                "nearest: keeps the hard edges of pixel art")])
+        self.hideableLayout.addWidget(self.scalesWidget)
+
+        self.addDescribedWidget(parent=self.depthLayout, listWidgets=[
+            describedWidget(
+                widget=self.outputDepth,
+                descri="Output depth:",
+                tooltip="8 bits: turn 16 bits and float frames into " +
+                "8 bits sRGB as soon as they're captured,\n" +
+                "so the spritesheet is smaller and faster to make.\n" +
+                "Uses the numpy assembly")])
+        self.addDescribedWidget(parent=self.depthLayout, listWidgets=[
+            describedWidget(
+                widget=self.dither,
+                descri="Dither:",
+                tooltip="Ordered dithering when going down to 8 bits\n" +
+                "or packing into rgba4444 or rgb565,\n" +
+                "so smooth gradients don't turn into bands")])
+        self.addDescribedWidget(parent=self.depthLayout, listWidgets=[
+            describedWidget(
+                widget=self.premultiplyAlpha,
+                descri="Premultiplied alpha:",
+                tooltip="Multiply the colors by alpha, for engines " +
+                "that blend premultiplied textures.\n" +
+                "Uses the numpy assembly")])
+        self.hideableLayout.addWidget(self.depthWidget)
+
+        self.addDescribedWidget(parent=self.memoryLayout, listWidgets=[
+            describedWidget(
+                widget=self.lowMemory,
+                descri="Low memory:",
+                tooltip="Write png spritesheets a band of rows at a time\n" +
+                "instead of building each one whole in memory first,\n" +
+                "for sheets too big for that (compare formats is skipped),\n" +
+                "and keep the captured frames on disk until then.\n" +
+                "Uses the numpy assembly")])
+        self.addDescribedWidget(parent=self.memoryLayout, listWidgets=[
+            describedWidget(
+                widget=self.scratchFrames,
+                descri="Frames on disk:",
+                tooltip="Keep the captured frames in a temporary file " +
+                "next to the spritesheet\n" +
+                "instead of memory until they're on it.\n" +
+                "Uses the numpy assembly")])
+        self.hideableLayout.addWidget(self.memoryWidget)
+
+        self.addDescribedWidget(parent=self.hideableLayout, listWidgets=[
+            describedWidget(
+                widget=self.traceExport,
+                descri="Write a trace:",
+                tooltip="Time each step of the export and write it\n" +
+                "next to the spritesheet (exportName.trace.json,\n" +
+                "and exportName.trace.chrome.json for chrome://tracing)"),
+            describedWidget(
+                widget=self.profileExport,
+                descri="Profile:",
+                tooltip="Profile the whole export with cProfile\n" +
+                "and write the stats next to the spritesheet " +
+                "(exportName.prof)")])
 
         self.hideableLayout.addItem(self.spacer)
                 
@@ -281,6 +629,17 @@ class UISpritesheetExporter(object):
 
         self.hideableLayout.addWidget(self.spinBoxesWidget)
 
+        self.addDescribedWidget(parent=self.hideableLayout, listWidgets=[
+            describedWidget(
+                widget=self.animations,
+                descri="Animations:",
+                tooltip="Named frame ranges exported together " +
+                "in the same spritesheet,\n" +
+                "as name:start-end or name:start-end/step, " +
+                "separated by commas;\n" +
+                "replaces start, end and step. " +
+                "The texture atlas lists the frames of each one")])
+
         self.addDescribedWidget(parent=self.checkBoxes, listWidgets=[
             describedWidget(
                 descri="Remove individual sprites?",
@@ -317,6 +676,23 @@ class UISpritesheetExporter(object):
 
         self.outerLayout.addWidget(self.hideableWidget)
 
+        # what the export will make, kept up to date with the settings
+        self.estimate = QLabel()
+        self.estimate.setWordWrap(True)
+        self.estimate.setToolTip(
+            "How big the spritesheet will be and about how much memory\n" +
+            "the export will need, before anything is rendered;\n" +
+            "trimming and removing duplicates can only make it smaller")
+        self.outerLayout.addWidget(self.estimate)
+        for widget in self.mainDialog.findChildren(QSpinBox):
+            widget.valueChanged.connect(self.updateEstimate)
+        for widget in self.mainDialog.findChildren(QCheckBox):
+            widget.stateChanged.connect(self.updateEstimate)
+        for widget in self.mainDialog.findChildren(QComboBox):
+            widget.currentIndexChanged.connect(self.updateEstimate)
+        for widget in self.mainDialog.findChildren(QLineEdit):
+            widget.textChanged.connect(self.updateEstimate)
+
         self.outerLayout.addWidget(self.OkCancelButtonBox)
         self.toggleHiddenParams()
         self.toggleHideable()
@@ -354,6 +730,7 @@ class UISpritesheetExporter(object):
         self.doc = self.app.activeDocument()
         if self.exportDirTx.text() == "":
             self.resetExportDir()
+        self.updateEstimate()
         self.mainDialog.setWindowTitle(i18n("SpritesheetExporter"))
         self.mainDialog.setSizeGripEnabled(True)
         self.mainDialog.show()
@@ -389,27 +766,194 @@ class UISpritesheetExporter(object):
         if self.spritesExportPath != "":
             self.spritesExportDirTx.setText(str(self.spritesExportPath))
 
+    # "idle:0-11, walk:12-35/2" -> [("idle", 0, 11, 1), ("walk", 12, 35, 2)]
+    def parseAnimations(self, text):
+        animations = []
+        for part in text.split(","):
+            if part.strip() == "":
+                continue
+            name, _, frames = part.rpartition(":")
+            frames, _, step = frames.partition("/")
+            start, _, end = frames.partition("-")
+            try:
+                animation = (name.strip(), int(start), int(end),
+                             int(step) if step.strip() else 1)
+            except ValueError:
+                raise ValueError(part.strip())
+            if animation[0] == "" or animation[3] < 1:
+                raise ValueError(part.strip())
+            animations.append(animation)
+        return animations
+
+    def parseScales(self, text):
+        scales = []
+        for part in text.split(","):
+            if part.strip() == "":
+                continue
+            try:
+                scale = float(part)
+            except ValueError:
+                raise ValueError(part.strip())
+            if scale <= 0:
+                raise ValueError(part.strip())
+            scales.append(scale)
+        return scales
+
+    # the dialog's settings on an exporter
+    def applySettings(self, exporter, animations, scales):
+        exporter.exportName = self.exportName.text().split('.')[0]
+        exporter.exportDir = Path(self.exportPath)
+        exporter.layersAsAnimation = self.layersAsAnimation.isChecked()
+        exporter.groupsAsFrames = self.groupsAsFrames.isChecked()
+        exporter.writeTextureAtlas = self.writeTextureAtlas.isChecked()
+        exporter.atlasFormat = self.atlasFormat.currentText()
+        exporter.captureInMemory = self.captureInMemory.isChecked()
+        if self.numpyCompositor.isChecked():
+            exporter.compositor = "numpy"
+        else:
+            exporter.compositor = "layers"
+        exporter.trim = self.trim.isChecked()
+        exporter.removeDuplicates = self.removeDuplicates.isChecked()
+        exporter.incremental = self.incremental.isChecked()
+        exporter.keyframesOnly = self.keyframesOnly.isChecked()
+        exporter.packer = self.packer.currentText()
+        exporter.maxSheetSize = self.maxSheetSize.value()
+        exporter.powerOfTwo = self.powerOfTwo.isChecked()
+        exporter.allowRotation = self.allowRotation.isChecked()
+        exporter.encodeWorkers = self.encodeWorkers.value()
+        exporter.framesInFlight = self.framesInFlight.value()
+        exporter.sheetFormat = self.sheetFormat.currentText()
+        exporter.pngLevel = self.pngLevel.value()
+        exporter.compareFormats = self.compareFormats.isChecked()
+        exporter.scales = scales
+        exporter.scaleFilter = self.scaleFilter.currentText()
+        if self.outputDepth.currentText() == "8 bits":
+            exporter.outputDepth = "U8"
+        else:
+            exporter.outputDepth = ""
+        exporter.dither = self.dither.isChecked()
+        exporter.premultiplyAlpha = self.premultiplyAlpha.isChecked()
+        exporter.lowMemory = self.lowMemory.isChecked()
+        exporter.scratchFrames = self.scratchFrames.isChecked()
+        exporter.traceExport = self.traceExport.isChecked()
+        exporter.profileExport = self.profileExport.isChecked()
+        exporter.isDirectionHorizontal = self.horDir.isChecked()
+        exporter.rows = self.rows.value()
+        exporter.columns = self.columns.value()
+        exporter.start = self.start.value()
+        exporter.end = self.end.value()
+        exporter.step = self.step.value()
+        exporter.animations = animations
+        exporter.removeTmp = self.removeTmp.isChecked()
+        exporter.forceNew = self.forceNew.isChecked()
+        if self.spritesExportDirTx.text() != "":
+            exporter.spritesExportDir = Path(self.spritesExportDirTx.text())
+        else:
+            # important: we reset spritesheetexporter's spritesExportDir
+            exporter.spritesExportDir = exporter.defaultPath
+
+    # the sheet the settings would make, planned without rendering
+    # anything, and what's wrong with it in red
+    def updateEstimate(self, *args):
+        if self.doc is None:
+            self.estimate.setText(i18n("No document to export"))
+            return
+        try:
+            animations = self.parseAnimations(self.animations.text())
+            scales = self.parseScales(self.scales.text())
+        except ValueError:
+            self.estimate.setText(i18n("Can't read the animations or scales"))
+            return
+        exporter = spritesheetexporter.SpritesheetExporter()
+        self.applySettings(exporter, animations, scales)
+        try:
+            layout = exporter.planLayout(self.doc)
+        except ValueError as error:
+            self.estimate.setText(
+                '<font color="red">' + str(error) + "</font>")
+            return
+        text = (i18n("Sheet ") + str(layout.width) + "x" +
+                str(layout.height))
+        if len(layout.pages) > 1:
+            text += " (" + str(len(layout.pages)) + i18n(" pages)")
+        text += (", " + str(len(layout.frames)) + i18n(" frames, about ") +
+                 layoutplanner.describeBytes(layout.peakBytes) +
+                 i18n(" of memory, files up to ") +
+                 layoutplanner.describeBytes(layout.outputBytes))
+        for warning in layout.warnings:
+            text += '<br><font color="red">' + i18n(warning) + "</font>"
+        self.estimate.setText(text)
+
     def confirmButton(self):
+        try:
+            animations = self.parseAnimations(self.animations.text())
+        except ValueError as error:
+            QMessageBox.warning(self.mainDialog, i18n("SpritesheetExporter"),
+                i18n("Can't read the animation ") + '"' + str(error) + '"' +
+                i18n(", expected name:start-end or name:start-end/step"))
+            return
+        try:
+            scales = self.parseScales(self.scales.text())
+        except ValueError as error:
+            QMessageBox.warning(self.mainDialog, i18n("SpritesheetExporter"),
+                i18n("Can't read the scale ") + '"' + str(error) + '"' +
+                i18n(", expected a number above 0"))
+            return
+
         # if you double click it shouldn't interrupt
         # the first run of the function with a new one
         self.mainDialog.setDisabled(True)
 
-        self.exp.exportName = self.exportName.text().split('.')[0]
-        self.exp.exportDir = Path(self.exportPath)
-        self.exp.layersAsAnimation = self.layersAsAnimation.isChecked()
-        self.exp.writeTextureAtlas = self.writeTextureAtlas.isChecked()
-        self.exp.isDirectionHorizontal = self.horDir.isChecked()
-        self.exp.rows = self.rows.value()
-        self.exp.columns = self.columns.value()
-        self.exp.start = self.start.value()
-        self.exp.end = self.end.value()
-        self.exp.step = self.step.value()
-        self.exp.removeTmp = self.removeTmp.isChecked()
-        self.exp.forceNew = self.forceNew.isChecked()
-        if self.spritesExportDirTx.text() != "":
-            self.exp.spritesExportDir = Path(self.spritesExportDirTx.text())
+        self.applySettings(self.exp, animations, scales)
+        # krita's api can only be used from its main thread,
+        # so the export runs there and lets the event loop
+        # run (and the cancel button work) after each frame;
+        # the progress blocks every window, krita's too,
+        # so the document can't be edited or closed halfway
+        self.progress = QProgressDialog(
+            i18n("Starting the export..."), i18n("Cancel"), 0, 0,
+            self.mainDialog)
+        self.progress.setWindowTitle(i18n("Exporting spritesheet"))
+        self.progress.setWindowModality(Qt.ApplicationModal)
+        self.progress.setMinimumDuration(0)
+        self.progressStage = None
+        self.exp.onProgress = self.showProgress
+        failure = None
+        try:
+            finished = self.exp.export()
+        except Exception as error:
+            failure = error
+            finished = False
+        finally:
+            self.exp.onProgress = None
+            self.progress.close()
+        if failure is not None:
+            QMessageBox.warning(self.mainDialog, i18n("SpritesheetExporter"),
+                i18n("The export failed: ") + str(failure))
+        if finished:
+            self.mainDialog.hide()
         else:
-            # important: we reset spritesheetexporter's spritesExportDir
-            self.exp.spritesExportDir = self.exp.defaultPath
-        self.exp.export()
-        self.mainDialog.hide()
+            # cancelled or failed, the settings are still there to try again
+            self.mainDialog.setDisabled(False)
+
+    # frames done, how many per second and about how long is left
+    def showProgress(self, stage, done, total):
+        now = time.perf_counter()
+        if stage != self.progressStage:
+            self.progressStage = stage
+            self.stageStart = now
+            self.stageStartDone = done
+        text = (i18n(progressStages[stage]) + " " +
+                str(done) + " / " + str(total))
+        elapsed = now - self.stageStart
+        if elapsed > 0 and done > self.stageStartDone:
+            rate = (done - self.stageStartDone) / elapsed
+            text += ("\n" + "{:.1f}".format(rate) + i18n(" per second, ") +
+                     i18n("about ") + str(int((total - done) / rate) + 1) +
+                     i18n(" s left"))
+        self.progress.setMaximum(total)
+        self.progress.setValue(done)
+        self.progress.setLabelText(text)
+        QApplication.processEvents()
+        if self.progress.wasCanceled():
+            self.exp.cancel()
@@ -0,0 +1,14 @@
+"""
+the tests run outside of krita: the plugin's package is imported
+from the repository, and the modules that need krita get the
+stand-in from benchmarks/krita.py
+
+"""
+
+import sys
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+for path in (root, root.joinpath("benchmarks")):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
@@ -0,0 +1,145 @@
+import json
+import struct
+
+import pytest
+
+from spritesheetExporter import atlaswriters
+
+
+meta = {"pages": [{"image": "s.png", "size": {"w": 64, "h": 32}},
+                  {"image": "s_1.png", "size": {"w": 16, "h": 16}}]}
+
+frames = [
+    {"filename": 0, "frame": {"x": 0, "y": 0, "w": 16, "h": 16},
+     "duration": 125},
+    {"filename": 1, "frame": {"x": 16, "y": 0, "w": 10, "h": 12},
+     "rotated": True, "trimmed": True,
+     "spriteSourceSize": {"x": 3, "y": 2, "w": 12, "h": 10},
+     "sourceSize": {"w": 16, "h": 16}, "duration": 250},
+    {"filename": 4, "frame": {"x": 0, "y": 0, "w": 16, "h": 16},
+     "page": 1, "duration": 125}]
+
+
+def writeAtlas(tmp_path, name, animations=None, durations=None):
+    writer = atlaswriters.writers[name](tmp_path.joinpath("s"), 8)
+    writer.begin(meta)
+    for frame in frames:
+        writer.addFrame(frame)
+    writer.end(animations, durations)
+    assert writer.files == []
+    return writer
+
+
+def testPhaser(tmp_path):
+    writeAtlas(tmp_path, "phaser", {"walk": [0, 1, 0], "idle": [4]},
+               {"walk": [125, 250, 500], "idle": [125]})
+    atlas = json.loads(tmp_path.joinpath("s.json").read_text())
+    assert atlas["frames"] == frames
+    assert atlas["meta"] == meta
+    assert atlas["animations"]["walk"] == [
+        {"filename": 0, "duration": 125}, {"filename": 1, "duration": 250},
+        {"filename": 0, "duration": 500}]
+
+
+def testPhaserAnimationsWithoutDurations(tmp_path):
+    writeAtlas(tmp_path, "phaser", {"walk": [0, 1]})
+    atlas = json.loads(tmp_path.joinpath("s.json").read_text())
+    assert atlas["animations"] == {"walk": [0, 1]}
+
+
+@pytest.mark.parametrize("name", ["texturepacker-hash",
+                                  "texturepacker-array"])
+def testTexturePackerPages(tmp_path, name):
+    writeAtlas(tmp_path, name, {"walk": [0, 1]})
+    first = json.loads(tmp_path.joinpath("s_0.json").read_text())
+    second = json.loads(tmp_path.joinpath("s_1.json").read_text())
+    assert first["meta"]["image"] == "s.png"
+    assert second["meta"]["size"] == {"w": 16, "h": 16}
+    if name == "texturepacker-hash":
+        assert sorted(first["frames"]) == ["0", "1"]
+        entry = first["frames"]["1"]
+        assert list(second["frames"]) == ["4"]
+    else:
+        assert [frame["filename"] for frame in first["frames"]] == ["0", "1"]
+        entry = first["frames"][1]
+    assert entry["rotated"] and entry["trimmed"]
+    assert entry["spriteSourceSize"] == {"x": 3, "y": 2, "w": 12, "h": 10}
+    assert entry["duration"] == 250
+    assert first["animations"] == {"walk": ["0", "1"]}
+
+
+@pytest.mark.parametrize("name", ["texturepacker-hash",
+                                  "texturepacker-array"])
+def testTexturePackerAnimationDurations(tmp_path, name):
+    writeAtlas(tmp_path, name, {"walk": [0, 1, 0]},
+               {"walk": [125, 250, 500]})
+    first = json.loads(tmp_path.joinpath("s_0.json").read_text())
+    assert first["animations"] == {"walk": [
+        {"filename": "0", "duration": 125},
+        {"filename": "1", "duration": 250},
+        {"filename": "0", "duration": 500}]}
+
+
+def testGodot(tmp_path):
+    writeAtlas(tmp_path, "godot", {"walk": [0, 1, 7]},
+               {"walk": [125, 250, 125]})
+    tres = tmp_path.joinpath("s.tres").read_text()
+    assert tres.count('[ext_resource type="Texture2D"') == 2
+    assert tres.count('[sub_resource type="AtlasTexture"') == 3
+    assert 'atlas = ExtResource("2")\nregion = Rect2(0, 0, 16, 16)' in tres
+    assert "margin = Rect2(3, 2, 4, 6)" in tres
+    # at 8 frames per second, frame 7 isn't in the atlas
+    assert '"duration": 1,\n"texture": SubResource("AtlasTexture_0")' in tres
+    assert '"duration": 2,\n"texture": SubResource("AtlasTexture_1")' in tres
+    assert tres.count('"texture": SubResource') == 2
+    assert '"speed": 8.0' in tres
+
+
+# the animations of a binary atlas, after its pages
+def binaryAnimations(data, position):
+    animationsNum, = struct.unpack_from("<I", data, position)
+    position += 4
+    animations = {}
+    for _ in range(animationsNum):
+        length, = struct.unpack_from("<H", data, position)
+        name = data[position + 2:position + 2 + length].decode("utf-8")
+        position += 2 + length
+        count, = struct.unpack_from("<I", data, position)
+        values = struct.unpack_from("<" + str(2 * count) + "I", data,
+                                    position + 4)
+        animations[name] = list(zip(values[0::2], values[1::2]))
+        position += 4 + 8 * count
+    assert position == len(data)
+    return animations
+
+
+def testBinary(tmp_path):
+    writeAtlas(tmp_path, "binary", {"walk": [1, 0, 9]})
+    data = tmp_path.joinpath("s.atlas").read_bytes()
+    header = atlaswriters.BinaryWriter.header
+    record = atlaswriters.BinaryWriter.record
+    magic, version, recordSize, framesNum, pagesNum = header.unpack_from(data)
+    assert (magic, version, recordSize, framesNum, pagesNum) == \
+        (b"SSAT", 2, 44, 3, 2)
+    records = [record.unpack_from(data, header.size + i * record.size)
+               for i in range(framesNum)]
+    assert records[1] == (1, 0, 3, 16, 0, 10, 12, 3, 2, 16, 16, 250)
+    assert records[2][:2] == (4, 1)
+    position = header.size + framesNum * record.size
+    for image in (b"s.png", b"s_1.png"):
+        width, height, length = struct.unpack_from("<IIH", data, position)
+        position += 10
+        assert data[position:position + length] == image
+        position += length
+    # the frame without a record is left out,
+    # and the animation doesn't say how long they're shown
+    assert binaryAnimations(data, position) == {"walk": [(1, 0), (0, 0)]}
+
+
+def testBinaryAnimationDurations(tmp_path):
+    writeAtlas(tmp_path, "binary", {"walk": [1, 9, 0], "idle": [4]},
+               {"walk": [250, 125, 500], "idle": [1000]})
+    data = tmp_path.joinpath("s.atlas").read_bytes()
+    position = data.index(b"s_1.png") + len(b"s_1.png")
+    assert binaryAnimations(data, position) == {
+        "walk": [(1, 250), (0, 500)], "idle": [(2, 1000)]}
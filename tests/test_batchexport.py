@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+import krita
+
+from spritesheetExporter import batchexport
+
+
+# .kra files krita's stand-in opens as small animations
+@pytest.fixture
+def kraFiles(tmp_path, monkeypatch):
+    def make(*names):
+        paths = []
+        for name in names:
+            path = tmp_path.joinpath(name + ".kra")
+            path.touch()
+            monkeypatch.setitem(krita.Krita.instance().files, str(path),
+                                krita.animatedDocument(16, 16, 4, name=name))
+            paths.append(path)
+        return paths
+    return make
+
+
+def testEachFileNextToItself(kraFiles):
+    paths = kraFiles("walk", "run")
+    results = batchexport.exportFiles(paths, {"writeTextureAtlas": True},
+                                      log=None)
+    assert [result["ok"] for result in results] == [True, True]
+    for path in paths:
+        assert path.with_suffix(".png").exists()
+        assert path.with_suffix(".json").exists()
+        # and the document is closed once exported
+        assert krita.Krita.instance().files[str(path)].closed
+
+
+def testAFailingFileDoesntStopTheOthers(kraFiles, tmp_path):
+    walk, run, jump = kraFiles("walk", "run", "jump")
+    missing = tmp_path.joinpath("missing.kra")
+    logged = []
+    results = batchexport.exportFiles(
+        [walk, missing, run, jump], {"compositor": "numpy"},
+        # too small a sheet for its sprites
+        perFile={str(run): {"maxSheetSize": 8}}, log=logged.append)
+    assert [result["ok"] for result in results] == [True, False, False, True]
+    assert "FileNotFoundError" in results[1]["error"]
+    assert "ValueError" in results[2]["error"]
+    assert jump.with_suffix(".png").exists()
+    assert not run.with_suffix(".png").exists()
+    assert len(logged) == 4 and logged[2].startswith("failed to export")
+    # the failed export's document is closed too
+    assert krita.Krita.instance().files[str(run)].closed
+
+
+def testUnknownSettings():
+    with pytest.raises(ValueError, match="unknown setting"):
+        batchexport.makeExporter({"trimming": True})
+    with pytest.raises(ValueError, match="unknown setting"):
+        batchexport.makeExporter({"frames": {}})
+    exporter = batchexport.makeExporter({"exportDir": "out", "step": 2})
+    assert exporter.exportDir.name == "out" and exporter.step == 2
+
+
+def testManifest(tmp_path):
+    manifest = tmp_path.joinpath("sprites.json")
+    manifest.write_text(json.dumps({
+        "settings": {"exportDir": "build", "trim": True},
+        "files": ["walk.kra",
+                  {"file": "run/run.kra",
+                   "settings": {"step": 2, "spritesExportDir": "tmp"}}]}))
+    files, settings, perFile = batchexport.loadManifest(manifest)
+    walk = str(tmp_path.joinpath("walk.kra"))
+    run = str(tmp_path.joinpath("run", "run.kra"))
+    assert files == [walk, run]
+    assert settings == {"exportDir": str(tmp_path.joinpath("build")),
+                        "trim": True}
+    assert perFile == {walk: {},
+                       run: {"step": 2,
+                             "spritesExportDir": str(tmp_path.joinpath("tmp"))}}
+
+
+# the manifest's settings, then --set, then each file's own
+def testMainWithAManifest(kraFiles, tmp_path):
+    walk, run = kraFiles("walk", "run")
+    tmp_path.joinpath("sprites.json").write_text(json.dumps({
+        "settings": {"exportDir": "build", "exportName": "sheet"},
+        "files": [{"file": "walk.kra",
+                   "settings": {"exportName": "walking"}},
+                  "run.kra"]}))
+    report = tmp_path.joinpath("report.json")
+    failed = batchexport.main(
+        ["--manifest", str(tmp_path.joinpath("sprites.json")),
+         "--set", "writeTextureAtlas=true", "--set", "atlasFormat=godot",
+         "--report", str(report)])
+    assert failed == 0
+    build = tmp_path.joinpath("build")
+    assert build.joinpath("walking.png").exists()
+    assert build.joinpath("walking.tres").exists()
+    assert build.joinpath("sheet.tres").exists()
+    results = json.loads(report.read_text())["files"]
+    assert [result["ok"] for result in results] == [True, True]
+
+
+def testParseValue():
+    assert batchexport.parseValue("true") is True
+    assert batchexport.parseValue("2") == 2
+    assert batchexport.parseValue("maxrects") == "maxrects"
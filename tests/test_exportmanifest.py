@@ -0,0 +1,64 @@
+import json
+
+from spritesheetExporter import exportmanifest
+
+
+def manifest():
+    frames = {
+        "0": {"hash": "aa", "page": 0, "x": 0, "y": 0, "w": 8, "h": 8,
+              "rotated": False},
+        "1": {"hash": "bb", "page": 0, "x": 8, "y": 0, "w": 8, "h": 8,
+              "rotated": False},
+        "3": {"hash": "cc", "page": 1, "x": 0, "y": 0, "w": 8, "h": 8,
+              "rotated": True}}
+    return exportmanifest.ExportManifest(
+        {"packer": "maxrects", "trim": True}, frames, {"2": "0"},
+        [{"image": "s.png", "w": 16, "h": 8},
+         {"image": "s_1.png", "w": 8, "h": 8}],
+        [{"image": "s@0.5x.png", "scale": "0.5"}])
+
+
+def testChangedFrames():
+    previous = manifest()
+    assert previous.changedFrames({"0": "aa", "1": "bb", "3": "cc"}) == []
+    assert previous.changedFrames({"0": "aa", "1": "ff", "3": "cc"}) == ["1"]
+    # a frame without a hash anymore changed too
+    assert previous.changedFrames({"0": "aa", "1": "bb"}) == ["3"]
+
+
+def testMatches():
+    previous = manifest()
+    settings = {"packer": "maxrects", "trim": True}
+    assert previous.matches(settings, [0, 1, 2, 3], {2: 0})
+    assert not previous.matches({"packer": "skyline", "trim": True},
+                                [0, 1, 2, 3], {2: 0})
+    assert not previous.matches(settings, [0, 1, 2, 3, 4], {2: 0})
+    assert not previous.matches(settings, [0, 1, 2, 3], {2: 1})
+    assert not previous.matches(settings, [0, 1, 2, 3], {})
+
+
+def testHashOf():
+    previous = manifest()
+    assert previous.hashOf(1) == "bb"
+    assert previous.hashOf("3") == "cc"
+    # duplicates aren't drawn, they have no hash of their own
+    assert previous.hashOf(2) is None
+
+
+def testSaveAndLoad(tmp_path):
+    path = tmp_path.joinpath("s.manifest.json")
+    manifest().save(path)
+    loaded = exportmanifest.load(path)
+    expected = manifest()
+    for name in ("settings", "frames", "duplicates", "pages", "scaledPages"):
+        assert getattr(loaded, name) == getattr(expected, name)
+
+
+def testUnusableManifests(tmp_path):
+    path = tmp_path.joinpath("s.manifest.json")
+    assert exportmanifest.load(path) is None
+    path.write_text("{ not json")
+    assert exportmanifest.load(path) is None
+    path.write_text(json.dumps(
+        {"version": exportmanifest.ExportManifest.version + 1}))
+    assert exportmanifest.load(path) is None
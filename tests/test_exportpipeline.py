@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+
+import krita
+
+from spritesheetExporter import exportpipeline
+from spritesheetExporter import spritesheetexporter
+
+
+# processes the frames once gate is set, telling started about the first
+def gatedProcess(done):
+    gate = threading.Event()
+    started = threading.Event()
+
+    def process(num, data):
+        started.set()
+        gate.wait()
+        done.append((num, data))
+
+    return process, gate, started
+
+
+def testWithoutThreadFramesAreProcessedRightAway():
+    done = []
+    pipeline = exportpipeline.FramePipeline(
+        lambda num, data: done.append((num, data)))
+    pipeline.put(0, b"a")
+    assert done == [(0, b"a")]
+    pipeline.finish()
+    assert pipeline.thread is None
+
+
+def testFramesAreProcessedInOrder():
+    done = []
+    pipeline = exportpipeline.FramePipeline(
+        lambda num, data: done.append((num, data)), maxInFlight=3)
+    for num in range(50):
+        pipeline.put(num, bytes([num]))
+    pipeline.finish()
+    assert done == [(num, bytes([num])) for num in range(50)]
+
+
+def testNoMoreThanMaxInFlightFramesWait():
+    done = []
+    process, gate, started = gatedProcess(done)
+    pipeline = exportpipeline.FramePipeline(process, maxInFlight=2)
+    pipeline.put(0, b"")
+    started.wait()
+    # the background thread is busy with the first frame,
+    # two more fit in the queue
+    pipeline.put(1, b"")
+    pipeline.put(2, b"")
+    assert pipeline.queue.full()
+    putting = threading.Thread(target=pipeline.put, args=(3, b""))
+    putting.start()
+    putting.join(0.1)
+    assert putting.is_alive()
+    gate.set()
+    putting.join()
+    pipeline.finish()
+    assert [num for num, data in done] == [0, 1, 2, 3]
+
+
+def testErrorsComeBackToTheMainThread():
+    def process(num, data):
+        if num == 1:
+            raise ValueError("frame 1")
+
+    pipeline = exportpipeline.FramePipeline(process, maxInFlight=1)
+    pipeline.put(0, b"")
+    pipeline.put(1, b"")
+    with pytest.raises(ValueError, match="frame 1"):
+        # given back on a later put() or, at the latest, by finish()
+        for num in range(2, 10):
+            pipeline.put(num, b"")
+        pipeline.finish()
+    assert pipeline.thread is None
+
+
+def testCancelDropsTheWaitingFrames():
+    done = []
+    process, gate, started = gatedProcess(done)
+    pipeline = exportpipeline.FramePipeline(process, maxInFlight=3)
+    pipeline.put(0, b"")
+    started.wait()
+    pipeline.put(1, b"")
+    pipeline.put(2, b"")
+    # the frame being processed ends, the others never start
+    threading.Timer(0.05, gate.set).start()
+    pipeline.cancel()
+    assert [num for num, data in done] == [0]
+    assert pipeline.thread is None
+    # nothing to give back once cancelled
+    pipeline.finish()
+
+
+# frames captured while the previous ones are written give the same
+# sheet, and cancelling leaves no thread behind
+@pytest.mark.parametrize("compositor", ["layers", "numpy"])
+def testExportWithFramesInFlight(tmp_path, compositor):
+    if compositor == "numpy":
+        pytest.importorskip("numpy")
+    sheets = []
+    for framesInFlight in (0, 3):
+        exporter = spritesheetexporter.SpritesheetExporter()
+        exporter.exportDir = tmp_path.joinpath(str(framesInFlight))
+        exporter.exportDir.mkdir()
+        exporter.spritesExportDir = exporter.exportDir.joinpath("sprites")
+        exporter.exportName = "s"
+        exporter.compositor = compositor
+        exporter.captureInMemory = True
+        exporter.framesInFlight = framesInFlight
+        assert exporter.export(doc=krita.animatedDocument(16, 16, 20))
+        sheets.append(krita.readPNG(exporter.exportDir.joinpath("s.png")))
+    assert sheets[0] is not None and sheets[0] == sheets[1]
+
+    def cancelOnFrame5(stage, done, total):
+        if done == 5:
+            exporter.cancel()
+
+    threads = threading.active_count()
+    exporter.onProgress = cancelOnFrame5
+    assert not exporter.export(doc=krita.animatedDocument(16, 16, 20))
+    assert threading.active_count() == threads
@@ -0,0 +1,98 @@
+import json
+import threading
+
+import krita
+
+from spritesheetExporter import exporttrace
+from spritesheetExporter import spritesheetexporter
+
+
+def testSpansCountersAndMarks():
+    trace = exporttrace.ExportTrace()
+    with trace.span("render", frame=3):
+        trace.mark("rendering")
+    started = trace.begin("write sheet")
+    trace.end(started)
+    with trace.span("render", frame=4):
+        pass
+    trace.count("bytes written", 10)
+    trace.count("bytes written", 5)
+    trace.count("frames skipped")
+    assert [(name, args) for name, start, end, thread, args
+            in trace.spans] == [("render", {"frame": 3}),
+                                ("write sheet", {}),
+                                ("render", {"frame": 4})]
+    assert all(end >= start for name, start, end, thread, args
+               in trace.spans)
+    assert trace.counters == {"bytes written": 15, "frames skipped": 1}
+    assert [message for message, at, thread in trace.marks] == ["rendering"]
+    totals = trace.totals()
+    assert totals["render"]["count"] == 2
+    assert totals["write sheet"]["count"] == 1
+
+
+def testSpanEndsOnError():
+    trace = exporttrace.ExportTrace()
+    try:
+        with trace.span("export"):
+            raise ValueError()
+    except ValueError:
+        pass
+    assert [span[0] for span in trace.spans] == ["export"]
+
+
+def testDisabledTraceRecordsNothing():
+    trace = exporttrace.ExportTrace(enabled=False)
+    with trace.span("render"):
+        trace.mark("rendering")
+    trace.end(trace.begin("write sheet"))
+    trace.count("bytes written", 10)
+    assert (trace.spans, trace.marks, trace.counters) == ([], [], {})
+
+
+def testCountsFromSeveralThreads():
+    trace = exporttrace.ExportTrace()
+
+    def count():
+        for i in range(1000):
+            trace.count("frames")
+
+    threads = [threading.Thread(target=count) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert trace.counters["frames"] == 4000
+
+
+def testSavedFiles(tmp_path):
+    trace = exporttrace.ExportTrace()
+    with trace.span("render", frame=0):
+        trace.mark("rendering")
+    trace.count("bytes written", 7)
+    trace.save(tmp_path.joinpath("t.json"))
+    trace.saveChromeTrace(tmp_path.joinpath("t.chrome.json"))
+    saved = json.loads(tmp_path.joinpath("t.json").read_text())
+    assert saved["spans"][0]["name"] == "render"
+    assert saved["spans"][0]["args"] == {"frame": 0}
+    assert saved["marks"][0]["message"] == "rendering"
+    assert saved["counters"] == {"bytes written": 7}
+    assert saved["totals"]["render"]["count"] == 1
+    events = json.loads(
+        tmp_path.joinpath("t.chrome.json").read_text())["traceEvents"]
+    assert [event["ph"] for event in events] == ["X", "i", "C"]
+    assert events[0]["dur"] >= 0
+    assert events[2]["args"] == {"bytes written": 7}
+
+
+# an export with a trace writes both files next to the sheet
+def testExportWritesItsTrace(tmp_path):
+    exporter = spritesheetexporter.SpritesheetExporter()
+    exporter.exportDir = tmp_path
+    exporter.spritesExportDir = tmp_path.joinpath("sprites")
+    exporter.exportName = "s"
+    exporter.traceExport = True
+    assert exporter.export(doc=krita.animatedDocument(8, 8, 3))
+    saved = json.loads(tmp_path.joinpath("s.trace.json").read_text())
+    assert "export" in saved["totals"]
+    assert tmp_path.joinpath("s.trace.chrome.json").exists()
@@ -0,0 +1,120 @@
+import krita
+
+from spritesheetExporter import keyframeindex
+
+
+# a document whose layers have keyframes at these times
+def documentWithKeyframes(*layersTimes, frames=24):
+    doc = krita.Document(4, 4, "keyframes")
+    doc.setFullClipRange(0, frames - 1)
+    for i, times in enumerate(layersTimes):
+        layer = krita.Node(doc, "layer" + str(i))
+        layer.setKeyframes(times)
+        doc.root.addChildNode(layer, None)
+    doc.setModified(False)
+    return doc
+
+
+# how many times the layers were asked for a keyframe
+def countLookups(doc, monkeypatch):
+    calls = []
+    lookup = krita.Node.hasKeyframeAtTime
+
+    def counted(layer, time):
+        calls.append(time)
+        return lookup(layer, time)
+
+    monkeypatch.setattr(krita.Node, "hasKeyframeAtTime", counted)
+    return calls
+
+
+def index(doc):
+    keyframes = keyframeindex.KeyframeIndex(doc)
+    keyframes.readTimes(doc)
+    return keyframes
+
+
+def testIndexOfEveryVisibleLayer():
+    doc = documentWithKeyframes([2, 10], [5, 10, 20])
+    hidden = krita.Node(doc, "hidden")
+    hidden.setKeyframes([0, 23])
+    hidden.setVisible(False)
+    doc.root.addChildNode(hidden, None)
+    keyframes = index(doc)
+    assert keyframes.keyframeTimes() == [2, 5, 10, 20]
+    assert keyframes.firstKeyframe(100) == 2
+    assert keyframes.firstKeyframe(1) == 1
+    assert keyframes.lastKeyframe(0) == 20
+    assert keyframes.hasKeyframeAt(5) and not keyframes.hasKeyframeAt(6)
+
+
+def testRangeOnlyLooksFromTheEnds(monkeypatch):
+    doc = documentWithKeyframes(*[[100 + layer, 500, 899 - layer]
+                                  for layer in range(50)], frames=1000)
+    calls = countLookups(doc, monkeypatch)
+    keyframes = keyframeindex.forDocument(doc)
+    assert (keyframes.firstKeyframe(1000), keyframes.lastKeyframe(0)) == \
+        (100, 899)
+    # from 0 to the first keyframe, from the end to the last one
+    assert len(calls) == sum(101 + layer + 101 + layer
+                             for layer in range(50))
+    keyframeindex.invalidate()
+
+
+def testChangesBetween():
+    keyframes = index(documentWithKeyframes([0, 4, 8]))
+    assert keyframes.changesBetween(0, 4)
+    assert not keyframes.changesBetween(0, 3)
+    assert not keyframes.changesBetween(4, 7)
+    assert keyframes.changesBetween(3, 100)
+    assert not keyframes.changesBetween(8, 100)
+
+
+def testExposures():
+    keyframes = index(documentWithKeyframes([0, 3, 6]))
+    exposed, held = keyframeindex.exposures(keyframes, range(0, 9))
+    assert exposed == [0, 3, 6]
+    assert held == {1: 0, 2: 0, 4: 3, 5: 3, 7: 6, 8: 6}
+
+
+def testAnimationsStartOnTheirOwnFrame():
+    keyframes = index(documentWithKeyframes([0, 6]))
+    exposed, held = keyframeindex.exposures(keyframes, range(0, 9),
+                                            starts={4})
+    assert exposed == [0, 4, 6]
+    assert held == {1: 0, 2: 0, 3: 0, 5: 4, 7: 6, 8: 6}
+
+
+def testCachedUntilTheKeyframesChange(monkeypatch):
+    doc = documentWithKeyframes([0, 5, 9])
+    keyframes = keyframeindex.forDocument(doc, allKeyframes=True)
+    calls = countLookups(doc, monkeypatch)
+    assert keyframeindex.forDocument(doc, allKeyframes=True) is keyframes
+    # only from the ends to the first keyframes, to check the key
+    assert len(calls) == 1 + (23 - 9 + 1)
+    layer = doc.topLevelNodes()[0]
+    # a keyframe after the last one, and the document is modified
+    layer.setKeyframes([0, 5, 9, 12])
+    assert doc.modified()
+    assert keyframeindex.forDocument(
+        doc, allKeyframes=True).keyframeTimes() == [0, 5, 9, 12]
+    # one inside the range of an already modified document can't be seen,
+    # an export reads them again
+    layer.setKeyframes([0, 7, 9, 12])
+    assert keyframeindex.forDocument(
+        doc, allKeyframes=True).keyframeTimes() == [0, 5, 9, 12]
+    assert keyframeindex.forDocument(
+        doc, allKeyframes=True, fresh=True).keyframeTimes() == [0, 7, 9, 12]
+    keyframeindex.invalidate(doc)
+    assert keyframeindex.indexes == {}
+
+
+def testHiddenLayersChangeTheKey():
+    doc = documentWithKeyframes([0, 5], [3, 8])
+    keyframes = keyframeindex.forDocument(doc)
+    doc.setModified(False)
+    doc.topLevelNodes()[1].setVisible(False)
+    doc.setModified(False)
+    assert keyframeindex.forDocument(doc) is not keyframes
+    assert keyframeindex.forDocument(doc).lastKeyframe(0) == 5
+    keyframeindex.invalidate()
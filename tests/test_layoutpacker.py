@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from spritesheetExporter import layoutpacker
+
+
+def randomSizes(seed, count, smallest, biggest):
+    generator = random.Random(seed)
+    return [(generator.randint(smallest, biggest),
+             generator.randint(smallest, biggest)) for _ in range(count)]
+
+
+# the rect each placed sprite takes on the sheet, checking it's on it
+def placedRects(packer, sizes, placements):
+    rects = []
+    for (width, height), placement in zip(sizes, placements):
+        if placement is None:
+            continue
+        x, y, rotated = placement
+        if rotated:
+            width, height = height, width
+        assert x >= 0 and y >= 0
+        assert x + width <= packer.width and y + height <= packer.height
+        rects.append((x, y, width, height))
+    return rects
+
+
+def assertNoOverlap(rects):
+    rects = sorted(rects)
+    for i, (x, y, width, height) in enumerate(rects):
+        for otherX, otherY, otherWidth, otherHeight in rects[i + 1:]:
+            if otherX >= x + width:
+                break
+            assert otherY >= y + height or y >= otherY + otherHeight
+
+
+@pytest.mark.parametrize("name", sorted(layoutpacker.packers))
+@pytest.mark.parametrize("allowRotation", [False, True])
+@pytest.mark.parametrize("seed", range(4))
+def testPackersDontOverlap(name, allowRotation, seed):
+    sizes = randomSizes(seed, 300, 1, 64)
+    packer = layoutpacker.packers[name](allowRotation=allowRotation)
+    placements = packer.pack(sizes)
+    assert len(placements) == len(sizes)
+    assert None not in placements
+    rects = placedRects(packer, sizes, placements)
+    assertNoOverlap(rects)
+    if not allowRotation:
+        assert not any(placement[2] for placement in placements)
+
+
+@pytest.mark.parametrize("name", ["maxrects", "skyline"])
+def testMaxSizeLeavesSpritesOut(name):
+    sizes = randomSizes(7, 200, 8, 40)
+    packer = layoutpacker.packers[name](maxWidth=128, maxHeight=128)
+    placements = packer.pack(sizes)
+    assert None in placements
+    assert packer.width <= 128 and packer.height <= 128
+    assertNoOverlap(placedRects(packer, sizes, placements))
+
+
+@pytest.mark.parametrize("name", sorted(layoutpacker.packers))
+def testPowerOfTwo(name):
+    packer = layoutpacker.packers[name](powerOfTwo=True)
+    packer.pack(randomSizes(3, 20, 5, 30))
+    for size in (packer.width, packer.height):
+        assert size & (size - 1) == 0
+
+
+@pytest.mark.parametrize("name", sorted(layoutpacker.packers))
+def testNothingToPack(name):
+    packer = layoutpacker.packers[name]()
+    assert packer.pack([]) == []
+    assert (packer.width, packer.height) == (0, 0)
+
+
+def testGridIsRowsThenColumns():
+    packer = layoutpacker.GridPacker(columns=3)
+    placements = packer.pack([(10, 20)] * 5)
+    assert [placement[:2] for placement in placements] == \
+        [(0, 0), (10, 0), (20, 0), (0, 20), (10, 20)]
+    assert (packer.width, packer.height) == (30, 40)
+
+
+def testGridShape():
+    assert layoutpacker.gridShape(12) == (3, 4)
+    assert layoutpacker.gridShape(12, rows=10) == (6, 2)
+    assert layoutpacker.gridShape(7, columns=2) == (4, 2)
@@ -0,0 +1,79 @@
+import pytest
+
+from spritesheetExporter import layoutpacker
+from spritesheetExporter import layoutplanner
+from spritesheetExporter import pixelbuffer
+from spritesheetExporter import pngencoder
+from spritesheetExporter import sheetformats
+
+
+def testFrameTimes():
+    assert layoutplanner.frameTimes(2, 10, 3) == [2, 5, 8]
+    # every frame of the animations, once, in order
+    assert layoutplanner.frameTimes(0, 100, 1, [
+        ("walk", 4, 8, 2), ("run", 0, 5, 1)]) == [0, 1, 2, 3, 4, 5, 6, 8]
+
+
+def testPlanIsTheExportersGrid():
+    frames = [0, 2, 4, 6, 8]
+    layout = layoutplanner.plan(frames, 30, 20, isDirectionHorizontal=False)
+    packer = layoutpacker.GridPacker(isDirectionHorizontal=False)
+    placements = packer.pack([(30, 20)] * len(frames))
+    assert layout.pages == [(packer.width, packer.height)]
+    assert (layout.width, layout.height) == (packer.width, packer.height)
+    for frame, (x, y, rotated) in zip(frames, placements):
+        assert layout.rects[frame] == (0, x, y, 30, 20)
+
+
+def testPlanOverflowsOnOtherPages():
+    layout = layoutplanner.plan(list(range(10)), 30, 30, maxSheetSize=64)
+    assert [page for page, x, y, width, height
+            in layout.rects.values()] == [0] * 4 + [1] * 4 + [2] * 2
+    assert all(max(page) <= 64 for page in layout.pages)
+    with pytest.raises(ValueError):
+        layoutplanner.plan([0, 1], 100, 100, maxSheetSize=64)
+
+
+def testEstimateWarnsAboutHugeSheets():
+    layout = layoutplanner.estimate(
+        layoutplanner.plan(list(range(100)), 2000, 2000), "U8")
+    assert layout.width > layoutplanner.maxTextureSize
+    assert "bigger than most gpus" in layout.warnings[0]
+    small = layoutplanner.estimate(
+        layoutplanner.plan(list(range(4)), 32, 32), "U8")
+    assert small.warnings == []
+
+
+def testEstimateMemory():
+    layout = layoutplanner.plan(list(range(16)), 64, 64)
+    whole = layoutplanner.estimate(layout, "U16", useCompositor=True,
+                                   outputDepth="U8").peakBytes
+    # the frames waiting (8 bits now) and the page, twice
+    assert whole == 16 * 64 * 64 * 4 + 2 * 256 * 256 * 4
+    # a band of a page this small is the whole page
+    assert layoutplanner.estimate(layout, "U16", useCompositor=True,
+                                  outputDepth="U8", lowMemory=True,
+                                  scratchFrames=True).peakBytes == \
+        2 * 256 * 256 * 4
+    big = layoutplanner.plan(list(range(64)), 256, 256)
+    lowMemory = layoutplanner.estimate(big, "U8", useCompositor=True,
+                                       lowMemory=True, scratchFrames=True)
+    assert lowMemory.peakBytes == 2 * pngencoder.stripBytes
+    scaled = layoutplanner.estimate(layout, "U8", useCompositor=True,
+                                    scales=[0.5, 1, 0.5]).outputBytes
+    assert scaled > layoutplanner.estimate(
+        layout, "U8", useCompositor=True).outputBytes
+
+
+@pytest.mark.skipif(not pixelbuffer.available(), reason="needs numpy")
+@pytest.mark.parametrize("sheetFormat", sorted(sheetformats.packedFormats))
+def testPackedPagesAreExactly(sheetFormat):
+    data = bytes(7 * 5 * 4)
+    assert len(sheetformats.encode(sheetFormat, data, 7, 5, "U8")) == \
+        layoutplanner.pageBytes(7, 5, sheetFormat, "U8")
+
+
+def testDescribeBytes():
+    assert layoutplanner.describeBytes(512) == "512 bytes"
+    assert layoutplanner.describeBytes(1536) == "1.5 KB"
+    assert layoutplanner.describeBytes(3 * 1024 ** 4) == "3072.0 GB"
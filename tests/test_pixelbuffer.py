@@ -0,0 +1,106 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from spritesheetExporter import pixelbuffer
+
+
+def testArrayRoundTrip():
+    data = bytes(range(128)) * 3
+    array = pixelbuffer.toArray(data, 8, 6, "U16")
+    assert array.shape == (6, 8, 4)
+    assert pixelbuffer.toBytes(array) == data
+
+
+def testOpacityOnlyChangesAlpha():
+    array = np.array([[[10, 20, 30, 255], [1, 2, 3, 101]]], dtype=np.uint8)
+    faded = pixelbuffer.withOpacity(array, 128)
+    assert (faded[:, :, :3] == array[:, :, :3]).all()
+    assert faded[0, :, 3].tolist() == [128, 51]
+
+
+def testPremultipliedRounds():
+    array = np.array([[[255, 128, 1, 128], [200, 100, 50, 0]]],
+                     dtype=np.uint8)
+    assert pixelbuffer.premultiplied(array).tolist() == \
+        [[[128, 64, 1, 128], [0, 0, 0, 0]]]
+
+
+def testEightBitFromSixteen():
+    array = np.array([[[0, 257, 32896, 65535]]], dtype=np.uint16)
+    assert pixelbuffer.toEightBit(array, "U16").tolist() == \
+        [[[0, 1, 128, 255]]]
+    # eight bits without a linear profile are left as they are
+    eight = np.zeros((2, 2, 4), dtype=np.uint8)
+    assert pixelbuffer.toEightBit(eight, "U8") is eight
+
+
+# float pixels are RGBA, clipped, and come out BGRA
+def testEightBitFromFloats():
+    array = np.array([[[1.0, 0.5, -0.5, 2.0]]], dtype=np.float32)
+    assert pixelbuffer.toEightBit(array, "F32").tolist() == \
+        [[[0, 128, 255, 255]]]
+
+
+# linear colors go through the sRGB curve, alpha doesn't
+def testEightBitFromLinear():
+    array = np.array([[[0.5, 0.0, 0.002, 0.5]]], dtype=np.float32)
+    assert pixelbuffer.toEightBit(array, "F32", linear=True).tolist() == \
+        [[[7, 0, 188, 128]]]
+
+
+# a flat color between two levels comes out as both,
+# in the proportion that keeps its average
+def testDitheringKeepsTheAverage():
+    array = np.full((8, 8, 4), 100.25 / 255, dtype=np.float32)
+    array[:, :, 3] = 1.0
+    plain = pixelbuffer.toEightBit(array, "F32")
+    dithered = pixelbuffer.toEightBit(array, "F32", dither=True)
+    assert (plain[:, :, :3] == 100).all()
+    assert set(np.unique(dithered[:, :, :3]).tolist()) == {100, 101}
+    assert dithered[:, :, :3].mean() == pytest.approx(100.25)
+    # alpha isn't dithered
+    assert (dithered[:, :, 3] == 255).all()
+
+
+def testOpaqueBounds():
+    array = np.zeros((10, 12, 4), dtype=np.uint8)
+    assert pixelbuffer.opaqueBounds(array) is None
+    array[3, 4, 3] = 1
+    array[6, 9, 3] = 255
+    assert pixelbuffer.opaqueBounds(array) == (4, 3, 6, 4)
+
+
+def testResampleKeepsSolidColor():
+    array = np.full((8, 8, 4), 200, dtype=np.uint8)
+    for resampleFilter in ("nearest", "box", "bilinear"):
+        resized = pixelbuffer.resample(array, 0.5, resampleFilter)
+        assert resized.shape == (4, 4, 4)
+        assert (resized == 200).all()
+
+
+@pytest.mark.parametrize("colorModel", sorted(pixelbuffer.channelCounts))
+@pytest.mark.parametrize("colorDepth", sorted(pixelbuffer.channelTypes))
+def testDataOpacityWithAndWithoutNumpy(monkeypatch, colorModel, colorDepth):
+    channels = pixelbuffer.channelCounts[colorModel]
+    generator = np.random.RandomState(channels)
+    if colorDepth in ("U8", "U16"):
+        values = generator.randint(0, np.iinfo(
+            pixelbuffer.channelTypes[colorDepth]).max + 1, (21, channels))
+    else:
+        values = generator.random_sample((21, channels))
+    pixels = values.astype(pixelbuffer.channelTypes[colorDepth])
+    faded = pixelbuffer.dataWithOpacity(pixels.tobytes(), colorModel,
+                                        colorDepth, 77)
+    result = np.frombuffer(faded, dtype=pixels.dtype).reshape(-1, channels)
+    # only the alpha, the last channel, changes
+    assert (result[:, :-1] == pixels[:, :-1]).all()
+    assert (result[:, -1] <= pixels[:, -1]).all()
+    monkeypatch.setattr(pixelbuffer, "np", None)
+    assert pixelbuffer.dataWithOpacity(pixels.tobytes(), colorModel,
+                                       colorDepth, 77) == faded
+
+
+def testDataOpacityOfUnknownModels():
+    assert pixelbuffer.dataWithOpacity(bytes(8), "RGB", "U8", 10) is None
+    assert pixelbuffer.dataWithOpacity(bytes(8), "RGBA", "U32", 10) is None
@@ -0,0 +1,173 @@
+import random
+import struct
+import zlib
+
+import pytest
+
+from spritesheetExporter import encoderpool
+from spritesheetExporter import pixelbuffer
+from spritesheetExporter import pngencoder
+
+
+def randomPixels(seed, width, height, colorDepth):
+    generator = random.Random(seed)
+    size = width * height * pngencoder.bytesPerPixel(colorDepth)
+    # runs of the same byte, so there's something to compress
+    data = bytearray()
+    while len(data) < size:
+        data += bytes([generator.randrange(256)]) * generator.randint(1, 9)
+    return bytes(data[:size])
+
+
+def paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+# a reader for the pngs we write: the chunks are checked,
+# the rows unfiltered and put back in krita's order
+def decode(png):
+    assert png[:8] == pngencoder.signature
+    chunks = []
+    position = 8
+    while position < len(png):
+        length, = struct.unpack(">I", png[position:position + 4])
+        tag = png[position + 4:position + 8]
+        data = png[position + 8:position + 8 + length]
+        crc, = struct.unpack(">I", png[position + 8 + length:
+                                       position + 12 + length])
+        assert crc == zlib.crc32(tag + data) & 0xffffffff
+        chunks.append((tag, data))
+        position += 12 + length
+    assert chunks[0][0] == b"IHDR" and chunks[-1][0] == b"IEND"
+    width, height, bitDepth, colorType = struct.unpack(
+        ">IIBB", chunks[0][1][:10])
+    assert colorType == 6
+    colorDepth = {8: "U8", 16: "U16"}[bitDepth]
+    pixelSize = pngencoder.bytesPerPixel(colorDepth)
+    stride = width * pixelSize
+    raw = zlib.decompress(b"".join(data for tag, data in chunks
+                                   if tag == b"IDAT"))
+    assert len(raw) == height * (stride + 1)
+    rows = []
+    above = bytearray(stride)
+    for row in range(height):
+        filterType = raw[row * (stride + 1)]
+        line = bytearray(raw[row * (stride + 1) + 1:(row + 1) * (stride + 1)])
+        for i in range(stride):
+            a = line[i - pixelSize] if i >= pixelSize else 0
+            b = above[i]
+            c = above[i - pixelSize] if i >= pixelSize else 0
+            predictor = [0, a, b, (a + b) >> 1, paeth(a, b, c)][filterType]
+            line[i] = (line[i] + predictor) & 0xff
+        rows.append(bytes(line))
+        above = line
+    # png's order back to krita's, it's its own inverse
+    data = bytes(pngencoder.toPNGOrder(b"".join(rows), colorDepth))
+    return width, height, colorDepth, data, dict(chunks)
+
+
+def filterModes():
+    if pixelbuffer.available():
+        return ["none", "adaptive"]
+    return ["none"]
+
+
+@pytest.mark.parametrize("colorDepth", ["U8", "U16"])
+@pytest.mark.parametrize("filterMode", filterModes())
+def testEncodeRoundTrip(colorDepth, filterMode):
+    data = randomPixels(1, 37, 23, colorDepth)
+    png = pngencoder.encode(data, 37, 23, colorDepth, 72.0,
+                            filterMode=filterMode)
+    width, height, decodedDepth, decoded, chunks = decode(png)
+    assert (width, height, decodedDepth) == (37, 23, colorDepth)
+    assert decoded == data
+    perMeter = int(round(72.0 / 0.0254))
+    assert chunks[b"pHYs"] == struct.pack(">IIB", perMeter, perMeter, 1)
+
+
+def testStripsMakeOneStream(monkeypatch):
+    # a strip every few rows, so the adler32s have to be combined
+    monkeypatch.setattr(pngencoder, "stripBytes", 200)
+    data = randomPixels(2, 16, 40, "U8")
+    assert len(pngencoder.splitStrips(data, 16, 40, "U8")) > 1
+    assert decode(pngencoder.encode(data, 16, 40, "U8"))[3] == data
+
+
+@pytest.mark.parametrize("filterMode", filterModes())
+def testStreamRoundTrip(tmp_path, filterMode):
+    data = randomPixels(3, 20, 30, "U8")
+    stride = 20 * 4
+    stream = pngencoder.PNGStream(tmp_path.joinpath("s.png"), 20, 30, "U8",
+                                  filterMode=filterMode)
+    # rows given a few at a time, or one at a time
+    for start, end in ((0, 7), (7, 8), (8, 25), (25, 30)):
+        stream.addRows(data[start * stride:end * stride])
+    size = stream.close()
+    png = tmp_path.joinpath("s.png").read_bytes()
+    assert size == len(png)
+    assert decode(png)[3] == data
+
+
+profile = ("sRGB-elle-V2-srgbtrc.icc", bytes(range(256)) * 3)
+
+
+def testColorProfile(tmp_path):
+    data = randomPixels(5, 12, 9, "U8")
+    png = pngencoder.encode(data, 12, 9, "U8", 72.0, iccProfile=profile)
+    assert pngencoder.readIccProfile(png) == profile
+    assert decode(png)[3] == data
+    assert pngencoder.readIccProfile(pngencoder.encode(data, 12, 9, "U8")) \
+        is None
+    stream = pngencoder.PNGStream(tmp_path.joinpath("s.png"), 12, 9, "U8",
+                                  iccProfile=profile)
+    stream.addRows(data)
+    stream.close()
+    assert pngencoder.readIccProfile(
+        tmp_path.joinpath("s.png").read_bytes()) == profile
+
+
+# png only allows 79 latin-1 characters
+def testColorProfileName():
+    png = pngencoder.encode(b"\0" * 4, 1, 1, "U8",
+                            iccProfile=(" " + "\u00e9" * 100, b"icc"))
+    assert pngencoder.readIccProfile(png) == ("\u00e9" * 79, b"icc")
+
+
+def testAbortedStreamLeavesNoFile(tmp_path):
+    path = tmp_path.joinpath("s.png")
+    stream = pngencoder.PNGStream(path, 20, 30, "U8")
+    stream.addRows(randomPixels(4, 20, 10, "U8"))
+    stream.abort()
+    assert not path.exists()
+
+
+def testPoolWritesWhatEncodeWould(tmp_path):
+    images = [(randomPixels(seed, 24, 10 + seed, "U8"), 24, 10 + seed)
+              for seed in range(5)]
+    pool = encoderpool.EncoderPool(2, maxPending=1)
+    try:
+        for i, (data, width, height) in enumerate(images):
+            pool.submit(tmp_path.joinpath(str(i) + ".png"),
+                        data, width, height, "U8", 72.0, iccProfile=profile)
+        written = pool.wait()
+    finally:
+        pool.close()
+    total = 0
+    for i, (data, width, height) in enumerate(images):
+        png = tmp_path.joinpath(str(i) + ".png").read_bytes()
+        assert png == pngencoder.encode(data, width, height, "U8", 72.0,
+                                        iccProfile=profile)
+        total += len(png)
+    assert written == total
+
+
+def testAdler32Combine():
+    first = b"some bytes"
+    second = b"and then some more"
+    assert pngencoder.adler32Combine(
+        zlib.adler32(first), zlib.adler32(second), len(second)) == \
+        zlib.adler32(first + second)
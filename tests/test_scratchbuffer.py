@@ -0,0 +1,87 @@
+import struct
+import zlib
+
+import pytest
+
+import krita
+
+np = pytest.importorskip("numpy")
+
+from spritesheetExporter import pngencoder
+from spritesheetExporter import scratchbuffer
+from spritesheetExporter import spritesheetexporter
+
+
+def testStoredArraysReadBack(tmp_path):
+    scratch = scratchbuffer.ScratchBuffer(1000, tmp_path)
+    first = np.arange(4 * 5 * 4, dtype=np.uint8).reshape(4, 5, 4)
+    second = np.arange(2 * 3 * 4, dtype=np.uint16).reshape(2, 3, 4) * 300
+    storedFirst = scratch.store(first)
+    storedSecond = scratch.store(second)
+    assert storedFirst.shape == first.shape
+    assert storedSecond.dtype == np.uint16
+    assert (storedFirst == first).all() and (storedSecond == second).all()
+    # copies: changing the originals changes nothing
+    first[...] = 0
+    assert storedFirst.any()
+    assert scratch.used == first.nbytes + second.nbytes
+    scratch.close()
+    # still readable as long as they're used
+    assert (storedSecond == np.arange(24).reshape(2, 3, 4) * 300).all()
+
+
+def testFullBuffer(tmp_path):
+    scratch = scratchbuffer.ScratchBuffer(100, tmp_path)
+    scratch.store(np.zeros(60, dtype=np.uint8))
+    with pytest.raises(MemoryError):
+        scratch.store(np.zeros(41, dtype=np.uint8))
+    # what still fits does
+    scratch.store(np.zeros(40, dtype=np.uint8))
+    scratch.close()
+
+
+def testNothingLeftInTheFolder(tmp_path):
+    scratch = scratchbuffer.ScratchBuffer(1 << 20, tmp_path)
+    scratch.store(np.ones((64, 64, 4), dtype=np.uint8))
+    scratch.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+# the filtered rows of a png: the same filters give the same rows,
+# however the compressed data was split
+def filteredRows(png):
+    rows = b""
+    position = len(pngencoder.signature)
+    while position < len(png):
+        length, tag = struct.unpack(">I4s", png[position:position + 8])
+        if tag == b"IDAT":
+            rows += png[position + 8:position + 8 + length]
+        position += 12 + length
+    return zlib.decompress(rows)
+
+
+# frames on disk, or a sheet written a band at a time,
+# give the same sheet as everything in memory
+@pytest.mark.parametrize("settings", [
+    {"scratchFrames": True},
+    {"lowMemory": True},
+    {"lowMemory": True, "scratchFrames": True, "trim": True,
+     "packer": "maxrects"}])
+def testSameSheetFromTheScratchFile(tmp_path, settings):
+    layout = {name: value for name, value in settings.items()
+              if name in ("trim", "packer")}
+    sheets = []
+    for run, runSettings in enumerate((layout, settings)):
+        exporter = spritesheetexporter.SpritesheetExporter()
+        exporter.exportDir = tmp_path.joinpath(str(run))
+        exporter.exportDir.mkdir()
+        exporter.spritesExportDir = exporter.exportDir.joinpath("sprites")
+        exporter.exportName = "s"
+        exporter.compositor = "numpy"
+        exporter.sheetFormat = "png-optimized"
+        for name, value in runSettings.items():
+            setattr(exporter, name, value)
+        assert exporter.export(doc=krita.animatedDocument(64, 48, 10, hold=2))
+        sheets.append(filteredRows(
+            exporter.exportDir.joinpath("s.png").read_bytes()))
+    assert sheets[0] == sheets[1]
@@ -0,0 +1,155 @@
+import struct
+import zlib
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from spritesheetExporter import pngencoder
+from spritesheetExporter import sheetformats
+
+
+# krita's BGRA bytes of an image using these RGBA colors
+def bgraOf(rgba):
+    return np.ascontiguousarray(rgba[:, :, [2, 1, 0, 3]]).tobytes()
+
+
+def pngChunks(png):
+    assert png[:8] == pngencoder.signature
+    chunks = {}
+    position = 8
+    while position < len(png):
+        length, = struct.unpack(">I", png[position:position + 4])
+        tag = png[position + 4:position + 8]
+        chunks[tag] = png[position + 8:position + 8 + length]
+        position += 12 + length
+    return chunks
+
+
+# the RGBA pixels of an indexed png
+def decodeIndexed(png):
+    chunks = pngChunks(png)
+    width, height, bitDepth, colorType = struct.unpack(
+        ">IIBB", chunks[b"IHDR"][:10])
+    assert colorType == 3
+    palette = np.frombuffer(chunks[b"PLTE"], dtype=np.uint8).reshape(-1, 3)
+    alpha = np.full(len(palette), 255, dtype=np.uint8)
+    transparency = np.frombuffer(chunks.get(b"tRNS", b""), dtype=np.uint8)
+    alpha[:len(transparency)] = transparency
+    stride = -(-width * bitDepth // 8)
+    raw = np.frombuffer(zlib.decompress(chunks[b"IDAT"]),
+                        dtype=np.uint8).reshape(height, stride + 1)
+    assert (raw[:, 0] == 0).all()
+    bits = np.unpackbits(raw[:, 1:], axis=1).reshape(height, -1, bitDepth)
+    weights = 1 << np.arange(bitDepth - 1, -1, -1)
+    indices = (bits * weights).sum(axis=2)[:, :width]
+    return np.dstack([palette[indices], alpha[indices]]), bitDepth
+
+
+@pytest.mark.parametrize("colorsNum,bitDepth",
+                         [(2, 1), (4, 2), (11, 4), (200, 8)])
+def testIndexedRoundTrip(colorsNum, bitDepth):
+    generator = np.random.RandomState(colorsNum)
+    # that many different colors, some of them transparent
+    colors = generator.randint(0, 256, (colorsNum, 4)).astype(np.uint8)
+    colors[:, 0] = np.arange(colorsNum)
+    colors[:, 3] = 255
+    colors[:colorsNum // 2, 3] = generator.randint(0, 255, colorsNum // 2)
+    # each of them somewhere in a 9x30 image
+    indices = generator.permutation(np.arange(9 * 30) % colorsNum)
+    rgba = colors[indices].reshape(30, 9, 4)
+    png = sheetformats.encode("png-indexed", bgraOf(rgba), 9, 30, "U8")
+    decoded, decodedBitDepth = decodeIndexed(png)
+    assert decodedBitDepth == bitDepth
+    assert (decoded == rgba).all()
+
+
+def testQuantizeDownTo256Colors():
+    generator = np.random.RandomState(0)
+    rgba = generator.randint(0, 256, (64, 64, 4)).astype(np.uint8)
+    colors, indices = sheetformats.quantize(rgba)
+    assert len(colors) <= 256
+    assert indices.shape == (64, 64)
+    # transparent entries come first
+    assert (np.diff(colors[:, 3].astype(np.int16)) >= 0).all()
+    # and every color stays close to what it was
+    assert np.abs(colors[indices].astype(np.int16) - rgba).max() < 128
+
+
+def testOptimizedIsOurAdaptivePng():
+    rgba = np.random.RandomState(1).randint(0, 256, (10, 12, 4)).astype(
+        np.uint8)
+    data = bgraOf(rgba)
+    assert sheetformats.encode("png-optimized", data, 12, 10, "U8", 72.0) \
+        == pngencoder.encode(data, 12, 10, "U8", 72.0, 9, "adaptive")
+
+
+def testCanEncode():
+    assert sheetformats.canEncode("png-indexed", "RGBA", "U8")
+    assert not sheetformats.canEncode("png-indexed", "RGBA", "U16")
+    assert not sheetformats.canEncode("png-optimized", "GRAYA", "U8")
+    assert not sheetformats.canEncode("jpeg", "RGBA", "U8")
+
+
+# the header fields and the rows of a KTX file
+def decodeKTX(ktx):
+    assert ktx[:12] == b"\xabKTX 11\xbb\r\n\x1a\n"
+    fields = struct.unpack_from("<13I", ktx, 12)
+    assert fields[0] == 0x04030201
+    keyValueBytes = fields[12]
+    keyValue = ktx[64:64 + keyValueBytes]
+    imageSize, = struct.unpack_from("<I", ktx, 64 + keyValueBytes)
+    pixels = ktx[68 + keyValueBytes:]
+    assert len(pixels) == imageSize
+    return fields, keyValue, pixels
+
+
+@pytest.mark.parametrize("sheetFormat", sorted(sheetformats.packedFormats))
+def testKTXHeader(sheetFormat):
+    data = bgraOf(np.zeros((3, 5, 4), dtype=np.uint8))
+    ktx = sheetformats.encode(sheetFormat, data, 5, 3, "U8")
+    fields, keyValue, pixels = decodeKTX(ktx)
+    glType, glTypeSize, glFormat, glInternalFormat = \
+        sheetformats.packedFormats[sheetFormat][1]
+    assert fields[1:5] == (glType, glTypeSize, glFormat, glInternalFormat)
+    # width, height, no depth, not an array, one face, one mipmap
+    assert fields[6:12] == (5, 3, 0, 0, 1, 1)
+    assert b"KTXorientation\x00S=r,T=d\x00" in keyValue
+    assert len(keyValue) % 4 == 0
+    # every row is padded to 4 bytes
+    pixelBytes = 4 if sheetFormat == "rgba8" else 2
+    assert len(pixels) == 3 * (-(-5 * pixelBytes // 4) * 4)
+
+
+def testKTXRoundTrip():
+    rgba = np.random.RandomState(2).randint(0, 256, (4, 7, 4)).astype(
+        np.uint8)
+    data = bgraOf(rgba)
+    pixels = decodeKTX(sheetformats.encode("rgba8", data, 7, 4, "U8"))[2]
+    assert (np.frombuffer(pixels, dtype=np.uint8).reshape(4, 7, 4)
+            == rgba).all()
+    # 16 bits pixels, red in the high bits, rows padded by 2 bytes
+    for sheetFormat, bits in (("rgba4444", (4, 4, 4, 4)),
+                              ("rgb565", (5, 6, 5))):
+        pixels = decodeKTX(sheetformats.encode(
+            sheetFormat, data, 7, 4, "U8"))[2]
+        packed = np.frombuffer(pixels, dtype="<u2").reshape(4, 8)[:, :7]
+        shift = 16
+        for channel, channelBits in enumerate(bits):
+            shift -= channelBits
+            levels = (1 << channelBits) - 1
+            values = (packed >> shift) & levels
+            expected = np.rint(rgba[:, :, channel] * (levels / 255.0))
+            assert (values == expected).all()
+
+
+def testKTXDitheringStaysClose():
+    rgba = np.tile(np.arange(0, 256, 8, dtype=np.uint8)[None, :, None],
+                   (8, 1, 4))
+    data = bgraOf(rgba)
+    plain = sheetformats.packedPixels(data, 32, 8, "rgba4444")
+    dithered = sheetformats.packedPixels(data, 32, 8, "rgba4444", dither=True)
+    assert (plain != dithered).any()
+    difference = ((plain >> 12).astype(np.int16)
+                  - (dithered >> 12).astype(np.int16))
+    assert np.abs(difference).max() <= 1
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+import krita
+
+np = pytest.importorskip("numpy")
+
+from spritesheetExporter import spriteframe
+from spritesheetExporter import spritesheetexporter
+
+
+# a width x height frame, opaque from (x, y) on for w x h pixels
+def frame(width, height, x, y, w, h):
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    pixels[y:y + h, x:x + w] = (10, 20, 30, 255)
+    return spriteframe.SpriteFrame(7, pixels)
+
+
+def testTrimToTheOpaquePixels():
+    sprite = frame(16, 12, 3, 2, 5, 4)
+    source = sprite.pixels
+    sprite.trim()
+    assert (sprite.width, sprite.height) == (5, 4)
+    assert (sprite.offsetX, sprite.offsetY) == (3, 2)
+    assert (sprite.sourceWidth, sprite.sourceHeight) == (16, 12)
+    assert sprite.trimmed
+    assert (sprite.pixels == source[2:6, 3:8]).all()
+    # a copy, so the whole frame can be let go of
+    assert not np.shares_memory(sprite.pixels, source)
+
+
+def testNothingToTrim():
+    sprite = frame(8, 8, 0, 0, 8, 8)
+    source = sprite.pixels
+    sprite.trim()
+    assert not sprite.trimmed
+    assert sprite.pixels is source
+    assert (sprite.offsetX, sprite.offsetY) == (0, 0)
+
+
+def testTransparentFrameKeepsAPixel():
+    sprite = frame(8, 8, 0, 0, 0, 0)
+    sprite.trim()
+    assert (sprite.width, sprite.height) == (1, 1)
+    assert sprite.pixels.shape == (1, 1, 4)
+
+
+def testAtlasFrame():
+    sprite = frame(16, 12, 3, 2, 5, 4)
+    sprite.trim()
+    sprite.x, sprite.y = 40, 8
+    assert sprite.atlasFrame() == {
+        "filename": 7, "frame": {"x": 40, "y": 8, "w": 5, "h": 4}}
+    sprite.rotated = True
+    assert sprite.atlasFrame(withTrimInfo=True) == {
+        "filename": 7,
+        "frame": {"x": 40, "y": 8, "w": 5, "h": 4},
+        "rotated": True,
+        "trimmed": True,
+        "spriteSourceSize": {"x": 3, "y": 2, "w": 5, "h": 4},
+        "sourceSize": {"w": 16, "h": 12}}
+
+
+# the atlas of a trimmed export puts each sprite back where it was
+def testTrimmedExport(tmp_path):
+    exporter = spritesheetexporter.SpritesheetExporter()
+    exporter.exportDir = tmp_path
+    exporter.spritesExportDir = tmp_path.joinpath("sprites")
+    exporter.exportName = "s"
+    exporter.trim = True
+    exporter.writeTextureAtlas = True
+    exporter.atlasFormat = "texturepacker-hash"
+    assert exporter.export(doc=krita.animatedDocument(32, 32, 4))
+    frames = json.loads(tmp_path.joinpath("s.json").read_text())["frames"]
+    # the stand-in draws a 16 pixels square moving 7 right and 3 down
+    for name, entry in frames.items():
+        step = int(name)
+        assert entry["trimmed"]
+        assert entry["frame"]["w"] == entry["frame"]["h"] == 16
+        assert entry["spriteSourceSize"] == {
+            "x": step * 7 % 17, "y": step * 3 % 17, "w": 16, "h": 16}
+        assert entry["sourceSize"] == {"w": 32, "h": 32}
@@ -0,0 +1,206 @@
+import json
+
+import pytest
+
+import krita
+
+from spritesheetExporter import pngencoder
+from spritesheetExporter import sheetcompositor
+from spritesheetExporter import spritesheetexporter
+
+pytest.importorskip("numpy")
+
+
+def exporter(exportDir, **settings):
+    exporter = spritesheetexporter.SpritesheetExporter()
+    exporter.exportDir = exportDir
+    exporter.exportName = "s"
+    exporter.spritesExportDir = exportDir.joinpath("sprites")
+    exporter.writeTextureAtlas = True
+    for name, value in settings.items():
+        setattr(exporter, name, value)
+    return exporter
+
+
+def files(directory):
+    return {path.name: path.read_bytes() for path in directory.iterdir()}
+
+
+# three 64 pixels wide pages, and one more at half the size
+pagesSettings = {"compositor": "numpy", "maxSheetSize": 64, "scales": [0.5],
+                 "incremental": True}
+
+
+def testCancelledExportKeepsTheLastOne(tmp_path):
+    exporter(tmp_path, **pagesSettings).export(
+        doc=krita.animatedDocument(32, 32, 12))
+    before = files(tmp_path)
+    assert {"s.json", "s_0.png", "s_2.png", "s@0.5x.png",
+            "s.manifest.json"} <= set(before)
+
+    cancelling = exporter(tmp_path, **pagesSettings)
+
+    # once the first page is written
+    def cancelOnSecondPage(stage, done, total):
+        if stage == "write" and done == 1:
+            cancelling.cancel()
+
+    cancelling.onProgress = cancelOnSecondPage
+    assert not cancelling.export(
+        doc=krita.animatedDocument(32, 32, 12, hold=3))
+    # no part file left, and the last export's files as they were
+    assert files(tmp_path) == before
+
+
+def testPartFilesTakeTheirPlace(tmp_path):
+    assert exporter(tmp_path, **pagesSettings).export(
+        doc=krita.animatedDocument(32, 32, 12))
+    assert not any(".part" in name for name in files(tmp_path))
+    assert exporter(tmp_path, **pagesSettings).export(
+        doc=krita.animatedDocument(32, 32, 12, hold=3))
+    assert not any(".part" in name for name in files(tmp_path))
+
+
+# the pngs we write ourselves have the document's profile, like krita's
+@pytest.mark.parametrize("settings", [
+    {"sheetFormat": "png-optimized"},
+    {"sheetFormat": "png-indexed"},
+    {"lowMemory": True},
+    {"captureInMemory": True, "removeTmp": False, "framesInFlight": 2}])
+def testColorProfileIsKept(tmp_path, settings):
+    doc = krita.animatedDocument(16, 16, 4)
+    doc.profile = "a profile"
+    assert exporter(tmp_path, compositor="numpy", **settings).export(doc=doc)
+    pngs = list(tmp_path.rglob("*.png"))
+    assert pngs
+    for path in pngs:
+        assert pngencoder.readIccProfile(path.read_bytes()) == \
+            ("a profile", krita.iccData("a profile"))
+
+
+# a keyframe every 3 frames at 24 fps: each one is rendered once
+# and shown for 125ms
+def testKeyframesOnlyDurations(tmp_path):
+    export = exporter(tmp_path, keyframesOnly=True, traceExport=True)
+    assert export.export(doc=krita.animatedDocument(32, 32, 12, hold=3))
+    assert export.trace.counters["frames rendered"] == 4
+    frames = json.loads(tmp_path.joinpath("s.json").read_text())["frames"]
+    assert [(frame["filename"], frame["duration"]) for frame in frames] == \
+        [(0, 125), (3, 125), (6, 125), (9, 125)]
+
+
+# an animation starts on its own frame, even in the middle of a hold,
+# and a held frame counts for as many of the animation's steps
+def testKeyframesOnlyAnimationDurations(tmp_path):
+    assert exporter(tmp_path, keyframesOnly=True,
+                    animations=[("a", 0, 11, 1), ("b", 4, 10, 2)]).export(
+        doc=krita.animatedDocument(32, 32, 12, hold=3))
+    atlas = json.loads(tmp_path.joinpath("s.json").read_text())
+    assert [frame["filename"] for frame in atlas["frames"]] == [0, 3, 4, 6, 9]
+    assert atlas["animations"] == {
+        "a": [{"filename": 0, "duration": 125}, {"filename": 3, "duration": 42},
+              {"filename": 4, "duration": 83}, {"filename": 6, "duration": 125},
+              {"filename": 9, "duration": 125}],
+        "b": [{"filename": 4, "duration": 83}, {"filename": 6, "duration": 167},
+              {"filename": 9, "duration": 83}]}
+
+
+# only the changed sprites go on the last export's page,
+# read back from where it was renamed to
+def testIncrementalExportPatchesThePage(tmp_path, monkeypatch):
+    settings = {"compositor": "numpy", "incremental": True,
+                "sheetFormat": "png-optimized"}
+    doc = krita.animatedDocument(32, 32, 8, hold=2)
+    assert exporter(tmp_path, **settings).export(doc=doc)
+    render = doc.renderer
+
+    def changed(time):
+        data = bytearray(render(time))
+        if time // 2 == 1:
+            data[-4:] = b"\x01\x02\x03\xff"
+        return bytes(data)
+
+    doc.renderer = changed
+    loaded = []
+    load = sheetcompositor.load
+
+    def recordedLoad(path, colorDepth):
+        compositor = load(path, colorDepth)
+        loaded.append((path.name, compositor is not None))
+        return compositor
+
+    monkeypatch.setattr(sheetcompositor, "load", recordedLoad)
+    assert exporter(tmp_path, **settings).export(doc=doc)
+    assert loaded == [("s.png", True)]
+    patched = tmp_path.joinpath("s.png").read_bytes()
+    # the same as exporting everything again
+    assert exporter(tmp_path, **dict(settings, incremental=False)).export(
+        doc=doc)
+    assert tmp_path.joinpath("s.png").read_bytes() == patched
+
+
+# the pixels of a sheet's cell
+def cell(sheet, x, y, width, height):
+    data, sheetWidth, sheetHeight, depth = sheet
+    size = krita.pixelSizes[depth]
+    return b"".join(
+        data[((y + row) * sheetWidth + x) * size:
+             ((y + row) * sheetWidth + x + width) * size]
+        for row in range(height))
+
+
+# krita's layers or the numpy compositor, each frame in its cell
+@pytest.mark.parametrize("compositor", ["layers", "numpy"])
+@pytest.mark.parametrize("horizontal", [True, False])
+def testEachFrameInItsCell(tmp_path, compositor, horizontal):
+    doc = krita.animatedDocument(16, 8, 5)
+    assert exporter(tmp_path, compositor=compositor,
+                    isDirectionHorizontal=horizontal).export(doc=doc)
+    atlas = json.loads(tmp_path.joinpath("s.json").read_text())
+    # 3 columns and 2 rows, filled a row or a column at a time
+    assert atlas["meta"]["size"] == {"w": 48, "h": 16}
+    sheet = krita.readPNG(tmp_path.joinpath("s.png"))
+    for num, frame in enumerate(atlas["frames"]):
+        assert frame["filename"] == num
+        position = frame["frame"]
+        assert (position["x"], position["y"]) == (
+            (num % 3 * 16, num // 3 * 8) if horizontal
+            else (num // 2 * 16, num % 2 * 8))
+        assert cell(sheet, position["x"], position["y"], 16, 8) == \
+            doc.renderer(num)
+
+
+def testStepAndRange(tmp_path):
+    assert exporter(tmp_path, start=2, end=9, step=3).export(
+        doc=krita.animatedDocument(8, 8, 12))
+    atlas = json.loads(tmp_path.joinpath("s.json").read_text())
+    assert [frame["filename"] for frame in atlas["frames"]] == [2, 5, 8]
+
+
+# frames held for 2 are written once, and share their rect
+@pytest.mark.parametrize("compositor", ["layers", "numpy"])
+def testDuplicatesShareTheirRect(tmp_path, compositor):
+    assert exporter(tmp_path, compositor=compositor, end=5,
+                    removeDuplicates=True).export(
+        doc=krita.animatedDocument(8, 8, 6, hold=2))
+    frames = json.loads(tmp_path.joinpath("s.json").read_text())["frames"]
+    rects = {frame["filename"]: frame["frame"] for frame in frames}
+    assert sorted(rects) == list(range(6))
+    for num in (1, 3, 5):
+        assert rects[num] == rects[num - 1]
+    assert len({tuple(rect.values()) for rect in rects.values()}) == 3
+
+
+# the visible layers are the frames, and stay as they were
+def testLayersAsAnimation(tmp_path):
+    doc = krita.Document(4, 4)
+    for num in range(4):
+        layer = doc.createNode("layer" + str(num), "paintlayer")
+        layer.setPixelData(bytes([num * 50, 0, 0, 255]) * 16, 0, 0, 4, 4)
+        layer.setVisible(num != 2)
+        doc.root.addChildNode(layer, None)
+    assert exporter(tmp_path, layersAsAnimation=True).export(doc=doc)
+    frames = json.loads(tmp_path.joinpath("s.json").read_text())["frames"]
+    assert [frame["filename"] for frame in frames] == [0, 1, 3]
+    assert [layer.visible() for layer in doc.topLevelNodes()] == \
+        [True, True, False, True]